@@ -14,14 +14,29 @@ python ~/code/Misc/CalculatePersonalVelocity.py 1
 - Week before last
 python ~/code/Misc/CalculatePersonalVelocity.py 2
 
+- Trend over the last 13 weeks (one icalBuddy call)
+python ~/code/Misc/CalculatePersonalVelocity.py --weeks 13
+
+- Trend between two dates
+python ~/code/Misc/CalculatePersonalVelocity.py --from 01/02/2023 --to 03/31/2023
+
+- Free slots of the current week
+python ~/code/Misc/CalculatePersonalVelocity.py --free-slots
+
+- Recompute cached past weeks (e.g. after editing old calendar entries)
+python ~/code/Misc/CalculatePersonalVelocity.py --weeks 13 --refresh-cache
+
+- Read an .ics export or CalDAV sync directory instead of icalBuddy
+python ~/code/Misc/CalculatePersonalVelocity.py --ics ~/calendars/work 1
+
 """
 
 from __future__ import print_function
 from __future__ import division
-from subprocess import check_output
+import argparse
 import datetime
-import sys
-from tabulate import tabulate
+import instrument
+from meetingintervals import day_usage, format_slot
 
 __author__ = "Ben Mason"
 __copyright__ = "Copyright 2017"
@@ -31,6 +46,8 @@ __status__ = "Production"
 
 DATEFORMAT = '%m/%d/%Y'
 DAYLENGTH = 9
+# Start of the working day, free slots are looked for up to DAYLENGTH later
+WORKDAYSTART = "08:00"
 DAYSINWEEK = 5
 TOTALHOURS = DAYLENGTH * DAYSINWEEK
 #Daily Adjust in Mins
@@ -42,6 +59,21 @@ IGNOREEVENTS = ["FW: Managed Services Daily Operations Call",
                 "Network Huddle (with recording option)"]
 DAYSOFWEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
 ICALBUDDYLOC = "/usr/local/bin/icalbuddy"
+# Seconds before a hung icalBuddy is killed
+ICALBUDDYTIMEOUT = 60
+# Calendar data icalBuddy reads, cached results are reused while it is unchanged
+ICALBUDDYSOURCES = ["~/Library/Calendars"]
+# .ics file or directory to use instead of icalBuddy, None for icalBuddy
+ICSSOURCE = None
+# Index of the .ics events, None for icsstore's default
+ICSSTORELOC = None
+# Results of completed weeks, keyed by week and the settings above;
+# None for velocitycache's defaults
+VELOCITYCACHELOC = None
+VELOCITYCACHEWEEKS = None
+USAGECATEGORIES = ['work', 'admin', 'focus', 'free']
+# Replaced by main() when --profile is given
+PROFILER = instrument.NULL_PROFILER
 
 
 def datesofweek(weekdelta=0):
@@ -50,139 +82,302 @@ def datesofweek(weekdelta=0):
     weekdelta = weekdelta * 7
 
     day = datetime.date.today()
-    datetoday = datetime.datetime.strptime(day.strftime(DATEFORMAT), DATEFORMAT)
+    # Midnight of today, without strptime's import and regex compile
+    datetoday = datetime.datetime.combine(day, datetime.time())
     start = datetoday - datetime.timedelta(days=datetoday.weekday() + weekdelta)
     end = start + datetime.timedelta(days=DAYSINWEEK-1)
     return day, start, end
 
-def timelength(timerange):
-    """ Calculate length of meeting """
-    try:
-        startime, stoptime = timerange.split(" - ")
-    except ValueError:
-        print ("ERROR: Entry \'" + timerange + "\' problem returning 0")
-        return 0
-    thetime1 = datetime.datetime.strptime(startime, '%H:%M')
-    thetime2 = datetime.datetime.strptime(stoptime, '%H:%M')
-    length = thetime2 - thetime1
-    lengthmins = length.seconds/60
+def datesofweeks(weeks, weekdelta=0):
+    """ Monday of the first and Friday of the last of a run of weeks """
+
+    _, _, end = datesofweek(weekdelta)
+    _, start, _ = datesofweek(weekdelta + weeks - 1)
+    return start, end
 
-    return lengthmins
+def weekkey(date):
+    """ ISO year and week a date belongs to """
 
-def geticaldata(weekdelta=0):
-    """ Run icalBuddy and return list of data """
-    _, monday, friday = datesofweek(weekdelta)
+    isodate = date.isocalendar()
+    return isodate[0], isodate[1]
 
-    daterange = "eventsFrom:" + monday.strftime(DATEFORMAT) + \
-        " to:" + friday.strftime(DATEFORMAT)
+def weeklabel(key):
+    """ 2022-W40 style label of a weekkey """
+
+    return f"{key[0]}-W{key[1]:02d}"
+
+def geticaldata(weekdelta=0, start=None, end=None, ics=None, timeout=ICALBUDDYTIMEOUT):
+    """
+    Run icalBuddy (killed after timeout seconds) or read the ics store,
+    return the (summary, start, end) events
+    """
+    if start is None or end is None:
+        _, monday, friday = datesofweek(weekdelta)
+    else:
+        monday, friday = start, end
+
+    if ics:
+        # Only .ics runs need the store
+        import icsstore # pylint: disable=import-outside-toplevel
+        with PROFILER.phase('parse'):
+            events = icsstore.read_ics_occurrences(ics, monday.date(), friday.date(),
+                                                   ICSSTORELOC or icsstore.ICS_STORE_FILENAME)
+        PROFILER.count('records', len(events))
+        return events
+
+    # Only icalBuddy runs start a process
+    import cmdrunner # pylint: disable=import-outside-toplevel
 
     icalbuddycommand = [ICALBUDDYLOC,
                         "-npn",
                         "-ea",
                         "-nc",
-                        "-ps ' ~ '",
-                        "-df %m/%d/%Y",
-                        "-tf %H:%M",
-                        "-eep 'url,location,notes,attendees'",
-                        "-b ''",
-                        "-ic 'Calendar'",
-                        daterange,
-                        "| uniq"] # using uniq to overcome and macOS bug
+                        "-ps", " ~ ",
+                        "-df", "%m/%d/%Y",
+                        "-tf", "%H:%M",
+                        "-eep", "url,location,notes,attendees",
+                        "-b", "",
+                        "-ic", "Calendar",
+                        "eventsFrom:" + monday.strftime(DATEFORMAT),
+                        "to:" + friday.strftime(DATEFORMAT)]
+
+    # Same query with unchanged calendars is answered from memory
+    with PROFILER.phase('subprocess'):
+        icalbuddyout = cmdrunner.run(icalbuddycommand, timeout=timeout,
+                                     cache=cmdrunner.SESSION_CACHE,
+                                     sources=ICALBUDDYSOURCES).stdout
+    PROFILER.count('bytes', len(icalbuddyout))
+    # Drop repeated lines (a macOS bug) like uniq used to
+    rawlist = cmdrunner.dedupe_adjacent(icalbuddyout).split('\n')
+    PROFILER.count('records', len(rawlist))
+
+    return list(icalbuddyentries(rawlist))
+
+def parseicaldate(date):
+    """ Turn an icalBuddy date (or relative day name) into a datetime """
+
+    relativedays = {
+        'today': 0,
+        'yesterday': -1,
+        'tomorrow': 1,
+        'day after tomorrow': 2,
+        'day before yesterday': -2
+    }
+
+    if date in relativedays:
+        day = datetime.date.today() + datetime.timedelta(days=relativedays[date])
+        return datetime.datetime.strptime(day.strftime(DATEFORMAT), DATEFORMAT)
+
+    # 08/11/2017 at 10:00 - 10:30
+    # currdate = datetime.datetime.strptime(date, '%b %d, %Y')
+    return datetime.datetime.strptime(date, DATEFORMAT)
+
+def emptyweek():
+    """ Per day work, admin and focus (zero) and free minutes of a week without events """
+
+    return ({item: 0 for item in DAYSOFWEEK},
+            {item: 0 for item in DAYSOFWEEK},
+            {item: 0 for item in DAYSOFWEEK},
+            {item: DAYLENGTH * 60 for item in DAYSOFWEEK})
+
+def eventcategory(event):
+    """ work, admin or focus for an event name, None if it is ignored """
+
+    if event in IGNOREEVENTS:
+        return None
+    if event in ADMINMEETINGS:
+        return 'admin'
+    if event in FOCUSTIME:
+        return 'focus'
+    return 'work'
+
+def icalbuddyentries(rawlist):
+    """ Turn ical Buddy lines into (summary, start, end) events """
+
+    for line in rawlist:
+        # print line
+        if line != "":
+            #print(line)
+            # The date part never holds a ~, the summary may
+            event, thedatetime = line.rsplit('~', 1)
+
+            # 08/11/2017 at 10:00 - 10:30
+            # print (event, thedatetime)
+            date, timerange = thedatetime.split(' at ')
+            try:
+                startime, stoptime = timerange.split(" - ")
+            except ValueError:
+                print ("ERROR: Entry \'" + timerange + "\' problem skipping")
+                continue
+
+            currdate = parseicaldate(date)
+            start = datetime.datetime.combine(currdate.date(), \
+                datetime.datetime.strptime(startime, '%H:%M').time())
+            end = datetime.datetime.combine(currdate.date(), \
+                datetime.datetime.strptime(stoptime, '%H:%M').time())
+            # Ends before it starts: the event runs past midnight, equal
+            # times are a zero length entry
+            if end < start:
+                end += datetime.timedelta(days=1)
+
+            yield event, start, end
+
+def categorizedevents(entries):
+    """ Turn (summary, start, end) events into (category, start, end), ignored ones dropped """
+
+    for event, start, end in entries:
+        category = eventcategory(event)
+        if category is not None:
+            yield category, start, end
+
+def icalevents(rawlist):
+    """ Turn ical Buddy lines into (category, start, end) events """
+
+    return categorizedevents(icalbuddyentries(rawlist))
+
+def workwindow():
+    """ Working day as (start, end) seconds since midnight """
+
+    hours, minutes = WORKDAYSTART.split(':')
+    start = int(hours) * 3600 + int(minutes) * 60
+    return start, start + DAYLENGTH * 3600
+
+def emptyusage():
+    """ Per day minutes of a week without events """
+
+    usage = {category: {item: 0 for item in DAYSOFWEEK} for category in USAGECATEGORIES}
+    usage['free'] = {item: DAYLENGTH * 60 for item in DAYSOFWEEK}
+    return usage
+
+def weekusage(entries):
+    """
+    Process (summary, start, end) events into per ISO week day minutes of
+    work, admin, focus and free time, overlapping events counted once
+    """
+
+    weeks = {}
+
+    with PROFILER.phase('aggregate'):
+        days = day_usage(categorizedevents(entries), window=workwindow())
+
+    for day, usage in days.items():
+        # Weekend events are outside the tracked work week
+        if day.weekday() >= len(DAYSOFWEEK):
+            continue
+
+        week = weeks.setdefault(weekkey(day), emptyusage())
+        for category in USAGECATEGORIES:
+            week[category][DAYSOFWEEK[day.weekday()]] = usage[category]
+
+    return weeks
+
+def weektotals(usage):
+    """ (workdaily, admindaily, focusdaily, freedaily) of a week's usage """
 
-    icalbuddyout = check_output(' '.join(icalbuddycommand), shell=True)
-    icalbuddyout = icalbuddyout.decode('UTF-8')
-    rawlist = icalbuddyout.split('\n')
+    return usage['work'], usage['admin'], usage['focus'], usage['free']
 
-    return rawlist
+def processicaldata_by_week(rawlist):
+    """ Process a list of ical Buddy Data into per ISO week day totals """
+
+    return {key: weektotals(usage) for key, usage in
+            weekusage(icalbuddyentries(rawlist)).items()}
+
+def weekcache():
+    """ Open the cache of completed weeks """
+
+    # Runs without the cache skip loading it
+    import velocitycache # pylint: disable=import-outside-toplevel
+
+    return velocitycache.WeekCache(VELOCITYCACHELOC or velocitycache.WEEK_CACHE_FILENAME,
+                                   VELOCITYCACHEWEEKS or velocitycache.WEEK_CACHE_MAX_WEEKS)
+
+def cacheconfig(ics=None):
+    """ Hash of everything that decides a week's result """
+
+    from velocitycache import config_hash # pylint: disable=import-outside-toplevel
+
+    return config_hash(ADMINMEETINGS, FOCUSTIME, IGNOREEVENTS, DAILYADJUST,
+                       WORKDAYSTART, DAYLENGTH, ics or ICALBUDDYLOC)
+
+def velocityweeks(start, end, ics=None, cache=None, refresh=False, timeout=ICALBUDDYTIMEOUT):
+    """
+    Per ISO week usage of start to end; completed weeks come from the
+    cache when possible and everything else from one calendar query
+    """
+
+    _, thismonday, _ = datesofweek()
+    mondays = []
+    monday = start - datetime.timedelta(days=start.weekday())
+    while monday <= end:
+        mondays.append(monday)
+        monday += datetime.timedelta(days=7)
+
+    # Only whole weeks before the current one are fixed
+    fixed = {weeklabel(weekkey(monday)): monday for monday in mondays
+             if monday >= start and monday < thismonday and
+             monday + datetime.timedelta(days=DAYSINWEEK-1) <= end}
+
+    config = cacheconfig(ics) if cache is not None else None
+    cached = cache.load(list(fixed), config) if cache is not None and not refresh else {}
+    weeks = {weekkey(fixed[label]): usage for label, usage in cached.items()}
+    PROFILER.count('cached weeks', len(cached))
+
+    needed = [monday for monday in mondays if weeklabel(weekkey(monday)) not in cached]
+    if needed:
+        fetchstart = max(start, needed[0])
+        fetchend = min(end, needed[-1] + datetime.timedelta(days=DAYSINWEEK-1))
+        computed = weekusage(geticaldata(start=fetchstart, end=fetchend, ics=ics,
+                                           timeout=timeout))
+        for monday in needed:
+            weeks[weekkey(monday)] = computed.get(weekkey(monday), emptyusage())
+
+        if cache is not None:
+            cache.save({label: weeks[weekkey(monday)] for label, monday in fixed.items()
+                        if label not in cached}, config)
+
+    return weeks
 
 def processicaldata(rawlist):
     """ Process a list of ical Buddy Data """
 
-    today, _, _ = datesofweek()
+    weeks = processicaldata_by_week(rawlist)
+    if not weeks:
+        return emptyweek()
 
-    workdaily = {}
-    for item in DAYSOFWEEK:
-        workdaily[item] = 0
+    totals = tuple({item: 0 for item in DAYSOFWEEK} for _ in USAGECATEGORIES)
+    for week in weeks.values():
+        for total, weekdaily in zip(totals, week):
+            for item in DAYSOFWEEK:
+                total[item] += weekdaily[item]
 
-    admindaily = {}
-    for item in DAYSOFWEEK:
-        admindaily[item] = 0
+    return totals
 
-    focusdaily = {}
-    for item in DAYSOFWEEK:
-        focusdaily[item] = 0
 
-    for line in rawlist:
-        # print line
-        if line != "":
-            #print(line)
-            event, thedatetime = line.split('~')
-            if event not in IGNOREEVENTS:
-                # 08/11/2017 at 10:00 - 10:30
-                # print (event, thedatetime)
-                date, timerange = thedatetime.split(' at ')
-                if date == 'today':
-                    currdate = datetime.datetime.strptime(today.strftime(DATEFORMAT),
-                                                          DATEFORMAT)
-                elif date == 'yesterday':
-                    yesterday = datetime.date.today() + datetime.timedelta(days=-1)
-                    currdate = datetime.datetime.strptime(yesterday.strftime(DATEFORMAT),
-                                                          DATEFORMAT)
-                elif date == 'tomorrow':
-                    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
-                    currdate = datetime.datetime.strptime(tomorrow.strftime(DATEFORMAT),
-                                                          DATEFORMAT)
-                elif date == 'day after tomorrow':
-                    tomorrow = datetime.date.today() + datetime.timedelta(days=2)
-                    currdate = datetime.datetime.strptime(tomorrow.strftime(DATEFORMAT),
-                                                          DATEFORMAT)
-                elif date == 'day before yesterday':
-                    tomorrow = datetime.date.today() + datetime.timedelta(days=-2)
-                    currdate = datetime.datetime.strptime(tomorrow.strftime(DATEFORMAT),
-                                                          DATEFORMAT)
-                else:
-                    # 08/11/2017 at 10:00 - 10:30
-                    # currdate = datetime.datetime.strptime(date, '%b %d, %Y')
-                    currdate = datetime.datetime.strptime(date, DATEFORMAT)
-
-                if event in ADMINMEETINGS:
-                    admindaily[DAYSOFWEEK[currdate.weekday()]] \
-                    += timelength(timerange)
-                elif event in FOCUSTIME:
-                    focusdaily[DAYSOFWEEK[currdate.weekday()]] \
-                    += timelength(timerange)
-                else:
-                    workdaily[DAYSOFWEEK[currdate.weekday()]] \
-                    += timelength(timerange)
-
-    return workdaily, admindaily, focusdaily
-
-
-def printvelocitystats(workdaily, admindaily, focusdaily):
-    """ Display ther Velicty Stats """
+def velocitystats(workdaily, admindaily, focusdaily, freedaily):
+    """
+    Calculate per day rows and week totals (in hours); free time is the
+    uncovered part of the working day, as in the free slot report
+    """
     totalvelocity = 0
     admintotal = 0
     worktotal = 0
     focustotal = 0
-    focus = 0
+    freetotal = 0
 
-    dailyheader = ["Day of Week", "Work", "Admin", "Focus", "Total", "Free"]
     dailyrows = []
 
     for item in DAYSOFWEEK:
         # need daily adjust to account for re-occuring tentatives
         work = (workdaily[item] - DAILYADJUST)/60
-        if work != 0:
-            admin = admindaily[item]/60
-            focus = (focusdaily[item] - DAILYADJUST)/60
-        else:
-            admin = 0
+        admin = admindaily[item]/60
+        focus = (focusdaily[item] - DAILYADJUST)/60
+        free = freedaily[item]/60
 
         admintotal += admin
         worktotal += work
         focustotal += focus
+        freetotal += free
         dailytotal = admin + work + focus
-        free = DAYLENGTH - dailytotal
         totalvelocity += dailytotal
 
         dailyrows.append([item, round(work, DECIMAL_PRECISION), admin, \
@@ -190,28 +385,175 @@ def printvelocitystats(workdaily, admindaily, focusdaily):
             round(dailytotal, DECIMAL_PRECISION), \
             round(free, DECIMAL_PRECISION)])
 
-    print (tabulate(dailyrows, dailyheader, tablefmt="fancy_grid"))
-    print (tabulate([["Work Total", round(worktotal, DECIMAL_PRECISION)],
-                     ["Admin Total", admintotal],
-                     ["Focus Total", focustotal],
-                     ["Total Hours", round(totalvelocity, DECIMAL_PRECISION)],
-                     ["Percent Usage", \
-                     str(round((totalvelocity/TOTALHOURS)*100,DECIMAL_PRECISION)) + " %"],
-                     ["Free Time Available", round(TOTALHOURS-(totalvelocity), \
-                         DECIMAL_PRECISION)]]))
+    totals = {
+        'work': worktotal,
+        'admin': admintotal,
+        'focus': focustotal,
+        'total': totalvelocity,
+        'usage': (totalvelocity/TOTALHOURS)*100,
+        'free': freetotal
+    }
+
+    return dailyrows, totals
+
+def formatvelocitystats(workdaily, admindaily, focusdaily, freedaily):
+    """ Ther Velicty Stats as text """
+
+    from tabulate import tabulate # pylint: disable=import-outside-toplevel
+
+    dailyheader = ["Day of Week", "Work", "Admin", "Focus", "Total", "Free"]
+    dailyrows, totals = velocitystats(workdaily, admindaily, focusdaily, freedaily)
+
+    return tabulate(dailyrows, dailyheader, tablefmt="fancy_grid") + "\n" + \
+        tabulate([["Work Total", round(totals['work'], DECIMAL_PRECISION)],
+                  ["Admin Total", totals['admin']],
+                  ["Focus Total", totals['focus']],
+                  ["Total Hours", round(totals['total'], DECIMAL_PRECISION)],
+                  ["Percent Usage", \
+                  str(round(totals['usage'], DECIMAL_PRECISION)) + " %"],
+                  ["Free Time Available", round(totals['free'], \
+                      DECIMAL_PRECISION)]])
+
+def printvelocitystats(workdaily, admindaily, focusdaily, freedaily):
+    """ Display ther Velicty Stats """
+
+    with PROFILER.phase('render'):
+        print (formatvelocitystats(workdaily, admindaily, focusdaily, freedaily))
+
+def velocityreport(weekdelta=0, ics=ICSSOURCE, usecache=True, timeout=ICALBUDDYTIMEOUT):
+    """
+    One week's velocity stats as text, for callers such as the dashboard;
+    timeout bounds the calendar query
+    """
+
+    cache = weekcache() if usecache else None
+    try:
+        _, monday, friday = datesofweek(weekdelta)
+        weeks = velocityweeks(monday, friday, ics, cache, timeout=timeout)
+        return formatvelocitystats(*weektotals(weeks[weekkey(monday)]))
+    finally:
+        if cache is not None:
+            cache.close()
+
+def printvelocitytrend(weeks, start, end):
+    """ Display one row per week plus range totals and averages """
+
+    from tabulate import tabulate # pylint: disable=import-outside-toplevel
+
+    trendheader = ["Week", "Work", "Admin", "Focus", "Total", "Percent Usage", "Free"]
+    columns = ['work', 'admin', 'focus', 'total', 'usage', 'free']
+    trendrows = []
+    sums = dict.fromkeys(columns, 0)
+
+    # Every week of the range gets a row, weeks without events included
+    monday = start - datetime.timedelta(days=start.weekday())
+    weekcount = 0
+    while monday <= end:
+        key = weekkey(monday)
+        _, totals = velocitystats(*weeks.get(key, emptyweek()))
+        for column in columns:
+            sums[column] += totals[column]
+        trendrows.append([f"{weeklabel(key)} ({monday.strftime(DATEFORMAT)})"] +
+                         [round(totals[column], DECIMAL_PRECISION) for column in columns])
+        weekcount += 1
+        monday += datetime.timedelta(days=7)
+
+    trendrows.append(["Total"] + [round(sums[column], DECIMAL_PRECISION)
+                                  for column in columns])
+    trendrows.append(["Average"] + [round(sums[column] / max(weekcount, 1), DECIMAL_PRECISION)
+                                    for column in columns])
+    trendrows[-2][5] = ""
+
+    with PROFILER.phase('render'):
+        print (tabulate(trendrows, trendheader, tablefmt="fancy_grid"))
+
+def printfreeslots(entries, start, end):
+    """ Display the free slots of every work day between start and end """
+
+    from tabulate import tabulate # pylint: disable=import-outside-toplevel
+
+    window = workwindow()
+    usage = day_usage(categorizedevents(entries), window=window)
+    slotrows = []
+
+    day = start.date()
+    while day <= end.date():
+        if day.weekday() < len(DAYSOFWEEK):
+            slots = usage[day]['free_slots'] if day in usage else [window]
+            slotrows.append([DAYSOFWEEK[day.weekday()] + " " + day.strftime(DATEFORMAT),
+                             ", ".join(format_slot(slot) for slot in slots),
+                             round(sum(stop - begin for begin, stop in slots) / 3600,
+                                   DECIMAL_PRECISION)])
+        day += datetime.timedelta(days=1)
+
+    print (tabulate(slotrows, ["Day", "Free Slots", "Free"], tablefmt="fancy_grid"))
 
 def main():
     """ Main Processing """
 
-    if len(sys.argv) > 1:
-        # Positive number backwards
-        weekdelta = int(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Calculate personal velocity from icalBuddy')
+    # Positive number backwards
+    parser.add_argument('weekdelta', nargs='?', type=int, default=0,
+                        help='weeks back from the current week')
+    parser.add_argument('--weeks', type=int,
+                        help='trend over this many weeks ending with weekdelta')
+    parser.add_argument('--from', dest='fromdate',
+                        help='trend start date (' + DATEFORMAT.replace('%', '') + ')')
+    parser.add_argument('--to', dest='todate',
+                        help="trend end date, defaults to this week's Friday")
+    parser.add_argument('--ics', default=ICSSOURCE,
+                        help='.ics file or directory of them to read instead of icalBuddy')
+    parser.add_argument('--free-slots', action='store_true',
+                        help='list the free slots of each work day')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='compute every week live, leaving the week cache alone')
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='recompute the requested past weeks and update the cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='drop every cached week first')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.todate and not args.fromdate:
+        parser.error("--to needs --from")
+    if args.fromdate and (args.weeks or args.weekdelta):
+        parser.error("--from/--to give the range, they cannot be combined with "
+                     "--weeks or weekdelta")
+
+    global PROFILER # pylint: disable=global-statement
+    PROFILER = instrument.from_args('velocity', args)
+
+    cache = None if args.no_cache else weekcache()
+    if cache is not None and args.clear_cache:
+        cache.invalidate()
+
+    if args.fromdate:
+        start = datetime.datetime.strptime(args.fromdate, DATEFORMAT)
+        end = datetime.datetime.strptime(args.todate, DATEFORMAT) if args.todate \
+            else datesofweek()[2]
+    elif args.weeks:
+        start, end = datesofweeks(args.weeks, args.weekdelta)
     else:
-        weekdelta=0
+        start, end = None, None
 
-    icaldata = geticaldata(weekdelta)
-    workdata, admindata, focusdaily = processicaldata(icaldata)
-    printvelocitystats(workdata, admindata, focusdaily)
+    try:
+        if start is None:
+            _, monday, friday = datesofweek(args.weekdelta)
+            weeks = velocityweeks(monday, friday, args.ics, cache, args.refresh_cache)
+            printvelocitystats(*weektotals(weeks[weekkey(monday)]))
+            if args.free_slots:
+                printfreeslots(geticaldata(args.weekdelta, ics=args.ics), monday, friday)
+            return
+
+        weeks = velocityweeks(start, end, args.ics, cache, args.refresh_cache)
+        printvelocitytrend({key: weektotals(usage) for key, usage in weeks.items()},
+                           start, end)
+        if args.free_slots:
+            printfreeslots(geticaldata(start=start, end=end, ics=args.ics), start, end)
+    finally:
+        if cache is not None:
+            cache.close()
+        PROFILER.finish()
 
 if __name__ == "__main__":
     main()
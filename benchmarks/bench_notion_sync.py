@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+'''
+Benchmark the Notion project sync (notionsync.py) against the local Notion stand-in
+
+For every size a synthetic OmniFocus export is generated and synced three
+times: a full sync into an empty workspace, a no-op re-sync (local state
+only) and a --full re-check (database scan, no writes). Wall time, request
+count and peak RSS are recorded for each run.
+
+Usage:
+python benchmarks/bench_notion_sync.py --sizes 1000 10000 50000 --output results.json
+'''
+
+import argparse
+import contextlib
+import csv
+import importlib
+import io
+import json
+import os
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import urllib.request
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Development"
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STANDIN_SCRIPT = os.path.join(REPO_DIR, 'notion_standin.py')
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+SCENARIOS = [('full sync', []), ('no-op re-sync', []), ('full re-check', ['--full'])]
+
+OF_STATUSES = [("active status", 70), ("on hold status", 10), ("done status", 15),
+               ("dropped status", 5)]
+OF_RELMS = [("Personal", 25), ("HouseHold", 10), ("Projects", 10), ("Education", 5),
+            ("Work", 40), ("Personal Projects", 8), ("Template", 2)]
+
+def weighted(choices):
+    ''' Pick from a list of (value, weight) '''
+
+    values, weights = zip(*choices)
+
+    return random.choices(values, weights)[0]
+
+def generate_of_csv(filename, projects, seed=0):
+    ''' Write a synthetic export in the format produced by OF-ProjReport.scpt '''
+
+    random.seed(seed)
+
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["ofid", "status", "name", "relm", "tag", "note"])
+        for number in range(projects):
+            relm = weighted(OF_RELMS)
+            note = "notion: skip" if random.random() < 0.02 else ""
+            writer.writerow([
+                ''.join(random.choices(string.ascii_letters + string.digits, k=11)),
+                weighted(OF_STATUSES),
+                f"Synthetic project {number}",
+                relm,
+                relm if random.random() < 0.9 else "?" + relm,
+                note
+            ])
+
+def peak_rss_kb() -> int:
+    ''' Peak resident set size of this process in KiB '''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_sync_child(settings_file):
+    ''' Child process: run the sync once with injected settings, print a JSON result '''
+
+    with open(settings_file) as handle:
+        settings = json.load(handle)
+
+    notionconfig = types.ModuleType('notionconfig')
+    notionconfig.__dict__.update(settings['config'])
+    sys.modules['notionconfig'] = notionconfig
+    sys.path.insert(0, REPO_DIR)
+
+    sync = importlib.import_module('notionsync')
+
+    sys.argv = ['notionsync'] + settings['argv']
+    output = io.StringIO()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        sync.main()
+    wall = time.perf_counter() - start
+
+    print(json.dumps({'wall_s': round(wall, 3), 'peak_rss_kb': peak_rss_kb(),
+                      'summary': output.getvalue().strip().splitlines()}))
+
+def standin_call(base_url, endpoint) -> dict:
+    ''' Read or reset the stand-in counters '''
+
+    url = base_url.rsplit('/v1', 1)[0] + '/_standin/' + endpoint
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+def start_standin(args):
+    ''' Launch the stand-in server as a separate process, returns (process, url) '''
+
+    command = [sys.executable, STANDIN_SCRIPT, '--latency', str(args.latency),
+               '--inject-429', str(args.inject_429)]
+    if args.rate_limit:
+        command += ['--rate-limit', str(args.rate_limit)]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+
+    return process, line.split('Listening on ', 1)[1].strip()
+
+def main():
+    ''' Main function '''
+
+    parser = argparse.ArgumentParser(description='Benchmark the Notion project sync')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='number of projects per synthetic export')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='stand-in latency per request in seconds')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='stand-in requests per second before 429')
+    parser.add_argument('--inject-429', type=float, default=0.0,
+                        help='fraction of stand-in responses that are 429')
+    parser.add_argument('--client-rate', type=float, default=1000,
+                        help='NOTION_RATE_LIMIT used by the sync')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--run-sync', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_sync:
+        run_sync_child(args.run_sync)
+        return
+
+    process, base_url = start_standin(args)
+    results = []
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in args.sizes:
+                csv_filename = os.path.join(workdir, f"of-{size}.csv")
+                generate_of_csv(csv_filename, size)
+
+                config = {
+                    'OF_CSV_FILENAME': csv_filename,
+                    'DATABASE_ID': f"personal-{size}",
+                    'work_db': f"work-{size}",
+                    'NOTION_ID': 'benchmark',
+                    'API_KEY': 'secret_benchmark',
+                    'BASE_URL': base_url,
+                    'NOTION_RATE_LIMIT': args.client_rate,
+                    'NOTION_RATE_BURST': max(int(args.client_rate), 1),
+                    'STATE_DB_FILENAME': os.path.join(workdir, f"state-{size}.sqlite")
+                }
+
+                for scenario, argv in SCENARIOS:
+                    settings_file = os.path.join(workdir, 'settings.json')
+                    with open(settings_file, 'w') as handle:
+                        json.dump({'config': config, 'argv': argv}, handle)
+
+                    standin_call(base_url, 'reset')
+                    child = subprocess.run([sys.executable, __file__, '--run-sync', settings_file],
+                                           stdout=subprocess.PIPE, text=True, check=True)
+                    result = json.loads(child.stdout.strip().splitlines()[-1])
+                    result.update(projects=size, scenario=scenario,
+                                  requests=standin_call(base_url, 'stats').get('requests', 0))
+                    results.append(result)
+
+                    print(f"{size:>7} {scenario:<15} {result['wall_s']:>9.3f}s "
+                          f"{result['requests']:>7} requests {result['peak_rss_kb']:>9} KiB",
+                          flush=True)
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+if __name__ == '__main__':
+    main()
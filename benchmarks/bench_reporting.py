@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+'''
+Benchmark the Timewarrior and calendar reporting paths on synthetic data
+
+For every size a synthetic Timewarrior database (monthly .data files), the
+matching `timew export` JSON and icalBuddy-style calendar output are
+generated, then each stage runs in its own child process so peak RSS is
+per stage. No timew or icalBuddy binaries are needed: the export stage
+feeds the generated JSON to TwReporter in place of the timew call.
+
+Stages: TwReporter.collect_tasks_list from the data files (cold and with a
+warm segment cache) and from export JSON, parse_tags_for_text/search_tags,
+add_durations, processicaldata and printvelocitystats.
+
+Results (throughput, latency percentiles, peak RSS) can be saved as a
+baseline and later runs compared against it; a stage whose median latency
+grew by more than --threshold is flagged and the exit status is 1.
+
+Usage:
+python benchmarks/bench_reporting.py --sizes 10000 100000 --save-baseline baseline.json
+python benchmarks/bench_reporting.py --sizes 10000 100000 --baseline baseline.json
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Development"
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_REPEATS = 5
+# Median latency growth over the baseline that counts as a regression
+DEFAULT_THRESHOLD = 0.20
+TW_DURATION = 'lastyear'
+TW_DATE_FORMAT = '%Y%m%dT%H%M%SZ'
+TAG_POOL = 200
+OPEN_INTERVALS = 1
+CALENDAR_YEARS = 3
+SEARCH_TERMS = ['tag7', 'project 3', 'meeting']
+
+STAGES = ['collect native', 'collect native cached', 'collect export', 'tag search',
+          'add_durations', 'processicaldata', 'printvelocitystats']
+
+def tag_pool(seed=0) -> list:
+    ''' Tag names, a few with spaces or quotes like real databases have '''
+
+    rng = random.Random(seed)
+    tags = []
+    for number in range(TAG_POOL):
+        kind = rng.random()
+        if kind < 0.1:
+            tags.append(f"project {number}")
+        elif kind < 0.12:
+            tags.append(f'say "hi" {number}')
+        else:
+            tags.append(f"tag{number}")
+    tags[:3] = ['meeting', 'email', 'admin']
+
+    return tags
+
+def synthetic_intervals(count, start: datetime, end: datetime, seed=0):
+    '''
+    Yield (start, end or None, tags) for count intervals between start and
+    end in order, Zipf-like tag popularity, the last OPEN_INTERVALS open
+    '''
+
+    rng = random.Random(seed)
+    tags = tag_pool(seed)
+    weights = [1 / (rank + 1) for rank in range(len(tags))]
+    span = (end - start).total_seconds()
+    step = span / max(count, 1)
+
+    for number in range(count):
+        begin = start + timedelta(seconds=number * step)
+        length = timedelta(seconds=rng.uniform(0.2, 0.95) * step)
+        chosen = list(dict.fromkeys(rng.choices(tags, weights, k=rng.choice((1, 1, 2, 3)))))
+        yield begin, None if number >= count - OPEN_INTERVALS else begin + length, chosen
+
+def quote_tag(tag: str) -> str:
+    ''' A tag as Timewarrior writes it in a data file '''
+
+    if ' ' in tag or '"' in tag:
+        return '"' + tag.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    return tag
+
+def write_timew_data(directory, count, start, end, seed=0):
+    ''' Write monthly Timewarrior .data files, returns the data directory '''
+
+    data_dir = os.path.join(directory, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+
+    handle = None
+    month = None
+    for begin, finish, tags in synthetic_intervals(count, start, end, seed):
+        if begin.strftime('%Y-%m') != month:
+            if handle is not None:
+                handle.close()
+            month = begin.strftime('%Y-%m')
+            handle = open(os.path.join(data_dir, month + '.data'), 'w')
+        line = 'inc ' + begin.strftime(TW_DATE_FORMAT)
+        if finish is not None:
+            line += ' - ' + finish.strftime(TW_DATE_FORMAT)
+        handle.write(line + ' # ' + ' '.join(quote_tag(tag) for tag in tags) + '\n')
+    if handle is not None:
+        handle.close()
+
+    return data_dir
+
+def write_timew_export(filename, count, start, end, seed=0):
+    ''' Write the `timew export` JSON for the same intervals '''
+
+    with open(filename, 'w') as handle:
+        handle.write('[\n')
+        for number, (begin, finish, tags) in enumerate(
+                synthetic_intervals(count, start, end, seed)):
+            item = {'id': count - number, 'start': begin.strftime(TW_DATE_FORMAT),
+                    'tags': tags}
+            if finish is not None:
+                item['end'] = finish.strftime(TW_DATE_FORMAT)
+            handle.write((',\n' if number else '') + json.dumps(item))
+        handle.write('\n]\n')
+
+def generate_icalbuddy_lines(count, years=CALENDAR_YEARS, seed=0, today=None) -> list:
+    '''
+    icalBuddy "event~date at HH:MM - HH:MM" lines spread over work days of
+    the last years, using the relative names icalBuddy prints for the last
+    few days
+    '''
+
+    rng = random.Random(seed)
+    today = today or datetime.now().date()
+    relative = {today: 'today', today - timedelta(days=1): 'yesterday',
+                today - timedelta(days=2): 'day before yesterday'}
+    names = ['Daily Review', 'Lunch', 'Weekly Review', 'Focus',
+             'Network Huddle (with recording option)'] + \
+            [f"Project sync {number}" for number in range(40)]
+    weights = [8, 10, 2, 6, 2] + [2] * 40
+
+    workdays = [today - timedelta(days=offset) for offset in range(365 * years)]
+    workdays = [day for day in workdays if day.weekday() < 5]
+
+    lines = []
+    for _ in range(count):
+        day = rng.choice(workdays)
+        start = rng.randrange(7 * 4, 18 * 4) * 15
+        length = rng.choice((15, 30, 30, 45, 60, 60, 90, 120))
+        end = min(start + length, 23 * 60 + 59)
+        date = relative.get(day, day.strftime('%m/%d/%Y'))
+        lines.append(f"{rng.choices(names, weights)[0]}~{date} at "
+                     f"{start // 60:02d}:{start % 60:02d} - {end // 60:02d}:{end % 60:02d}")
+
+    return lines
+
+def peak_rss_kb() -> int:
+    ''' Peak resident set size of this process in KiB '''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def percentile(values, fraction):
+    ''' Nearest-rank percentile of a list of numbers '''
+
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered), max(1, math.ceil(fraction * len(ordered)))) - 1]
+
+def run_stage_child(settings_file):
+    ''' Child process: time one stage repeatedly, print a JSON result '''
+
+    with open(settings_file) as handle:
+        settings = json.load(handle)
+
+    sys.path.insert(0, REPO_DIR)
+    os.environ['TIMEWARRIORDB'] = settings['timew_dir']
+    # pylint: disable=import-outside-toplevel
+    import timewdata
+    import tw_text_reporter
+    import CalculatePersonalVelocity as velocity
+
+    stage = settings['stage']
+    reporter = tw_text_reporter.TwReporter()
+    cache = None
+
+    if stage == 'collect native cached':
+        cache = timewdata.SegmentCache(settings['cache_dir'])
+        reporter.collect_tasks_list(TW_DURATION, 'native', cache)
+    if stage == 'collect export':
+        with open(settings['export_file']) as handle:
+            payload = handle.read()
+        reporter.execute_cli = lambda cli, sources=(): payload
+    if stage in ('tag search', 'add_durations'):
+        reporter.collect_tasks_list(TW_DURATION, 'native')
+    if stage in ('processicaldata', 'printvelocitystats'):
+        with open(settings['ical_file']) as handle:
+            rawlist = handle.read().split('\n')
+        weekdata = velocity.processicaldata(rawlist)
+    tasks = reporter.todays_tasks if stage == 'add_durations' else None
+
+    def run_once():
+        if stage in ('collect native', 'collect native cached'):
+            return reporter.collect_tasks_list(TW_DURATION, 'native', cache)
+        if stage == 'collect export':
+            return reporter.collect_tasks_list(TW_DURATION, 'export')
+        if stage == 'tag search':
+            reporter.parse_tags_for_text(SEARCH_TERMS[0])
+            return len(reporter.search_tags(SEARCH_TERMS)[0])
+        if stage == 'add_durations':
+            return reporter.add_durations(tasks)
+        if stage == 'processicaldata':
+            return velocity.processicaldata(rawlist)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return velocity.printvelocitystats(*weekdata)
+
+    latencies = []
+    for _ in range(settings['repeats']):
+        start = time.perf_counter()
+        run_once()
+        latencies.append(time.perf_counter() - start)
+
+    print(json.dumps({'latencies': latencies, 'peak_rss_kb': peak_rss_kb()}))
+
+def summarize(stage, size, child) -> dict:
+    ''' Throughput and latency percentiles of a stage run '''
+
+    latencies = child['latencies']
+    median = percentile(latencies, 0.5)
+
+    return {
+        'stage': stage,
+        'size': size,
+        'runs': len(latencies),
+        'p50_s': round(median, 6),
+        'p90_s': round(percentile(latencies, 0.9), 6),
+        'p99_s': round(percentile(latencies, 0.99), 6),
+        'min_s': round(min(latencies), 6),
+        'records_per_s': round(size / median) if median else None,
+        'peak_rss_kb': child['peak_rss_kb']
+    }
+
+def compare(results, baseline, threshold) -> list:
+    ''' Results whose median latency grew past threshold over the baseline '''
+
+    previous = {(entry['stage'], entry['size']): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['stage'], result['size']))
+        if before is None or not before['p50_s']:
+            continue
+        result['baseline_p50_s'] = before['p50_s']
+        result['change'] = round(result['p50_s'] / before['p50_s'] - 1, 4)
+        if result['change'] > threshold:
+            regressions.append(result)
+
+    return regressions
+
+def main():
+    ''' Main function '''
+
+    parser = argparse.ArgumentParser(description='Benchmark the reporting paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='intervals (and calendar events) per synthetic data set')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help='timed runs per stage')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results saved earlier')
+    parser.add_argument('--save-baseline', help='save these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='median slowdown that counts as a regression (0.2 = 20%%)')
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        run_stage_child(args.run_stage)
+        return
+
+    # The data files hold last year, like `:lastyear` reports read
+    this_year = datetime.now().replace(month=1, day=1, hour=0, minute=0, second=0,
+                                       microsecond=0)
+    range_start = this_year.replace(year=this_year.year - 1).astimezone(timezone.utc)
+    range_end = this_year.astimezone(timezone.utc) - timedelta(hours=1)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            size_dir = os.path.join(workdir, str(size))
+            timew_dir = os.path.join(size_dir, 'timew')
+            write_timew_data(timew_dir, size, range_start, range_end)
+            export_file = os.path.join(size_dir, 'export.json')
+            write_timew_export(export_file, size, range_start, range_end)
+            ical_file = os.path.join(size_dir, 'icalbuddy.txt')
+            with open(ical_file, 'w') as handle:
+                handle.write('\n'.join(generate_icalbuddy_lines(size)))
+
+            for stage in args.stages:
+                settings_file = os.path.join(size_dir, 'settings.json')
+                with open(settings_file, 'w') as handle:
+                    json.dump({'stage': stage, 'repeats': args.repeats,
+                               'timew_dir': timew_dir, 'export_file': export_file,
+                               'ical_file': ical_file,
+                               'cache_dir': os.path.join(size_dir, 'cache')}, handle)
+
+                child = subprocess.run([sys.executable, __file__, '--run-stage', settings_file],
+                                       stdout=subprocess.PIPE, text=True, check=True)
+                result = summarize(stage, size,
+                                   json.loads(child.stdout.strip().splitlines()[-1]))
+                results.append(result)
+
+                print(f"{size:>8} {stage:<22} p50 {result['p50_s']:>9.4f}s "
+                      f"p90 {result['p90_s']:>9.4f}s {result['records_per_s'] or 0:>11} rec/s "
+                      f"{result['peak_rss_kb']:>9} KiB", flush=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(results, json.load(handle), args.threshold)
+        for result in regressions:
+            print(f"REGRESSION {result['size']} {result['stage']}: p50 {result['p50_s']:.4f}s "
+                  f"vs {result['baseline_p50_s']:.4f}s (+{result['change']:.0%})")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+'''
+Benchmark cold start of the tools: time until the first byte of output
+
+Runs `tw-search` (on a small synthetic Timewarrior database) and
+`velocity` (on a one-week .ics file) as fresh processes, once through the
+standalone scripts and once through `productivity_tools.py`, and reports
+the median time from exec to the first byte on stdout. HOME points at a
+scratch directory so no real caches or data are touched.
+
+With --ref the standalone scripts of that git revision (e.g. the commit
+before the CLI) are timed as well, as the "before" numbers. Any revision
+works: scripts that predate --no-cache/--ics get only the search text (no
+arguments for velocity) and read from stubs instead, a `timew` on PATH
+printing the export JSON of the same intervals and an icalBuddy printing
+the same week, which their unpacked copy is pointed at. Such a revision
+then does different work (a cat instead of reading the data files or the
+.ics store), so its times are only a rough "before". A CLI median above
+--max-ms, or above the --ref script median, is a regression and the exit
+status is 1.
+
+Usage:
+python benchmarks/bench_startup.py
+python benchmarks/bench_startup.py --ref HEAD~1 --runs 30 --max-ms 150
+'''
+
+import argparse
+import compileall
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from bench_reporting import REPO_DIR, percentile, write_timew_data, write_timew_export
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Development"
+
+DEFAULT_RUNS = 15
+TIMEW_INTERVALS = 200
+# subcommand: (script, arguments, arguments for revisions without the options)
+COMMANDS = {
+    'tw-search': ('tw_text_reporter.py', ['--no-cache', '-q', 'meeting'], ['meeting']),
+    'velocity': ('CalculatePersonalVelocity.py', ['--no-cache', '--ics', '{ics}'], [])
+}
+# Where scripts before --ics run icalBuddy from
+ICALBUDDY_PATH = "/usr/local/bin/icalbuddy"
+WEEK_EVENTS = [('09:00', '09:30', 'Daily Review'), ('10:00', '11:30', 'Project sync'),
+               ('14:00', '16:00', 'Focus')]
+
+def week_days(today=None) -> list:
+    ''' Monday to Friday of this week '''
+
+    today = today or datetime.now().date()
+    monday = today - timedelta(days=today.weekday())
+
+    return [monday + timedelta(days=offset) for offset in range(5)]
+
+def write_week_ics(filename, today=None):
+    ''' A calendar with a few meetings on each day of this week '''
+
+    events = []
+    for day in week_days(today):
+        day = day.strftime('%Y%m%d')
+        for number, (start, end, name) in enumerate(WEEK_EVENTS):
+            events += ['BEGIN:VEVENT', f"UID:{day}-{number}@bench", f"SUMMARY:{name}",
+                       f"DTSTART:{day}T{start.replace(':', '')}00",
+                       f"DTEND:{day}T{end.replace(':', '')}00", 'END:VEVENT']
+
+    with open(filename, 'w') as handle:
+        handle.write('\r\n'.join(['BEGIN:VCALENDAR', 'VERSION:2.0'] + events +
+                                 ['END:VCALENDAR']) + '\r\n')
+
+def write_stubs(directory, export_file) -> dict:
+    ''' timew and icalBuddy stand-ins for old revisions, returns {name: path} '''
+
+    lines = [f"{name}~{day.strftime('%m/%d/%Y')} at {start} - {end}"
+             for day in week_days() for start, end, name in WEEK_EVENTS]
+    calendar = os.path.join(directory, 'icalbuddy.txt')
+    with open(calendar, 'w') as handle:
+        handle.write('\n'.join(lines) + '\n')
+
+    stubs = {}
+    for name, output in (('timew', export_file), ('icalbuddy', calendar)):
+        stubs[name] = os.path.join(directory, name)
+        with open(stubs[name], 'w') as handle:
+            handle.write(f"#!/bin/sh\ncat '{output}'\n")
+        os.chmod(stubs[name], 0o755)
+
+    return stubs
+
+def legacy_script(path, options) -> bool:
+    ''' True if the script predates any of the -- options '''
+
+    with open(path) as handle:
+        source = handle.read()
+
+    return any(f"'{option}'" not in source for option in options if option.startswith('--'))
+
+def first_output_ms(argv, env) -> float:
+    ''' Milliseconds from starting argv to its first stdout byte '''
+
+    start = time.perf_counter()
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               env=env)
+    first = process.stdout.read1(1)
+    elapsed = (time.perf_counter() - start) * 1000
+    process.stdout.read()
+    process.stdout.close()
+    if process.wait() != 0 or not first:
+        raise RuntimeError(f"{' '.join(argv)} failed (exit status {process.returncode})")
+
+    return elapsed
+
+def export_ref(ref, directory, icalbuddy=None) -> str:
+    '''
+    Unpack the tree of a git revision, returns its directory; with
+    icalbuddy, scripts calling ICALBUDDY_PATH are pointed at that stub
+    '''
+
+    archive = subprocess.run(['git', '-C', REPO_DIR, 'archive', ref],
+                             stdout=subprocess.PIPE, check=True).stdout
+    os.makedirs(directory, exist_ok=True)
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+
+    if icalbuddy is not None:
+        for script, _, _ in COMMANDS.values():
+            path = os.path.join(directory, script)
+            with open(path) as handle:
+                source = handle.read()
+            with open(path, 'w') as handle:
+                handle.write(source.replace(ICALBUDDY_PATH, icalbuddy))
+
+    return directory
+
+def main():
+    ''' Main function '''
+
+    parser = argparse.ArgumentParser(description='Benchmark time to first output')
+    parser.add_argument('--commands', nargs='+', choices=list(COMMANDS), default=list(COMMANDS))
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS,
+                        help='cold starts per variant')
+    parser.add_argument('--ref', help='also time the standalone scripts of this git revision')
+    parser.add_argument('--max-ms', type=float,
+                        help='fail when a CLI median is above this many milliseconds')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    # An installed CLI imports byte-compiled modules; without this, runs with
+    # PYTHONDONTWRITEBYTECODE set would compile every module on each start
+    compileall.compile_dir(REPO_DIR, maxlevels=0, quiet=1)
+
+    results = []
+    regressions = []
+    with tempfile.TemporaryDirectory() as workdir:
+        home = os.path.join(workdir, 'home')
+        os.makedirs(home)
+        now = datetime.now(timezone.utc)
+        timew_dir = os.path.join(workdir, 'timew')
+        write_timew_data(timew_dir, TIMEW_INTERVALS, now.replace(month=1, day=1) -
+                         timedelta(days=365), now.replace(month=1, day=1) - timedelta(hours=1))
+        export_file = os.path.join(workdir, 'export.json')
+        write_timew_export(export_file, TIMEW_INTERVALS, now.replace(month=1, day=1) -
+                           timedelta(days=365), now.replace(month=1, day=1) - timedelta(hours=1))
+        ics = os.path.join(workdir, 'week.ics')
+        write_week_ics(ics)
+        stub_dir = os.path.join(workdir, 'bin')
+        os.makedirs(stub_dir)
+        stubs = write_stubs(stub_dir, export_file)
+        env = dict(os.environ, HOME=home, TIMEWARRIORDB=timew_dir,
+                   PATH=stub_dir + os.pathsep + os.environ.get('PATH', ''))
+
+        trees = [('script', REPO_DIR)]
+        if args.ref:
+            trees.insert(0, (f"script@{args.ref}",
+                             export_ref(args.ref, os.path.join(workdir, 'ref'),
+                                        stubs['icalbuddy'])))
+
+        for command in args.commands:
+            script, options, legacy_options = COMMANDS[command]
+            options = [option.format(ics=ics) for option in options]
+            variants = []
+            for label, tree in trees:
+                path = os.path.join(tree, script)
+                variants.append((label, [sys.executable, path] +
+                                 (legacy_options if legacy_script(path, options) else options)))
+            variants.append(('cli', [sys.executable,
+                                     os.path.join(REPO_DIR, 'productivity_tools.py'),
+                                     command] + options))
+
+            # Interleaved so drift in machine load hits every variant alike
+            timings = {label: [] for label, _ in variants}
+            for _ in range(args.runs):
+                for label, argv in variants:
+                    timings[label].append(first_output_ms(argv, env))
+
+            medians = {}
+            for label, _ in variants:
+                medians[label] = percentile(timings[label], 0.5)
+                results.append({'command': command, 'variant': label, 'runs': args.runs,
+                                'p50_ms': round(medians[label], 2),
+                                'p90_ms': round(percentile(timings[label], 0.9), 2)})
+                print(f"{command:<10} {label:<24} p50 {medians[label]:>8.1f} ms "
+                      f"p90 {results[-1]['p90_ms']:>8.1f} ms", flush=True)
+
+            if args.max_ms is not None and medians['cli'] > args.max_ms:
+                regressions.append(f"{command}: cli p50 {medians['cli']:.1f} ms "
+                                   f"over the {args.max_ms:.0f} ms budget")
+            if args.ref and medians['cli'] > medians[trees[0][0]]:
+                regressions.append(f"{command}: cli p50 {medians['cli']:.1f} ms, "
+                                   f"{trees[0][0]} {medians[trees[0][0]]:.1f} ms")
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
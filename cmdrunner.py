@@ -0,0 +1,268 @@
+'''
+Common way to run the external commands the tools depend on
+(timew, task, icalBuddy)
+
+Commands are argv lists, never shell strings. Every call has a timeout
+and is timed; several commands can run at once with bounded concurrency,
+stdout can be streamed while the command runs, and idempotent read-only
+queries can be answered from a content-addressed result cache keyed by
+argv, input and the mtimes of the data the command reads.
+'''
+
+import codecs
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+DEFAULT_TIMEOUT = 60
+MAX_WORKERS = 4
+STREAM_CHUNK_SIZE = 64 * 1024
+CACHE_MAX_ENTRIES = 64
+# Calls kept for timings(), long running loops (--watch, --refresh) drop the oldest
+TIMINGS_MAX_ENTRIES = 1000
+
+CommandResult = namedtuple('CommandResult',
+                           ['argv', 'returncode', 'stdout', 'stderr', 'elapsed', 'cached'])
+
+class CommandError(Exception):
+    ''' A command could not be started, failed or timed out '''
+
+    def __init__(self, argv, reason, result=None):
+        self.argv = argv
+        self.reason = reason
+        self.result = result
+        super().__init__(f"{' '.join(argv)}: {reason}")
+
+class CommandTimeout(CommandError):
+    ''' A command ran past its timeout and was killed '''
+
+_timings = deque(maxlen=TIMINGS_MAX_ENTRIES)
+_timings_lock = threading.Lock()
+
+def record_timing(argv, elapsed, returncode, cached=False):
+    ''' Note how long a call took '''
+
+    logging.debug("cli: %s %.3fs rc=%s%s", argv, elapsed, returncode,
+                  " (cached)" if cached else "")
+    with _timings_lock:
+        _timings.append({'argv': list(argv), 'elapsed': elapsed, 'returncode': returncode,
+                         'cached': cached})
+
+def timings(reset=False) -> list:
+    ''' The last TIMINGS_MAX_ENTRIES calls as {'argv', 'elapsed', 'returncode', 'cached'} '''
+
+    with _timings_lock:
+        calls = list(_timings)
+        if reset:
+            _timings.clear()
+
+    return calls
+
+def source_signature(sources) -> list:
+    '''
+    mtime/size of the files a command reads; a directory also covers the
+    files directly inside it
+    '''
+
+    signature = []
+    for source in sources:
+        source = os.path.expanduser(source)
+        try:
+            stat = os.stat(source)
+        except OSError:
+            signature.append([source, None])
+            continue
+
+        entry = [source, stat.st_mtime_ns, stat.st_size]
+        if os.path.isdir(source):
+            with os.scandir(source) as entries:
+                entry.append(sorted([item.name, item.stat().st_mtime_ns, item.stat().st_size]
+                                    for item in entries))
+        signature.append(entry)
+
+    return signature
+
+class ResultCache:
+    ''' In-memory LRU of successful command results keyed by content hash '''
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(argv, stdin, sources) -> str:
+        ''' Hash of argv, stdin and the source signature '''
+
+        content = json.dumps([list(argv), stdin, source_signature(sources)])
+
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        ''' Cached CommandResult, None on a miss '''
+
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                self.results.move_to_end(key)
+
+        return result
+
+    def put(self, key, result: CommandResult):
+        ''' Store a result, dropping the least recently used beyond max_entries '''
+
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        ''' Forget every result '''
+
+        with self.lock:
+            self.results.clear()
+
+# Shared by everything in one process
+SESSION_CACHE = ResultCache()
+
+def check_argv(argv):
+    ''' Only argv lists are run, a string would need a shell '''
+
+    if isinstance(argv, (str, bytes)):
+        raise TypeError("commands are argv lists, not shell strings")
+
+def run(argv, timeout=DEFAULT_TIMEOUT, stdin=None, check=True, cache=None,
+        sources=()) -> CommandResult:
+    '''
+    Run a command to completion and return its output as text. With a
+    cache, a result for the same argv, stdin and unchanged sources is
+    returned without running anything. Raises CommandTimeout past timeout
+    and, with check, CommandError if it cannot start or exits non-zero.
+    '''
+
+    check_argv(argv)
+
+    key = None
+    if cache is not None:
+        key = cache.key(argv, stdin, sources)
+        result = cache.get(key)
+        if result is not None:
+            record_timing(argv, 0.0, result.returncode, cached=True)
+            return result._replace(elapsed=0.0, cached=True)
+
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(argv, input=stdin, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, timeout=timeout,
+                                   check=False)
+    except subprocess.TimeoutExpired as error:
+        record_timing(argv, time.perf_counter() - start, None)
+        raise CommandTimeout(argv, f"timed out after {timeout}s") from error
+    except OSError as error:
+        record_timing(argv, time.perf_counter() - start, None)
+        raise CommandError(argv, str(error)) from error
+
+    elapsed = time.perf_counter() - start
+    record_timing(argv, elapsed, completed.returncode)
+    result = CommandResult(list(argv), completed.returncode, completed.stdout,
+                           completed.stderr, elapsed, False)
+
+    if completed.returncode != 0:
+        if check:
+            message = completed.stderr.strip().splitlines()
+            raise CommandError(argv, f"exit status {completed.returncode}" +
+                               (f": {message[0]}" if message else ""), result)
+    elif key is not None:
+        cache.put(key, result)
+
+    return result
+
+def run_many(commands, max_workers=MAX_WORKERS, **kwargs) -> list:
+    '''
+    Run several argv lists at most max_workers at a time with the same
+    run() options; results come back in order, a failed command as its
+    CommandError instead of a result
+    '''
+
+    # Imported here, most runs never need a pool and it is slow to import
+    from concurrent.futures import ThreadPoolExecutor # pylint: disable=import-outside-toplevel
+
+    def run_one(argv):
+        try:
+            return run(argv, **kwargs)
+        except CommandError as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run_one, commands))
+
+def stream(argv, timeout=DEFAULT_TIMEOUT, check=True, chunk_size=STREAM_CHUNK_SIZE):
+    '''
+    Run a command and yield its stdout as text chunks while it runs; the
+    command is killed once timeout has passed (CommandTimeout)
+    '''
+
+    check_argv(argv)
+
+    start = time.perf_counter()
+    try:
+        process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as error:
+        raise CommandError(argv, str(error)) from error
+
+    expired = threading.Event()
+    def kill():
+        expired.set()
+        process.kill()
+    watchdog = threading.Timer(timeout, kill) if timeout else None
+    if watchdog is not None:
+        watchdog.daemon = True
+        watchdog.start()
+
+    # Drain stderr alongside so a chatty command cannot block on a full pipe
+    stderr = []
+    def read_stderr():
+        for line in process.stderr:
+            stderr.append(line.decode('utf-8', errors='replace'))
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for chunk in iter(lambda: process.stdout.read1(chunk_size), b''):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+        if watchdog is not None:
+            watchdog.cancel()
+        stderr_thread.join()
+        record_timing(argv, time.perf_counter() - start, returncode)
+
+    if expired.is_set():
+        raise CommandTimeout(argv, f"timed out after {timeout}s")
+    if check and returncode != 0:
+        raise CommandError(argv, f"exit status {returncode}" +
+                           (f": {stderr[0].strip()}" if stderr else ""))
+
+def dedupe_adjacent(text: str) -> str:
+    ''' Drop lines repeating the line before them, like uniq '''
+
+    lines = text.split('\n')
+
+    return '\n'.join(line for index, line in enumerate(lines)
+                     if index == 0 or line != lines[index - 1])
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+'''
+Productivity dashboard: velocity, Timewarrior week chart, today's
+intervals and today's meetings
+
+All sections are gathered concurrently instead of one process after the
+other, each with its own timeout, and shown in the usual order. A section
+that fails or runs out of time keeps its last output marked as stale (or
+a placeholder on the first run). With --refresh N the dashboard stays up
+and redraws as each section finishes updating.
+
+Usage:
+python ~/code/Misc/dashboard.py
+python ~/code/Misc/dashboard.py --refresh 300
+'''
+
+import argparse
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import Future, wait
+from datetime import datetime
+import cmdrunner
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+TIMEW_COMMAND = "timew"
+ICALBUDDY_COMMAND = "/usr/local/bin/icalbuddy"
+# Seconds a section may take before it is shown as stale
+SECTION_TIMEOUT = 15
+LOGGING_LEVEL = logging.ERROR
+LOGGING_FORMAT = '[%(levelname)s] %(asctime)s - %(funcName)s %(lineno)d - %(message)s'
+CLEAR_SCREEN = "\033[H\033[J"
+
+def velocity_text(timeout):
+    ''' This week's velocity from CalculatePersonalVelocity, icalBuddy bounded by timeout '''
+
+    # Imported here so the other sections still work without its dependencies
+    import CalculatePersonalVelocity # pylint: disable=import-outside-toplevel
+
+    return CalculatePersonalVelocity.velocityreport(timeout=timeout)
+
+def command_text(argv, timeout, dedupe=False) -> str:
+    ''' Output of a command, adjacent duplicate lines dropped when dedupe is set '''
+
+    output = cmdrunner.run(argv, timeout=timeout).stdout
+
+    # Replaces `| uniq`, icalBuddy repeats lines on some macOS versions
+    return cmdrunner.dedupe_adjacent(output) if dedupe else output
+
+def timew_text(args, timeout) -> str:
+    ''' Timewarrior report, forcing colour when the dashboard is on a terminal '''
+
+    argv = [TIMEW_COMMAND] + args + ([':color'] if sys.stdout.isatty() else [])
+
+    return command_text(argv, timeout)
+
+def meetings_text(timeout) -> str:
+    ''' Today's meetings from icalBuddy '''
+
+    argv = [ICALBUDDY_COMMAND, "-npn", "-ea", "-nc", "-ps", "/ » /",
+            "-eep", "url,location,notes,attendees", "-ic", "Calendar", "eventsToday"]
+
+    return command_text(argv, timeout, dedupe=True)
+
+class Section:
+    ''' One dashboard section: how to produce it and what it showed last '''
+
+    def __init__(self, title, producer, *args):
+        self.title = title
+        self.producer = producer
+        self.args = args
+        self.text = None
+        self.updated = None
+        self.problem = None
+        self.future = None
+
+    def run(self, timeout):
+        ''' Produce the section text (runs in a worker thread) '''
+
+        return self.producer(*self.args, timeout)
+
+    def start(self, timeout) -> Future:
+        '''
+        Run the section in a daemon thread; unlike a pool worker, one
+        still stuck when the dashboard exits does not hold up the exit
+        '''
+
+        future = Future()
+
+        def work():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.run(timeout))
+            except BaseException as error: # pylint: disable=broad-except
+                future.set_exception(error)
+
+        threading.Thread(target=work, name=f"dashboard-{self.title}", daemon=True).start()
+
+        return future
+
+    def collect(self, timed_out=False):
+        ''' Take the result of the finished (or abandoned) run '''
+
+        if timed_out:
+            self.problem = "timed out"
+            return
+
+        try:
+            self.text = self.future.result()
+            self.updated = datetime.now()
+            self.problem = None
+        except cmdrunner.CommandTimeout:
+            self.problem = "timed out"
+        except cmdrunner.CommandError as error:
+            self.problem = error.reason
+        except Exception as error: # pylint: disable=broad-except
+            logging.debug("%s failed: %s", self.title, error)
+            self.problem = str(error).splitlines()[0] if str(error) else type(error).__name__
+        self.future = None
+
+    def render(self) -> str:
+        ''' Heading plus the latest text, marked when it is stale or missing '''
+
+        heading = f" {self.title}\n {'-' * len(self.title)}\n"
+
+        if self.text is None:
+            status = "updating" if self.problem is None else f"unavailable: {self.problem}"
+            return heading + f"[{status}]\n"
+
+        body = self.text.rstrip('\n') + '\n'
+        if self.problem is not None:
+            body += f"[stale since {self.updated:%H:%M:%S}: {self.problem}]\n"
+        elif self.future is not None:
+            body += f"[updating, shown from {self.updated:%H:%M:%S}]\n"
+
+        return heading + body
+
+def dashboard_sections():
+    ''' The sections in display order '''
+
+    return [
+        Section("Velocity", velocity_text),
+        Section("Week Chart", timew_text, ['week']),
+        Section("Day List", timew_text, ['sum', ':ids']),
+        Section("Meeting", meetings_text)
+    ]
+
+def render(sections, clear=True):
+    ''' Draw every section in order '''
+
+    output = '\n'.join(section.render() for section in sections)
+    sys.stdout.write((CLEAR_SCREEN if clear else '') + output)
+    sys.stdout.flush()
+
+def gather(sections, timeout, on_update=None):
+    '''
+    Start every section that is not still running, then collect results
+    until all are in or the timeout passes; on_update is called after
+    each section finishes
+    '''
+
+    for section in sections:
+        if section.future is None:
+            section.future = section.start(timeout)
+
+    deadline = time.monotonic() + timeout
+    pending = {section.future: section for section in sections}
+    while pending:
+        done, _ = wait(pending, timeout=max(deadline - time.monotonic(), 0),
+                       return_when='FIRST_COMPLETED')
+        if not done:
+            break
+        for future in done:
+            pending.pop(future).collect()
+        if on_update is not None:
+            on_update()
+
+    # Still running: keep the old text, retry on the next refresh once done
+    for section in pending.values():
+        section.collect(timed_out=True)
+
+def main():
+    ''' Main function '''
+
+    parser = argparse.ArgumentParser(description='Productivity dashboard')
+    parser.add_argument('--refresh', type=float, metavar='N',
+                        help='stay running and refresh every N seconds')
+    parser.add_argument('--timeout', type=float, default=SECTION_TIMEOUT,
+                        help='seconds each section may take')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOGGING_LEVEL, format=LOGGING_FORMAT)
+
+    sections = dashboard_sections()
+    clear = sys.stdout.isatty()
+
+    if not args.refresh:
+        gather(sections, args.timeout)
+        render(sections, clear)
+        return
+
+    try:
+        while True:
+            started = time.monotonic()
+            render(sections, clear)
+            gather(sections, args.timeout, lambda: render(sections, clear))
+            render(sections, clear)
+            time.sleep(max(args.refresh - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+'''
+Indexed store of calendar events read from .ics files
+
+Reads standard iCalendar exports, or a directory of them such as a CalDAV
+sync folder, expands recurring events and keeps every occurrence in a
+SQLite table indexed by day. Files are only parsed again when their mtime
+or size changes, so repeated velocity runs over a year of calendar data
+just query the requested window.
+
+Occurrences come back as (summary, start, end) with local datetimes, the
+events CalculatePersonalVelocity also makes of icalBuddy's output.
+
+Recurrence rules are expanded with python-dateutil when it is installed;
+otherwise a built-in expander handles FREQ, INTERVAL, COUNT, UNTIL and
+weekly BYDAY, which covers ordinary meeting series.
+'''
+
+import os
+import re
+import sqlite3
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+ICS_STORE_FILENAME = "~/.cache/velocity-ics.sqlite"
+ICS_SUFFIX = '.ics'
+# Open ended series are expanded this far past today
+EXPAND_HORIZON_DAYS = 400
+# Bump when the stored rows change meaning
+STORE_VERSION = 1
+
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+DURATION_PATTERN = re.compile(r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?'
+                              r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+# Imported on first use, only files being (re)indexed need them
+_rrule = None
+_zoneinfo = None
+
+def rrule_module():
+    ''' dateutil's rrule module, None if python-dateutil is not installed '''
+
+    global _rrule # pylint: disable=global-statement
+    if _rrule is None:
+        try:
+            from dateutil import rrule # pylint: disable=import-outside-toplevel
+            _rrule = rrule
+        except ImportError:
+            _rrule = False
+
+    return _rrule or None
+
+def zone_info(name: str):
+    ''' ZoneInfo of a TZID, None without zoneinfo; unknown names raise '''
+
+    global _zoneinfo # pylint: disable=global-statement
+    if _zoneinfo is None:
+        try:
+            import zoneinfo # pylint: disable=import-outside-toplevel
+            _zoneinfo = zoneinfo
+        except ImportError:
+            _zoneinfo = False
+
+    return _zoneinfo.ZoneInfo(name) if _zoneinfo else None
+
+def unfold(text: str) -> list:
+    ''' Content lines of an iCalendar file with folded lines joined '''
+
+    lines = []
+    for raw in text.splitlines():
+        if raw[:1] in (' ', '\t') and lines:
+            lines[-1] += raw[1:]
+        elif raw:
+            lines.append(raw)
+
+    return lines
+
+def parse_content_line(line: str):
+    ''' Split "NAME;PARAM=x:value" into (name, params, value) '''
+
+    head, _, value = line.partition(':')
+    name, *params = head.split(';')
+
+    return name.upper(), dict(param.split('=', 1) for param in params if '=' in param), value
+
+def unescape(value: str) -> str:
+    ''' Undo iCalendar TEXT escaping '''
+
+    return re.sub(r'\\([\\;,nN])',
+                  lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+def parse_events(text: str) -> list:
+    '''
+    VEVENTs of an iCalendar document as dicts of name -> list of
+    (params, value); nested components such as VALARM are skipped
+    '''
+
+    events = []
+    event = None
+    depth = 0
+
+    for line in unfold(text):
+        name, params, value = parse_content_line(line)
+        if name == 'BEGIN':
+            if value.upper() == 'VEVENT' and depth == 0:
+                event = {}
+            elif event is not None:
+                depth += 1
+        elif name == 'END':
+            if depth:
+                depth -= 1
+            elif value.upper() == 'VEVENT' and event is not None:
+                events.append(event)
+                event = None
+        elif event is not None and depth == 0:
+            event.setdefault(name, []).append((params, value))
+
+    return events
+
+def parse_datetime(value: str, params: dict):
+    '''
+    Turn a DATE or DATE-TIME value into (datetime, all_day); UTC and TZID
+    times come back timezone aware, floating times naive
+    '''
+
+    value = value.strip()
+    if params.get('VALUE', '').upper() == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], '%Y%m%d'), True
+
+    parsed = datetime.strptime(value.rstrip('Z')[:15], '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        return parsed.replace(tzinfo=timezone.utc), False
+
+    if 'TZID' in params:
+        try:
+            zone = zone_info(params['TZID'].strip('"'))
+            if zone is not None:
+                return parsed.replace(tzinfo=zone), False
+        except (KeyError, ValueError):
+            import logging # pylint: disable=import-outside-toplevel
+            logging.debug("unknown TZID %s, treating as floating", params['TZID'])
+
+    return parsed, False
+
+def to_local(when: datetime) -> datetime:
+    ''' Naive local time of an aware datetime, floating times unchanged '''
+
+    if when.tzinfo is None:
+        return when
+
+    return when.astimezone().replace(tzinfo=None)
+
+def parse_duration(value: str) -> timedelta:
+    ''' iCalendar DURATION value as a timedelta '''
+
+    match = DURATION_PATTERN.match(value.strip())
+    if match is None:
+        raise ValueError(f"bad duration {value}")
+
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    length = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                       minutes=int(minutes or 0), seconds=int(seconds or 0))
+
+    return -length if sign == '-' else length
+
+def property_value(event: dict, name: str, default=None):
+    ''' (params, value) of the first occurrence of a property '''
+
+    values = event.get(name)
+
+    return values[0] if values else default
+
+def date_list(event: dict, name: str) -> set:
+    ''' All datetimes of a multi valued property such as EXDATE or RDATE '''
+
+    dates = set()
+    for params, value in event.get(name, []):
+        for item in value.split(','):
+            if item:
+                dates.add(parse_datetime(item, params)[0])
+
+    return dates
+
+def add_months(day: datetime, months: int):
+    ''' Same day of the month, months away, None if that month is too short '''
+
+    month = day.year * 12 + day.month - 1 + months
+    try:
+        return day.replace(year=month // 12, month=month % 12 + 1)
+    except ValueError:
+        return None
+
+def simple_rrule(rule: str, start: datetime, until: datetime):
+    ''' Yield occurrence starts of a common RRULE subset up to until '''
+
+    parts = dict(part.split('=', 1) for part in rule.split(';') if '=' in part)
+    freq = parts.get('FREQ', '').upper()
+    interval = int(parts.get('INTERVAL', 1))
+    count = int(parts['COUNT']) if 'COUNT' in parts else None
+    if 'UNTIL' in parts:
+        rule_until, all_day = parse_datetime(parts['UNTIL'], {})
+        if all_day:
+            rule_until += timedelta(days=1, seconds=-1)
+        if rule_until.tzinfo is not None and start.tzinfo is not None:
+            rule_until = rule_until.astimezone(start.tzinfo)
+        rule_until = rule_until.replace(tzinfo=start.tzinfo)
+        until = min(until, rule_until)
+
+    unsupported = set(parts) - {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYDAY', 'WKST'}
+    if unsupported or freq not in ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY') or \
+            ('BYDAY' in parts and freq != 'WEEKLY'):
+        import logging # pylint: disable=import-outside-toplevel
+        logging.warning("RRULE %s needs python-dateutil, only the first occurrence is used",
+                        rule)
+        yield start
+        return
+
+    weekdays = [WEEKDAYS.index(day[-2:]) for day in parts.get('BYDAY', '').split(',') if day]
+    emitted = 0
+    step = 0
+
+    while True:
+        if freq == 'DAILY':
+            period = [start + timedelta(days=step * interval)]
+        elif freq == 'WEEKLY':
+            week_start = start + timedelta(weeks=step * interval)
+            if weekdays:
+                monday = week_start - timedelta(days=week_start.weekday())
+                period = [monday + timedelta(days=day) for day in sorted(weekdays)]
+                period = [when for when in period if when >= start]
+            else:
+                period = [week_start]
+        else:
+            months = step * interval * (12 if freq == 'YEARLY' else 1)
+            period = [when for when in [add_months(start, months)] if when is not None]
+
+        if period and period[0] > until:
+            return
+        for when in period:
+            if when > until or (count is not None and emitted >= count):
+                return
+            emitted += 1
+            yield when
+        step += 1
+
+def expand_starts(event: dict, start: datetime, horizon: datetime):
+    ''' Start times of every occurrence of an event up to horizon '''
+
+    rules = [value for _, value in event.get('RRULE', [])]
+    extra = date_list(event, 'RDATE')
+    rrule = rrule_module() if rules else None
+
+    if not rules:
+        starts = [start]
+    elif rrule is not None:
+        # dateutil wants UNTIL in UTC only when DTSTART is aware
+        rule_text = '\n'.join('RRULE:' + (rule if start.tzinfo is not None
+                                          else re.sub(r'(UNTIL=\d{8}T\d{6})Z', r'\1', rule))
+                              for rule in rules)
+        series = rrule.rrulestr(rule_text, dtstart=start, forceset=True)
+        starts = series.between(start, horizon, inc=True)
+    else:
+        starts = [when for rule in rules for when in simple_rrule(rule, start, horizon)]
+
+    return sorted(set(starts) | {when for when in extra if to_local(when) <= to_local(horizon)},
+                  key=to_local)
+
+def event_occurrences(events: list, horizon: datetime):
+    '''
+    Yield (summary, local start, local end) for every timed occurrence,
+    skipping all-day and cancelled events, EXDATEs and occurrences that
+    a RECURRENCE-ID override replaces
+    '''
+
+    overridden = set()
+    for event in events:
+        if 'RECURRENCE-ID' in event:
+            params, value = property_value(event, 'RECURRENCE-ID')
+            overridden.add((property_value(event, 'UID', ({}, ''))[1],
+                            to_local(parse_datetime(value, params)[0])))
+
+    for event in events:
+        if 'DTSTART' not in event:
+            continue
+        status = property_value(event, 'STATUS', ({}, ''))[1].upper()
+        if status == 'CANCELLED':
+            continue
+
+        params, value = property_value(event, 'DTSTART')
+        start, all_day = parse_datetime(value, params)
+        if all_day:
+            continue
+
+        if 'DTEND' in event:
+            params, value = property_value(event, 'DTEND')
+            end = parse_datetime(value, params)[0]
+            length = to_local(end) - to_local(start)
+        elif 'DURATION' in event:
+            length = parse_duration(property_value(event, 'DURATION')[1])
+        else:
+            length = timedelta()
+
+        summary = unescape(property_value(event, 'SUMMARY', ({}, ''))[1])
+        uid = property_value(event, 'UID', ({}, ''))[1]
+        excluded = {to_local(when) for when in date_list(event, 'EXDATE')}
+        is_override = 'RECURRENCE-ID' in event
+
+        horizon_start = horizon if start.tzinfo is None else horizon.astimezone()
+        for when in expand_starts(event, start, horizon_start):
+            local = to_local(when)
+            if local in excluded or (not is_override and (uid, local) in overridden):
+                continue
+            yield summary, local, to_local(when + length)
+
+class IcsStore:
+    '''
+    SQLite table of event occurrences indexed by day, refreshed per source
+    file when the file's mtime or size changes
+    '''
+
+    def __init__(self, filename=ICS_STORE_FILENAME, horizon_days=EXPAND_HORIZON_DAYS):
+        ''' Open (or create) the store '''
+
+        filename = os.path.expanduser(filename)
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        self.horizon_days = horizon_days
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                horizon TEXT NOT NULL,
+                version INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS occurrences (
+                path TEXT NOT NULL,
+                day TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS occurrences_day ON occurrences (day);
+            CREATE INDEX IF NOT EXISTS occurrences_path ON occurrences (path);''')
+        self.conn.commit()
+
+    @staticmethod
+    def source_files(source) -> list:
+        ''' The .ics file itself, or every .ics file below a directory '''
+
+        source = os.path.abspath(os.path.expanduser(source))
+        if not os.path.isdir(source):
+            return [source]
+
+        files = []
+        for root, _, names in os.walk(source):
+            files.extend(os.path.join(root, name) for name in names
+                         if name.lower().endswith(ICS_SUFFIX))
+
+        return sorted(files)
+
+    def update(self, source, until=None) -> Counter:
+        '''
+        Re-index the source files that changed, or whose expansion stops
+        before until, and forget files that disappeared
+        '''
+
+        horizon = max(datetime.now() + timedelta(days=self.horizon_days),
+                      until or datetime.min)
+        stats = Counter()
+        files = self.source_files(source)
+        root = os.path.abspath(os.path.expanduser(source))
+
+        known = {path: (mtime_ns, size, stored_horizon, version)
+                 for path, mtime_ns, size, stored_horizon, version in
+                 self.conn.execute('SELECT path, mtime_ns, size, horizon, version FROM files')}
+
+        with self.conn:
+            for path in files:
+                stat = os.stat(path)
+                stored = known.get(path)
+                if stored is not None and stored[:2] == (stat.st_mtime_ns, stat.st_size) and \
+                        stored[3] == STORE_VERSION and \
+                        (until is None or stored[2] >= until.isoformat()):
+                    stats['unchanged'] += 1
+                    continue
+
+                # Only loaded when something is (re)indexed, quick runs skip it
+                import logging # pylint: disable=import-outside-toplevel
+                logging.debug("indexing %s", path)
+                with open(path, encoding='utf-8', errors='replace') as handle:
+                    events = parse_events(handle.read())
+
+                self.conn.execute('DELETE FROM occurrences WHERE path = ?', (path,))
+                self.conn.executemany(
+                    'INSERT INTO occurrences (path, day, summary, start, end) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    ((path, start.date().isoformat(), summary, start.isoformat(),
+                      end.isoformat())
+                     for summary, start, end in event_occurrences(events, horizon)))
+                self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                  (path, stat.st_mtime_ns, stat.st_size, horizon.isoformat(),
+                                   STORE_VERSION))
+                stats['indexed'] += 1
+
+            for path in set(known) - set(files):
+                if path == root or path.startswith(os.path.join(root, '')):
+                    self.conn.execute('DELETE FROM occurrences WHERE path = ?', (path,))
+                    self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+                    stats['removed'] += 1
+
+        return stats
+
+    def occurrences(self, first: date, last: date, sources=None) -> list:
+        ''' (summary, start, end) of the occurrences starting on first..last inclusive '''
+
+        query = 'SELECT summary, start, end FROM occurrences WHERE day BETWEEN ? AND ?'
+        if sources is not None:
+            # A temp table, not one bound parameter per file: a CalDAV directory
+            # holds a file per event, past SQLite's bound variable limit
+            with self.conn:
+                self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (path TEXT PRIMARY KEY)')
+                self.conn.execute('DELETE FROM wanted')
+                self.conn.executemany('INSERT OR IGNORE INTO wanted VALUES (?)',
+                                      [(path,) for path in sources])
+            query += ' AND path IN (SELECT path FROM wanted)'
+
+        rows = self.conn.execute(query + ' ORDER BY start', (first.isoformat(), last.isoformat()))
+
+        return [(summary, datetime.fromisoformat(start), datetime.fromisoformat(end))
+                for summary, start, end in rows]
+
+    def close(self):
+        ''' Close the database '''
+
+        self.conn.close()
+
+def read_ics_occurrences(source, first: date, last: date, filename=ICS_STORE_FILENAME) -> list:
+    ''' Refresh the store from source and return the (summary, start, end) of the window '''
+
+    store = IcsStore(filename)
+    try:
+        until = datetime.combine(last, datetime.max.time())
+        store.update(source, until)
+        return store.occurrences(first, last, IcsStore.source_files(source))
+    finally:
+        store.close()
@@ -0,0 +1,164 @@
+'''
+Lightweight run profiling shared by the tools
+
+A Profiler times named phases (subprocess, parse, aggregate, network,
+render, ...), counts things (records, API calls, retries, bytes) and at
+the end writes one JSON line with the totals, peak RSS and the external
+commands run, optionally alongside a cProfile dump. When profiling is off
+the tools get NULL_PROFILER, whose methods do nothing, so the calls can
+stay in place for cron jobs.
+
+Usage:
+    profiler = instrument.from_args('tool', args)
+    with profiler.phase('parse'):
+        ...
+    profiler.count('records', len(rows))
+    profiler.finish()
+'''
+
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+def peak_rss_kb() -> int:
+    ''' Peak resident set size of this process in KiB '''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+class Profiler:
+    ''' Phase timings and counters of one run (thread safe) '''
+
+    def __init__(self, tool, output='-', cprofile=None):
+        self.tool = tool
+        self.output = output
+        self.phases = Counter()
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = False
+        self.profile = None
+        if cprofile:
+            import cProfile # pylint: disable=import-outside-toplevel
+            self.cprofile = cprofile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    @contextmanager
+    def phase(self, name):
+        ''' Add the time spent in the block to a named phase '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] += elapsed
+
+    def count(self, name, amount=1):
+        ''' Add to a named counter '''
+
+        with self.lock:
+            self.counters[name] += amount
+
+    def iterate(self, name, iterable):
+        ''' Yield from iterable, adding the time spent producing items to a phase '''
+
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self, **extra) -> dict:
+        ''' The run so far as a JSON serialisable dict '''
+
+        # No command was run when cmdrunner was never imported, which quick runs avoid
+        runner = sys.modules.get('cmdrunner')
+        commands = runner.timings() if runner is not None else []
+        with self.lock:
+            return {
+                'tool': self.tool,
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'wall_s': round(time.perf_counter() - self.started, 6),
+                'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                'counters': dict(self.counters),
+                'commands': [{'argv': call['argv'][:2], 'elapsed': round(call['elapsed'], 6),
+                              'cached': call['cached']} for call in commands],
+                'peak_rss_kb': peak_rss_kb(),
+                **extra
+            }
+
+    def finish(self, **extra) -> dict:
+        ''' Write the JSON line (and cProfile dump) once, returns the record '''
+
+        record = self.record(**extra)
+        if not self.finished:
+            self.finished = True
+            if self.profile is not None:
+                self.profile.disable()
+                self.profile.dump_stats(self.cprofile)
+            import json # pylint: disable=import-outside-toplevel
+            line = json.dumps(record, sort_keys=True)
+            if self.output in (None, '-'):
+                print(line, file=sys.stderr, flush=True)
+            else:
+                with open(self.output, 'a') as handle:
+                    handle.write(line + '\n')
+
+        return record
+
+class NullProfiler:
+    ''' Stand-in used when profiling is off, every call is a no-op '''
+
+    _context = nullcontext()
+
+    def phase(self, name): # pylint: disable=unused-argument
+        ''' Context manager that does nothing '''
+        return self._context
+
+    def count(self, name, amount=1):
+        ''' Ignore a counter '''
+
+    def iterate(self, name, iterable): # pylint: disable=unused-argument
+        ''' The iterable itself '''
+        return iterable
+
+    def finish(self, **extra): # pylint: disable=unused-argument
+        ''' Nothing to write '''
+        return None
+
+NULL_PROFILER = NullProfiler()
+
+def add_arguments(parser):
+    ''' --profile [FILE] and --cprofile FILE options '''
+
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='append per-phase timings and counters as a JSON line '
+                             'to FILE (stderr without FILE)')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='also dump cProfile statistics to FILE (implies --profile)')
+
+def from_args(tool, args):
+    ''' Profiler for the parsed options, NULL_PROFILER when profiling is off '''
+
+    if not args.profile and not args.cprofile:
+        return NULL_PROFILER
+
+    return Profiler(tool, args.profile or '-', args.cprofile)
@@ -0,0 +1,295 @@
+'''
+Columnar storage for Timewarrior intervals
+
+Intervals are kept as parallel int64 arrays of epoch seconds plus an id
+per distinct tag combination, instead of one dict with datetime objects
+per interval. Sums and group-bys run as array reductions, using NumPy for
+large stores when it is installed and plain loops over the arrays otherwise.
+NumPy is only imported once a store is big enough to repay its import time.
+'''
+
+import time
+from array import array
+from datetime import date, datetime, timedelta, timezone
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+# End value stored for an interval that is still running
+ACTIVE = -1
+SECONDS_PER_DAY = 86400
+# date.toordinal() of 1970-01-01
+EPOCH_ORDINAL = 719163
+GROUPINGS = ['day', 'week', 'month', 'tag']
+# Groupings the one-pass rollup can produce
+REPORT_GROUPINGS = GROUPINGS + ['tag-week']
+# Below this many intervals plain loops finish before `import numpy` would
+NUMPY_MIN_INTERVALS = 50000
+
+_day_cache = {}
+_numpy = None
+
+def numpy_for(size: int):
+    ''' NumPy for arrays of size elements, None if not installed or not worth it '''
+
+    global _numpy # pylint: disable=global-statement
+    if size < NUMPY_MIN_INTERVALS:
+        return None
+    if _numpy is None:
+        try:
+            import numpy # pylint: disable=import-outside-toplevel
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+
+    return _numpy or None
+
+def days_from_civil(year: int, month: int, day: int) -> int:
+    ''' Days since 1970-01-01 of a proleptic Gregorian date '''
+
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+
+    return era * 146097 + day_of_era - 719468
+
+def parse_stamp(stamp: str) -> int:
+    ''' Epoch seconds of a fixed format "YYYYMMDDTHHMMSSZ" UTC timestamp '''
+
+    day = _day_cache.get(stamp[:8])
+    if day is None:
+        day = _day_cache[stamp[:8]] = days_from_civil(int(stamp[:4]), int(stamp[4:6]),
+                                                      int(stamp[6:8])) * SECONDS_PER_DAY
+
+    return day + int(stamp[9:11]) * 3600 + int(stamp[11:13]) * 60 + int(stamp[13:15])
+
+class IntervalStore:
+    ''' Parallel arrays of interval ids, start/end epoch seconds and tag set ids '''
+
+    def __init__(self):
+        self.ids = array('q')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.tag_ids = array('i')
+        self.tag_sets = []
+        self.tag_set_ids = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, interval_id: int, start: str, end, tags):
+        ''' Add an interval from timestamp strings, end is None while running '''
+
+        self.append_epoch(interval_id, parse_stamp(start),
+                          ACTIVE if end is None else parse_stamp(end), tags)
+
+    def append_epoch(self, interval_id: int, start: int, end: int, tags):
+        ''' Add an interval from epoch seconds, end is ACTIVE while running '''
+
+        tags = tuple(tags)
+        tag_id = self.tag_set_ids.get(tags)
+        if tag_id is None:
+            tag_id = self.tag_set_ids[tags] = len(self.tag_sets)
+            self.tag_sets.append(tags)
+
+        self.ids.append(interval_id)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.tag_ids.append(tag_id)
+
+    @staticmethod
+    def naive_utc(epoch: int) -> datetime:
+        ''' Epoch seconds as the naive UTC datetime strptime used to produce '''
+
+        return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+    def interval(self, position: int) -> dict:
+        ''' One interval as the dict TwReporter has always handed out '''
+
+        task = {
+            'starttime': self.naive_utc(self.starts[position]),
+            'id': self.ids[position],
+            'tag': list(self.tag_sets[self.tag_ids[position]])
+        }
+
+        if self.ends[position] == ACTIVE:
+            task['duration'] = 'Active'
+        else:
+            task['stoptime'] = self.naive_utc(self.ends[position])
+            task['duration'] = task['stoptime'] - task['starttime']
+
+        return task
+
+    def positions_by_tag_set(self) -> list:
+        ''' For every tag set id, the positions of its intervals '''
+
+        positions = [[] for _ in self.tag_sets]
+        for position, tag_id in enumerate(self.tag_ids):
+            positions[tag_id].append(position)
+
+        return positions
+
+    def durations(self, positions=None, now=None):
+        ''' Seconds per interval (running ones up to now) as an array '''
+
+        now = int(now if now is not None else time.time())
+        np = numpy_for(len(self.starts) if positions is None else len(positions))
+
+        if np is not None:
+            starts = np.frombuffer(self.starts, dtype=np.int64)
+            ends = np.frombuffer(self.ends, dtype=np.int64)
+            if positions is not None:
+                index = np.fromiter(positions, dtype=np.int64)
+                starts, ends = starts[index], ends[index]
+            return np.where(ends == ACTIVE, now, ends) - starts
+
+        if positions is None:
+            positions = range(len(self.starts))
+
+        return array('q', ((now if self.ends[position] == ACTIVE else self.ends[position])
+                           - self.starts[position] for position in positions))
+
+    def total_seconds(self, positions=None, now=None) -> int:
+        ''' Total tracked seconds of the given positions (default all) '''
+
+        seconds = self.durations(positions, now)
+
+        return sum(seconds) if isinstance(seconds, array) else int(seconds.sum())
+
+    def local_days(self, positions=None):
+        ''' Local calendar day (days since epoch) each interval started on '''
+
+        starts = self.starts if positions is None else [self.starts[p] for p in positions]
+        np = numpy_for(len(starts))
+
+        # UTC offsets only change at DST boundaries, so look them up per hour
+        offsets = {}
+        def offset(hour):
+            if hour not in offsets:
+                offsets[hour] = time.localtime(hour * 3600).tm_gmtoff
+            return offsets[hour]
+
+        if np is not None:
+            starts = np.asarray(starts, dtype=np.int64)
+            hours, inverse = np.unique(starts // 3600, return_inverse=True)
+            local = starts + np.array([offset(int(hour)) for hour in hours],
+                                      dtype=np.int64)[inverse]
+            return local // SECONDS_PER_DAY
+
+        return array('q', ((start + offset(start // 3600)) // SECONDS_PER_DAY
+                           for start in starts))
+
+    def group_sums(self, by='day', positions=None, now=None) -> dict:
+        '''
+        Tracked seconds grouped by local day/ISO week/month of the start, or
+        by individual tag; returns {key: seconds} sorted by key
+        '''
+
+        if positions is not None:
+            positions = sorted(positions)
+        seconds = self.durations(positions, now)
+
+        if by == 'tag':
+            tag_ids = self.tag_ids if positions is None else [self.tag_ids[p] for p in positions]
+            per_set = sum_by_key(tag_ids, seconds)
+            totals = {}
+            for tag_id, total in per_set.items():
+                for tag in self.tag_sets[tag_id] or ('',):
+                    totals[tag] = totals.get(tag, 0) + total
+            return dict(sorted(totals.items()))
+
+        per_day = sum_by_key(self.local_days(positions), seconds)
+        if by == 'day':
+            return {date.fromordinal(day + EPOCH_ORDINAL).isoformat(): total
+                    for day, total in sorted(per_day.items())}
+
+        totals = {}
+        for day, total in sorted(per_day.items()):
+            key = period_key(date.fromordinal(day + EPOCH_ORDINAL), by)
+            totals[key] = totals.get(key, 0) + total
+
+        return totals
+
+    def rollup(self, groupings=REPORT_GROUPINGS, positions=None, now=None) -> dict:
+        '''
+        Several group-bys from one pass over the intervals
+
+        Durations and local days are computed once, reduced to seconds per
+        (day, tag set), and every grouping is derived from that small table.
+        Running intervals are clipped to now. Returns {grouping: {key: seconds}}
+        with (tag, week) keys for tag-week.
+        '''
+
+        if positions is not None:
+            positions = sorted(positions)
+        seconds = self.durations(positions, now)
+        days = self.local_days(positions)
+        tag_ids = self.tag_ids if positions is None else [self.tag_ids[p] for p in positions]
+
+        width = max(len(self.tag_sets), 1)
+        np = numpy_for(len(days))
+        if np is not None:
+            keys = np.asarray(days, dtype=np.int64) * width + np.asarray(tag_ids, dtype=np.int64)
+        else:
+            keys = [day * width + tag_id for day, tag_id in zip(days, tag_ids)]
+
+        results = {grouping: {} for grouping in groupings}
+        periods = {}
+        for key, total in sum_by_key(keys, seconds).items():
+            day, tag_id = divmod(key, width)
+            if day not in periods:
+                when = date.fromordinal(day + EPOCH_ORDINAL)
+                periods[day] = {by: period_key(when, by) for by in ('day', 'week', 'month')}
+            period = periods[day]
+
+            for grouping in ('day', 'week', 'month'):
+                if grouping in results:
+                    bucket = results[grouping]
+                    bucket[period[grouping]] = bucket.get(period[grouping], 0) + total
+            for tag in self.tag_sets[tag_id] or ('',):
+                if 'tag' in results:
+                    results['tag'][tag] = results['tag'].get(tag, 0) + total
+                if 'tag-week' in results:
+                    tag_week = (tag, period['week'])
+                    results['tag-week'][tag_week] = results['tag-week'].get(tag_week, 0) + total
+
+        return {grouping: dict(sorted(totals.items())) for grouping, totals in results.items()}
+
+def period_key(day: date, by: str) -> str:
+    ''' Label of the week or month a date belongs to '''
+
+    if by == 'week':
+        iso = day.isocalendar()
+        return f"{iso[0]}-W{iso[1]:02d}"
+    if by == 'month':
+        return day.strftime('%Y-%m')
+
+    return day.isoformat()
+
+def sum_by_key(keys, values) -> dict:
+    ''' Sum values per distinct key '''
+
+    np = numpy_for(len(keys))
+    if np is not None:
+        keys = np.asarray(keys, dtype=np.int64)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=np.asarray(values, dtype=np.float64),
+                           minlength=len(unique))
+        return {int(key): int(total) for key, total in zip(unique, sums)}
+
+    totals = {}
+    for key, value in zip(keys, values):
+        totals[key] = totals.get(key, 0) + value
+
+    return totals
+
+def format_seconds(seconds: int) -> str:
+    ''' Seconds in the H:MM:SS form timedelta prints '''
+
+    return str(timedelta(seconds=int(seconds)))
@@ -0,0 +1,123 @@
+'''
+Sweep-line engine for per day meeting time
+
+Adding up the length of every calendar event counts overlapping and double
+booked meetings twice. Here each event is split at midnight into per day
+pieces, the pieces of a day are sorted once and swept in order: every
+stretch of time is credited to the highest precedence category covering
+it (work before admin before focus by default), merged busy slots are
+kept, and the gaps inside the working day are the free slots.
+'''
+
+from datetime import datetime, time, timedelta
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+# Earlier categories win where events overlap
+PRECEDENCE = ('work', 'admin', 'focus')
+SECONDS_PER_DAY = 86400
+
+def split_at_midnight(start: datetime, end: datetime):
+    ''' Yield (day, start second, end second) pieces of an event '''
+
+    while start < end:
+        midnight = datetime.combine(start.date() + timedelta(days=1), time())
+        piece_end = min(end, midnight)
+        day_start = datetime.combine(start.date(), time())
+        yield (start.date(), int((start - day_start).total_seconds()),
+               int((piece_end - day_start).total_seconds()))
+        start = piece_end
+
+def pieces_by_day(events, precedence=PRECEDENCE) -> dict:
+    '''
+    Group (category, start, end) events into {day: [(start s, end s, rank)]},
+    categories not in precedence are ignored
+    '''
+
+    ranks = {category: rank for rank, category in enumerate(precedence)}
+    days = {}
+
+    for category, start, end in events:
+        rank = ranks.get(category)
+        if rank is None:
+            continue
+        for day, piece_start, piece_end in split_at_midnight(start, end):
+            days.setdefault(day, []).append((piece_start, piece_end, rank))
+
+    return days
+
+def sweep(pieces, categories: int):
+    '''
+    One pass over a day's pieces: seconds credited to each category rank
+    and the merged busy slots as [(start s, end s)]
+    '''
+
+    points = sorted([(start, 1, rank) for start, _, rank in pieces] +
+                    [(end, -1, rank) for _, end, rank in pieces])
+    active = [0] * categories
+    seconds = [0] * categories
+    busy = []
+    previous = None
+
+    for position, delta, rank in points:
+        if previous is not None and position > previous:
+            for covering in range(categories):
+                if active[covering]:
+                    seconds[covering] += position - previous
+                    if busy and busy[-1][1] == previous:
+                        busy[-1] = (busy[-1][0], position)
+                    else:
+                        busy.append((previous, position))
+                    break
+        active[rank] += delta
+        previous = position
+
+    return seconds, busy
+
+def free_slots(busy: list, window_start: int, window_end: int) -> list:
+    ''' Gaps between merged busy slots inside [window_start, window_end) seconds '''
+
+    slots = []
+    cursor = window_start
+    for start, end in busy:
+        if end <= cursor:
+            continue
+        if start >= window_end:
+            break
+        if start > cursor:
+            slots.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < window_end:
+        slots.append((cursor, window_end))
+
+    return slots
+
+def day_usage(events, precedence=PRECEDENCE, window=(0, SECONDS_PER_DAY)) -> dict:
+    '''
+    Per day minutes of every category plus 'busy' and 'free' minutes and
+    the free slots inside the working window (seconds since midnight):
+    {day: {'work': m, 'admin': m, 'focus': m, 'busy': m, 'free': m,
+           'free_slots': [(start s, end s)]}}
+    '''
+
+    usage = {}
+    for day, pieces in sorted(pieces_by_day(events, precedence).items()):
+        seconds, busy = sweep(pieces, len(precedence))
+        slots = free_slots(busy, *window)
+        totals = {category: seconds[rank] / 60 for rank, category in enumerate(precedence)}
+        totals['busy'] = sum(seconds) / 60
+        totals['free'] = sum(end - start for start, end in slots) / 60
+        totals['free_slots'] = slots
+        usage[day] = totals
+
+    return usage
+
+def format_slot(slot) -> str:
+    ''' "HH:MM-HH:MM" of a (start s, end s) slot '''
+
+    return '-'.join(f"{second // 3600:02d}:{second % 3600 // 60:02d}" for second in slot)
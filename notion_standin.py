@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+'''
+Local stand-in for the parts of the Notion API used by the project sync
+
+Implements database query (filters, sorts, pagination), page create and
+page patch in memory, with configurable latency, rate limiting and
+injected 429/5xx responses. Point NotionInterface (or notionconfig.BASE_URL)
+at the printed URL.
+'''
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Development"
+
+LOGGING_LEVEL = logging.ERROR
+LOGGING_FORMAT = '[%(levelname)s] %(asctime)s - %(funcName)s %(lineno)d - %(message)s'
+MAX_PAGE_SIZE = 100
+
+QUERY_PATH = re.compile(r'^/v1/databases/([^/]+)/query$')
+PAGE_PATH = re.compile(r'^/v1/pages/([^/]+)$')
+
+def now_iso() -> str:
+    ''' Current time in Notion's timestamp format '''
+
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def property_text(prop: dict) -> str:
+    ''' Plain text of a title/rich_text/select property '''
+
+    if 'select' in prop:
+        return (prop['select'] or {}).get('name') or ''
+
+    parts = prop.get('title', prop.get('rich_text', []))
+
+    return ''.join(part.get('plain_text', '') for part in parts)
+
+def with_plain_text(properties: dict) -> dict:
+    ''' Fill in plain_text on text parts like the real API does '''
+
+    for prop in properties.values():
+        for key in ('title', 'rich_text'):
+            for part in prop.get(key, []):
+                part.setdefault('plain_text', part.get('text', {}).get('content', ''))
+
+    return properties
+
+def matches(page: dict, db_filter: dict) -> bool:
+    ''' Evaluate a (subset of a) Notion query filter against a page '''
+
+    if 'and' in db_filter:
+        return all(matches(page, sub) for sub in db_filter['and'])
+    if 'or' in db_filter:
+        return any(matches(page, sub) for sub in db_filter['or'])
+
+    if 'timestamp' in db_filter:
+        value = page[db_filter['timestamp']]
+        condition = db_filter[db_filter['timestamp']]
+    else:
+        value = property_text(page['properties'].get(db_filter['property'], {}))
+        condition = next(v for k, v in db_filter.items() if k != 'property')
+
+    for operator, operand in condition.items():
+        if operator == 'contains' and operand not in value:
+            return False
+        if operator == 'equals' and operand != value:
+            return False
+        if operator in ('after', 'on_or_after', 'before', 'on_or_before'):
+            if not {'after': value > operand, 'on_or_after': value >= operand,
+                    'before': value < operand, 'on_or_before': value <= operand}[operator]:
+                return False
+
+    return True
+
+def sort_key(sort: dict):
+    ''' Key function for one entry of a query's "sorts" list '''
+
+    if 'timestamp' in sort:
+        return lambda page: page[sort['timestamp']]
+
+    return lambda page: property_text(page['properties'].get(sort['property'], {}))
+
+class NotionStandin:
+    ''' In-memory Notion workspace plus the failure model applied to requests '''
+
+    def __init__(self, latency=0.0, rate_limit=None, burst=3, inject_429=0.0,
+                 inject_5xx=0.0, retry_after=1):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.inject_429 = inject_429
+        self.inject_5xx = inject_5xx
+        self.retry_after = retry_after
+
+        self.lock = threading.Lock()
+        self.databases = {}
+        self.pages = {}
+        self.stats = Counter()
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def count(self, name, amount=1):
+        ''' Thread safe request counters '''
+
+        with self.lock:
+            self.stats[name] += amount
+
+    def reset_stats(self):
+        ''' Zero the request counters '''
+
+        with self.lock:
+            self.stats = Counter()
+
+    def throttled(self) -> bool:
+        ''' Apply the rate limit and random 429 injection '''
+
+        if self.inject_429 and random.random() < self.inject_429:
+            return True
+        if self.rate_limit is None:
+            return False
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate_limit)
+            self.updated = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+
+        return False
+
+    def query(self, database_id, body: dict) -> dict:
+        ''' POST /databases/{id}/query '''
+
+        with self.lock:
+            pages = [self.pages[page_id] for page_id in self.databases.get(database_id, [])]
+
+        if 'filter' in body:
+            pages = [page for page in pages if matches(page, body['filter'])]
+        for sort in reversed(body.get('sorts', [])):
+            pages.sort(key=sort_key(sort), reverse=sort.get('direction') == 'descending')
+
+        start = int(body.get('start_cursor') or 0)
+        end = start + min(body.get('page_size', MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+
+        return {
+            'object': 'list',
+            'results': pages[start:end],
+            'has_more': end < len(pages),
+            'next_cursor': str(end) if end < len(pages) else None
+        }
+
+    def create_page(self, body: dict) -> dict:
+        ''' POST /pages '''
+
+        timestamp = now_iso()
+        page = {
+            'object': 'page',
+            'id': str(uuid.uuid4()),
+            'created_time': timestamp,
+            'last_edited_time': timestamp,
+            'parent': body['parent'],
+            'properties': with_plain_text(body.get('properties', {}))
+        }
+
+        with self.lock:
+            self.pages[page['id']] = page
+            self.databases.setdefault(body['parent']['database_id'], []).append(page['id'])
+
+        return page
+
+    def update_page(self, page_id, body: dict):
+        ''' PATCH /pages/{id}, None if the page does not exist '''
+
+        with self.lock:
+            page = self.pages.get(page_id)
+            if page is None:
+                return None
+            page['properties'].update(with_plain_text(body.get('properties', {})))
+            page['last_edited_time'] = now_iso()
+
+        return page
+
+class StandinHandler(BaseHTTPRequestHandler):
+    ''' HTTP front end for a NotionStandin '''
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    standin = None
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        logging.debug(format, *args)
+
+    def reply(self, status, body: dict, headers=None):
+        ''' Send a JSON response '''
+
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def error(self, status, code, message, headers=None):
+        ''' Send a Notion style error object '''
+
+        self.reply(status, {'object': 'error', 'status': status, 'code': code,
+                            'message': message}, headers)
+
+    def handle_api(self, method):
+        ''' Common request path: read body, apply failure model, dispatch '''
+
+        standin = self.standin
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+
+        # Control endpoints are not counted or delayed
+        if self.path == '/_standin/stats':
+            with standin.lock:
+                stats = dict(standin.stats, pages=len(standin.pages))
+            self.reply(200, stats)
+            return
+        if self.path == '/_standin/reset':
+            standin.reset_stats()
+            self.reply(200, {})
+            return
+
+        standin.count('requests')
+        standin.count('bytes_in', length)
+
+        if standin.latency:
+            time.sleep(standin.latency)
+
+        if standin.throttled():
+            standin.count('429')
+            self.error(429, 'rate_limited', 'Rate limited',
+                       {'Retry-After': str(standin.retry_after)})
+            return
+        if standin.inject_5xx and random.random() < standin.inject_5xx:
+            standin.count('5xx')
+            self.error(502, 'bad_gateway', 'Injected failure')
+            return
+
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            self.error(400, 'invalid_json', 'Body failed to parse')
+            return
+
+        query = QUERY_PATH.match(self.path)
+        page = PAGE_PATH.match(self.path)
+
+        if method == 'POST' and query:
+            standin.count('query')
+            self.reply(200, standin.query(query.group(1), body))
+        elif method == 'POST' and self.path == '/v1/pages':
+            standin.count('create')
+            self.reply(200, standin.create_page(body))
+        elif method == 'PATCH' and page:
+            standin.count('update')
+            result = standin.update_page(page.group(1), body)
+            if result is None:
+                self.error(404, 'object_not_found', 'Could not find page')
+            else:
+                self.reply(200, result)
+        else:
+            self.error(400, 'invalid_request_url', 'Invalid request URL.')
+
+    def do_GET(self): # pylint: disable=invalid-name
+        ''' Control endpoints '''
+        self.handle_api('GET')
+
+    def do_POST(self): # pylint: disable=invalid-name
+        ''' Query and create '''
+        self.handle_api('POST')
+
+    def do_PATCH(self): # pylint: disable=invalid-name
+        ''' Page update '''
+        self.handle_api('PATCH')
+
+def start_server(standin, host='127.0.0.1', port=0) -> ThreadingHTTPServer:
+    ''' Serve a NotionStandin from a background thread, returns the server '''
+
+    handler = type('BoundStandinHandler', (StandinHandler,), {'standin': standin})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def main():
+    ''' Main function '''
+
+    parser = argparse.ArgumentParser(description='Local Notion API stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='requests per second before answering 429')
+    parser.add_argument('--burst', type=int, default=3)
+    parser.add_argument('--inject-429', type=float, default=0.0,
+                        help='fraction of requests answered with 429')
+    parser.add_argument('--inject-5xx', type=float, default=0.0,
+                        help='fraction of requests answered with 502')
+    parser.add_argument('--retry-after', type=float, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOGGING_LEVEL, format=LOGGING_FORMAT)
+
+    standin = NotionStandin(args.latency, args.rate_limit, args.burst, args.inject_429,
+                            args.inject_5xx, args.retry_after)
+    server = start_server(standin, args.host, args.port)
+
+    print(f"Listening on http://{args.host}:{server.server_port}/v1", flush=True)
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
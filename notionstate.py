@@ -0,0 +1,222 @@
+'''
+Local SQLite record of the OmniFocus projects already pushed to Notion,
+and a mirror of the project pages pulled back from Notion
+'''
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+# Mapped CSV columns that decide whether a project has to be pushed again
+STATE_FIELDS = ('status', 'name', 'relm', 'tag', 'note')
+
+def row_hash(task: dict) -> str:
+    ''' Content hash of the mapped row '''
+
+    content = json.dumps([task.get(field) for field in STATE_FIELDS])
+
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+class SyncStateStore:
+    '''
+    Pushed project state keyed by OmniFocus id
+
+    The whole table is held in memory for lookups; successful pushes are
+    queued from any thread and written by commit() in one transaction.
+    '''
+
+    def __init__(self, filename):
+        ''' Open (or create) the state database '''
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS pushed (
+                                ofid TEXT PRIMARY KEY,
+                                database_id TEXT NOT NULL,
+                                page_id TEXT NOT NULL,
+                                row_hash TEXT NOT NULL,
+                                pushed_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+        self.conn.commit()
+
+        self.known = {
+            ofid : (database_id, page_id, digest)
+            for ofid, database_id, page_id, digest in
+            self.conn.execute('SELECT ofid, database_id, page_id, row_hash FROM pushed')
+        }
+        self.pending = []
+        self.lock = threading.Lock()
+
+        logging.debug("Loaded state for %s projects from %s", len(self.known), filename)
+
+    def unchanged(self, task: dict, database_id) -> bool:
+        ''' True if the row was already pushed to this database as-is '''
+
+        known = self.known.get(task['ofid'])
+
+        return known is not None and known[0] == database_id and known[2] == row_hash(task)
+
+    def record(self, task: dict, database_id, page_id):
+        ''' Queue a successful push (safe to call from worker threads) '''
+
+        with self.lock:
+            self.pending.append((task['ofid'], database_id, page_id, row_hash(task)))
+
+    def commit(self) -> int:
+        ''' Write queued pushes in a single transaction, returns rows written '''
+
+        with self.lock:
+            batch, self.pending = self.pending, []
+
+        if batch:
+            with self.conn:
+                self.conn.executemany('''INSERT OR REPLACE INTO pushed
+                                         (ofid, database_id, page_id, row_hash)
+                                         VALUES (?, ?, ?, ?)''', batch)
+            for ofid, database_id, page_id, digest in batch:
+                self.known[ofid] = (database_id, page_id, digest)
+
+        return len(batch)
+
+    def close(self):
+        ''' Flush anything queued and close the database '''
+
+        self.commit()
+        self.conn.close()
+
+# Notion page fields kept in the mirror, besides page id and database
+MIRROR_FIELDS = ('ofid', 'status', 'name', 'relm', 'tag', 'note', 'archived',
+                 'last_edited_time')
+
+class NotionMirror:
+    '''
+    Local copy of the Notion project pages keyed by page id (and OmnifocusId)
+
+    Each database has a watermark, the newest last_edited_time pulled so
+    far, so the next pull only asks Notion for pages edited since then.
+    Pages and watermark are written in the same transaction, a pull that
+    stops half way resumes from the last batch it stored.
+
+    Queries never return archived or deleted pages, so an incremental pull
+    cannot see removals; a full pull marks every mirrored page it did not
+    get back as archived (full_pulled_at records when that last happened).
+    '''
+
+    def __init__(self, filename):
+        ''' Open (or create) the mirror tables '''
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS mirror (
+                                page_id TEXT PRIMARY KEY,
+                                database_id TEXT NOT NULL,
+                                ofid TEXT,
+                                status TEXT,
+                                name TEXT,
+                                relm TEXT,
+                                tag TEXT,
+                                note TEXT,
+                                archived INTEGER NOT NULL DEFAULT 0,
+                                last_edited_time TEXT NOT NULL,
+                                pulled_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS mirror_ofid ON mirror (ofid)')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS watermarks (
+                                database_id TEXT PRIMARY KEY,
+                                last_edited_time TEXT,
+                                full_pulled_at REAL)''')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(watermarks)')]
+        if 'full_pulled_at' not in columns:
+            self.conn.execute('ALTER TABLE watermarks ADD COLUMN full_pulled_at REAL')
+        self.conn.commit()
+
+    def watermark(self, database_id):
+        ''' Newest last_edited_time pulled from the database, None before the first pull '''
+
+        row = self.conn.execute('SELECT last_edited_time FROM watermarks WHERE database_id = ?',
+                                (database_id,)).fetchone()
+
+        return row[0] if row else None
+
+    def full_pull_due(self, database_id, max_age) -> bool:
+        ''' True if the database never had a full pull, or not in the last max_age seconds '''
+
+        row = self.conn.execute('SELECT full_pulled_at FROM watermarks WHERE database_id = ?',
+                                (database_id,)).fetchone()
+
+        return row is None or row[0] is None or time.time() - row[0] > max_age
+
+    def upsert(self, database_id, rows) -> int:
+        '''
+        Store page rows (dicts with page_id and MIRROR_FIELDS) and move the
+        watermark up to the newest of them, returns rows written
+        '''
+
+        if not rows:
+            return 0
+
+        newest = max(row['last_edited_time'] for row in rows)
+        with self.conn:
+            self.conn.executemany(f'''INSERT OR REPLACE INTO mirror
+                                      (page_id, database_id, {', '.join(MIRROR_FIELDS)})
+                                      VALUES (?, ?{', ?' * len(MIRROR_FIELDS)})''',
+                                  [[row['page_id'], database_id] +
+                                   [row[field] for field in MIRROR_FIELDS] for row in rows])
+            self.conn.execute('''INSERT INTO watermarks (database_id, last_edited_time)
+                                 VALUES (?, ?) ON CONFLICT (database_id) DO UPDATE
+                                 SET last_edited_time = max(coalesce(last_edited_time, ''),
+                                                            excluded.last_edited_time)''',
+                              (database_id, newest))
+
+        return len(rows)
+
+    def mark_removed(self, database_id, seen) -> int:
+        '''
+        After a full pull: mark the database's pages missing from seen (the
+        page ids it returned) as archived, returns pages newly marked
+        '''
+
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS seen (page_id TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM seen')
+            self.conn.executemany('INSERT OR IGNORE INTO seen VALUES (?)',
+                                  [(page_id,) for page_id in seen])
+            cursor = self.conn.execute('''UPDATE mirror SET archived = 1
+                                          WHERE database_id = ? AND archived = 0
+                                          AND page_id NOT IN (SELECT page_id FROM seen)''',
+                                       (database_id,))
+            self.conn.execute('''INSERT INTO watermarks (database_id, full_pulled_at)
+                                 VALUES (?, ?) ON CONFLICT (database_id) DO UPDATE
+                                 SET full_pulled_at = excluded.full_pulled_at''',
+                              (database_id, time.time()))
+            self.conn.execute('DELETE FROM seen')
+
+        return cursor.rowcount
+
+    def pages(self, database_ids=None, archived=False) -> list:
+        ''' Mirrored pages as dicts, ordered by database and name '''
+
+        query = f"SELECT page_id, database_id, {', '.join(MIRROR_FIELDS)} FROM mirror"
+        conditions, params = [], []
+        if not archived:
+            conditions.append('archived = 0')
+        if database_ids is not None:
+            conditions.append(f"database_id IN ({','.join('?' * len(database_ids))})")
+            params += list(database_ids)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        cursor = self.conn.execute(query + ' ORDER BY database_id, name', params)
+        columns = [column[0] for column in cursor.description]
+
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def close(self):
+        ''' Close the database '''
+
+        self.conn.close()
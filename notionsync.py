@@ -0,0 +1,1062 @@
+#!/usr/bin/env python3
+'''
+Script to Syncronize Projects between Omnifocus and Notion Project database
+
+Run as `productivity-tools notion-sync` or omnifocus-notion-project-sync.py
+
+--pull keeps a local mirror of the Notion project pages current by asking
+only for pages edited since the last pull, with a full read now and then
+(or with --full) to notice removed pages; --export-csv also writes the
+mirror in the OmniFocus export layout.
+'''
+import argparse
+import csv
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+import instrument
+from notionstate import NotionMirror, SyncStateStore
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+BASE_URL = "https://api.notion.com/v1"
+# Notion caps query pages at 100 results
+QUERY_PAGE_SIZE = 100
+NOTION_VERSION = '2021-08-16'
+# Connections kept open per host, and (connect, read) timeouts in seconds
+HTTP_POOL_SIZE = 8
+HTTP_TIMEOUT = (5, 30)
+# Notion allows an average of ~3 requests per second per integration
+NOTION_RATE_LIMIT = 3
+NOTION_RATE_BURST = 3
+WRITE_WORKERS = 4
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+STATE_DB_FILENAME = "~/.omnifocus-notion-sync.sqlite"
+# Pushed rows written to the state database per transaction
+STATE_BATCH_SIZE = 100
+# Pulled pages written to the mirror per transaction
+MIRROR_BATCH_SIZE = 100
+# Seconds between full pulls, which are what notice pages removed in Notion
+MIRROR_FULL_PULL_INTERVAL = 7 * 24 * 3600
+# Watch mode: seconds between checks when inotify is unavailable, and how
+# long the export must stay unchanged before it is considered complete
+WATCH_POLL_INTERVAL = 2
+WATCH_DEBOUNCE = 1
+LOGGING_LEVEL = logging.ERROR
+LOGGING_FORMAT = '[%(levelname)s] %(asctime)s - %(funcName)s %(lineno)d - %(message)s'
+
+SKIPLIST = ["Template", None ]
+
+# Imported by load_config() when a sync starts, not when this module loads
+notionconfig = None # pylint: disable=invalid-name
+
+of_task_status_mapping = {
+    "active status" : "In Progress",
+    "done status" : "Complete",
+    "dropped status" : "Dropped",
+    "on hold status" : "Hold"
+}
+
+# Map Tag to Relm
+of_relm_mapping = {
+    "Personal" : "Personal",
+    "HouseHold" : "Household",
+    "Projects" : "Personal",
+    "Education" : "Education",
+    "Work" : "Work",
+    "Template" : "Template",
+    "Personal Projects" : "Hobby"
+}
+
+# Notion values back to the OmniFocus export's, the first OmniFocus value wins
+notion_status_mapping = {notion: of for of, notion in reversed(of_task_status_mapping.items())}
+notion_relm_mapping = {notion: of for of, notion in reversed(of_relm_mapping.items())}
+
+# Columns of the OmniFocus export read by read_of_csv_file
+OF_CSV_COLUMNS = ['ofid', 'status', 'name', 'relm', 'tag', 'note']
+
+class NotionRequestError(Exception):
+    ''' A Notion API request still failed after every retry '''
+
+    def __init__(self, method, url, reason):
+        super().__init__(f"{method} {url}: {reason}")
+        self.method = method
+        self.url = url
+        self.reason = reason
+
+class TokenBucket:
+    ''' Thread safe token bucket limiting the request rate of all workers '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        ''' Block until a request may be sent '''
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Reserve a token now, sleep off any debt outside the lock
+            self.tokens -= 1
+            wait = max(self.paused_until - now, -self.tokens / self.rate, 0)
+
+        if wait:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        ''' Hold every caller back, e.g. for a Retry-After response '''
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def retry_delay(attempt, retry_after=None):
+    ''' Seconds to wait before the next attempt (Retry-After or jittered backoff) '''
+
+    if retry_after is not None:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+class NotionInterface:
+    ''' This class is used as an interface to the Notion API '''
+
+    instance_name = None
+    api_key = None
+    base_url = BASE_URL
+    timeout = HTTP_TIMEOUT
+    session = None
+    limiter = None
+
+    def __init__(self, instance_name, api_key, base_url=BASE_URL, session=None,
+                 pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT, limiter=None):
+        '''
+        Initialize class
+
+        One pooled keep-alive session is shared by every request (and every
+        worker thread); pass session/base_url to point at another transport.
+        '''
+        self.instance_name = instance_name
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.limiter = limiter
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.local = threading.local()
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                  pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+        session.headers.update({
+        'Notion-Version': NOTION_VERSION,
+        'Authorization': self.api_key,
+        'Content-Type': 'application/json',
+        'Connection': 'keep-alive'
+        })
+        self.session = session
+
+    def close(self):
+        ''' Release pooled connections '''
+        self.session.close()
+
+    def execute_request(self, method, url, payload, applied=None):
+        '''
+        Execute REST API calls
+
+        Requests pass through the rate limiter (if one is set); 429s honour
+        Retry-After, 5xx and connection errors are retried with backoff.
+
+        A read timeout, dropped connection or 5xx may come after Notion
+        already carried out the request. For requests that must not be
+        repeated (page creates) applied is called before resending after
+        such a failure; when it returns the result of the earlier attempt
+        that is returned instead of sending the request again.
+        '''
+
+        reason = None
+        uncertain = False
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                self.count('retries')
+                time.sleep(delay)
+                if uncertain and applied is not None:
+                    earlier = applied()
+                    if earlier is not None:
+                        logging.debug("%s %s: already applied, not resent", method, url)
+                        self.local.attempts = attempt
+                        return earlier
+
+            if self.limiter is not None:
+                self.limiter.acquire()
+            self.count('requests')
+
+            try:
+                response = self.session.request(method, url, data=payload,
+                                                timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                reason = err
+                # Only a connect timeout certainly never reached Notion
+                uncertain = not isinstance(err, requests.ConnectTimeout)
+                delay = retry_delay(attempt)
+                continue
+
+            uncertain = response.status_code >= 500
+            if response.status_code == 429:
+                reason = "rate limited"
+                delay = retry_delay(attempt, response.headers.get('Retry-After'))
+                self.count('throttled')
+                if self.limiter is not None:
+                    self.limiter.pause(delay)
+            elif response.status_code >= 500:
+                reason = f"HTTP {response.status_code}"
+                delay = retry_delay(attempt)
+            else:
+                self.local.attempts = attempt + 1
+                self.count('bytes', len(response.content))
+                return response.json()
+
+            logging.debug("%s %s: %s, retrying in %.2fs", method, url, reason, delay)
+
+        self.local.attempts = MAX_RETRIES + 1
+        raise NotionRequestError(method, url, reason)
+
+    def count(self, name, amount=1):
+        ''' Thread safe request counters '''
+
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    def last_attempts(self) -> int:
+        ''' Attempts used by the calling thread's most recent request '''
+
+        return getattr(self.local, 'attempts', 0)
+
+
+    def search_database_by_text_property(self, database_id, proj_property, value):
+        ''' Use Notion API to query by text propery in Database '''
+
+        url = self.base_url + "/databases/" + database_id + "/query"
+
+        payload = json.dumps({
+        "filter": {
+            "property": proj_property,
+            "text": {
+            "contains": value
+            }
+        }
+        })
+
+        result = self.execute_request('POST', url, payload)
+
+        return result
+
+
+    def query_database(self, database_id, db_filter=None, sorts=None):
+        '''
+        Page through every result of a database query (generator)
+
+        An error response raises NotionRequestError, a partial result would
+        look like missing projects and have them created again
+        '''
+
+        url = self.base_url + "/databases/" + database_id + "/query"
+
+        body = {"page_size": QUERY_PAGE_SIZE}
+        if db_filter is not None:
+            body['filter'] = db_filter
+        if sorts is not None:
+            body['sorts'] = sorts
+
+        while True:
+            result = self.execute_request('POST', url, json.dumps(body))
+
+            if result.get('object') == 'error':
+                raise NotionRequestError('POST', url, result.get('message'))
+
+            yield from result['results']
+
+            if not result.get('has_more'):
+                return
+            body['start_cursor'] = result['next_cursor']
+
+    def pages_edited_since(self, database_id, since=None):
+        '''
+        Pages of a database edited on or after since (every page when None),
+        oldest edit first (generator)
+        '''
+
+        db_filter = None
+        if since is not None:
+            db_filter = {"timestamp": "last_edited_time",
+                         "last_edited_time": {"on_or_after": since}}
+
+        yield from self.query_database(database_id, db_filter,
+                                       [{"timestamp": "last_edited_time",
+                                         "direction": "ascending"}])
+
+    def build_project_index(self, database_id) -> dict:
+        ''' Read a whole project database once and index it by OmnifocusId '''
+
+        index = {}
+        for page in self.query_database(database_id):
+            summary = page_summary(page)
+            if summary['ofid']:
+                index[summary['ofid']] = summary
+
+        logging.debug("Indexed %s projects in %s", len(index), database_id)
+
+        return index
+
+    def find_project_page(self, database_id, ofid):
+        ''' The page of a database with exactly this OmnifocusId, None if there is none '''
+
+        db_filter = {"property": "OmnifocusId", "rich_text": {"equals": ofid}}
+
+        return next(iter(self.query_database(database_id, db_filter)), None)
+
+    def create_page_db(self, page_parameters):
+        '''
+        Use Notion API to create new Project item in Notion Database
+
+        Retries after an uncertain failure first look the project up by
+        OmnifocusId, so a create that reached Notion is not made twice
+        '''
+
+        url = self.base_url + "/pages"
+
+        payload = json.dumps({
+        "parent": {
+            "database_id": page_parameters['databaseid']
+        },
+        "properties": {
+            "Name": {
+            "title": [
+                {
+                    "text": {
+                        "content" : page_parameters['name']
+                    }
+                }
+            ]
+            },
+            "Status": {
+                "select": {
+                    "name" : page_parameters['status']
+                }
+            },
+            "Relm": {
+                "select": {
+                    "name" : page_parameters['relm']
+                }
+            },
+            "OmnifocusId": {
+                "rich_text": [
+                    {
+                    "text" :{
+                        "content" : page_parameters['ofid']
+                    }
+                } ]
+            },
+        },
+        "children": []
+        })
+
+        result = self.execute_request('POST', url, payload, applied=lambda:
+                                      self.find_project_page(page_parameters['databaseid'],
+                                                             page_parameters['ofid']))
+        logging.debug(result)
+
+        return result
+
+    def update_page_status(self, page_id, status):
+        ''' Use Notion API to update status on a Project page '''
+
+        url = self.base_url + "/pages/" + page_id
+
+        payload = json.dumps({
+        "properties": {
+            "Status": {
+            "select": {
+                "name": status
+            }
+            }
+        }
+        })
+        result = self.execute_request('PATCH', url, payload)
+
+        return result
+
+    def check_if_project_exists(self, task: dict, databaseid) -> dict:
+        ''' Query Notion API to see of a Task exists with the ofid '''
+
+        search_result = self.search_database_by_text_property(databaseid, \
+            "OmnifocusId", task['ofid'])
+        logging.debug(search_result)
+
+        results = { }
+
+        if search_result['object'] != 'error' and search_result['results'] != []:
+            results['projid'] = search_result['results'][0]['id']
+            results['projstatus'] = search_result['results'][0]['properties']['Status']\
+                ['select']['name']
+            results['projname'] = search_result['results'][0]['properties']['Name']\
+                ['title'][0]['text']['content']
+            logging.debug ("%s", results)
+
+        else:
+            #create
+            results = None
+
+        return results
+
+class WriteScheduler:
+    ''' Bounded worker pool issuing Notion page writes concurrently '''
+
+    def __init__(self, notion_if, workers=WRITE_WORKERS):
+        self.notion_if = notion_if
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='notion-write')
+        # Keep the backlog of queued writes bounded
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.lock = threading.Lock()
+        self.stats = Counter(created=0, updated=0, failed=0, retried=0)
+        # (kind, ofid, attempts) of the writes that failed
+        self.failures = []
+        self.in_flight = set()
+
+    def submit(self, kind, ofid, func, *args, on_success=None):
+        ''' Queue a write; kind is the counter bumped when it succeeds '''
+
+        self.slots.acquire()
+        future = self.executor.submit(self.run, kind, ofid, func, args, on_success)
+        with self.lock:
+            self.in_flight.add(future)
+        future.add_done_callback(self.finished)
+
+        return future
+
+    def finished(self, future):
+        ''' Done callback: free the queue slot '''
+
+        with self.lock:
+            self.in_flight.discard(future)
+        self.slots.release()
+
+    def run(self, kind, ofid, func, args, on_success):
+        ''' Worker body: perform one write and record its outcome '''
+
+        try:
+            result = func(*args)
+        except (NotionRequestError, requests.RequestException) as err:
+            logging.error("%s of %s failed: %s", kind, ofid, err)
+            outcome = 'failed'
+        else:
+            if result.get('object') == 'error':
+                logging.error("%s of %s failed: %s", kind, ofid, result.get('message'))
+                outcome = 'failed'
+            else:
+                outcome = kind
+                if on_success is not None:
+                    on_success(result)
+
+        attempts = self.notion_if.last_attempts()
+
+        with self.lock:
+            self.stats[outcome] += 1
+            if attempts > 1:
+                self.stats['retried'] += 1
+            if outcome == 'failed':
+                self.failures.append((kind, ofid, attempts))
+
+        return outcome
+
+    def drain(self):
+        '''
+        Wait for queued writes, return and reset the statistics and the
+        failed writes so far
+        '''
+
+        with self.lock:
+            in_flight = list(self.in_flight)
+        wait(in_flight)
+
+        with self.lock:
+            stats, failures = self.stats, self.failures
+            self.stats = Counter(created=0, updated=0, failed=0, retried=0)
+            self.failures = []
+
+        return stats, failures
+
+    def close(self):
+        ''' Wait for queued writes, return the remaining statistics and failures '''
+
+        result = self.drain()
+        self.executor.shutdown(wait=True)
+
+        return result
+
+class ExportWatcher:
+    ''' Wait for the OmniFocus export to be rewritten (inotify, else polling) '''
+
+    def __init__(self, filename, poll_interval=WATCH_POLL_INTERVAL, debounce=WATCH_DEBOUNCE):
+        self.filename = os.path.abspath(filename)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.signature = export_signature(self.filename)
+        self.inotify = None
+
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                # Watch the directory, the export may be replaced rather than rewritten
+                self.inotify.add_watch(os.path.dirname(self.filename),
+                                       inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO |
+                                       inotify_flags.CREATE | inotify_flags.MODIFY)
+            except OSError as err:
+                logging.error("inotify unavailable, polling instead: %s", err)
+                self.inotify = None
+
+    def wait_for_event(self):
+        ''' Return on a filesystem event for the export or after poll_interval '''
+
+        if self.inotify is None:
+            time.sleep(self.poll_interval)
+            return
+
+        name = os.path.basename(self.filename)
+        for event in self.inotify.read(timeout=int(self.poll_interval * 1000)):
+            if event.name == name:
+                return
+
+    def wait(self):
+        ''' Block until the export has changed and stopped changing '''
+
+        while True:
+            self.wait_for_event()
+            signature = export_signature(self.filename)
+            if signature is None or signature == self.signature:
+                continue
+
+            # Debounce partial writes
+            while True:
+                time.sleep(self.debounce)
+                newer = export_signature(self.filename)
+                if newer == signature:
+                    break
+                signature = newer
+
+            if signature is not None:
+                self.signature = signature
+                return signature
+
+def export_signature(filename):
+    ''' (mtime, size) of a file, None if it does not exist '''
+
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+def property_text(properties: dict, name) -> str:
+    ''' Plain text of a title, rich_text, select or multi_select page property '''
+
+    prop = properties.get(name) or {}
+
+    if prop.get('select') is not None:
+        return prop['select'].get('name') or ''
+    if prop.get('multi_select') is not None:
+        return ', '.join(option.get('name', '') for option in prop['multi_select'])
+
+    parts = prop.get('title') or prop.get('rich_text') or []
+
+    return ''.join(part.get('plain_text', part.get('text', {}).get('content', ''))
+                   for part in parts)
+
+def page_summary(page: dict) -> dict:
+    ''' Reduce a Notion page object to the fields the sync cares about '''
+
+    properties = page.get('properties', {})
+    status = properties.get('Status', {}).get('select') or {}
+
+    return {
+        'projid' : page['id'],
+        'projstatus' : status.get('name'),
+        'projname' : property_text(properties, 'Name'),
+        'ofid' : property_text(properties, 'OmnifocusId')
+    }
+
+def mirror_row(page: dict) -> dict:
+    ''' A Notion page as a NotionMirror row '''
+
+    properties = page.get('properties', {})
+    summary = page_summary(page)
+
+    return {
+        'page_id' : page['id'],
+        'ofid' : summary['ofid'] or None,
+        'status' : summary['projstatus'],
+        'name' : summary['projname'],
+        'relm' : property_text(properties, 'Relm') or None,
+        'tag' : property_text(properties, 'Tag'),
+        'note' : property_text(properties, 'Note'),
+        'archived' : int(bool(page.get('archived') or page.get('in_trash'))),
+        'last_edited_time' : page['last_edited_time']
+    }
+
+def read_of_csv_file(of_csv_filename):
+    '''
+    Read in CSV export file of OmiFocus projects generated from assicated applescript
+
+    Rows are yielded one at a time as they are parsed
+    '''
+
+    # "ofid","Status","Name","relm","tag","Note"
+
+    with open(of_csv_filename, newline='', errors='ignore') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=',') #, quotechar='"')
+        yield from reader
+
+def clean_tags(tasks, stats: Counter):
+    ''' Pipeline stage: strip stray characters from the tag column '''
+
+    def clean_tag(tag):
+        tag = tag.strip("?")
+        tag = tag.strip(" ")
+
+        return tag
+
+    for task in tasks:
+        stats['read'] += 1
+        task['tag'] = clean_tag(task['tag'])
+
+        yield task
+
+def map_fields(tasks, stats: Counter):
+    ''' Pipeline stage: map OmniFocus status and relm to their Notion values '''
+
+    for task in tasks:
+        task['status'] = task_status_mapper(task['status'], of_task_status_mapping)
+        task['notion_relm'] = task_relm_mapper(task['relm'], of_relm_mapping)
+        if task['status'] is None:
+            stats['unmapped status'] += 1
+        logging.debug(task)
+
+        yield task
+
+def filter_skipped(tasks, stats: Counter):
+    ''' Pipeline stage: drop templates and projects marked "notion: skip" '''
+
+    for task in tasks:
+        if task['tag'] in SKIPLIST or task['relm'] in SKIPLIST or "notion: skip" in task['note']:
+            logging.debug("Skipping Notion Check")
+            stats['skipped'] += 1
+            continue
+
+        yield task
+
+def route_to_database(tasks, database_id, work_database_id):
+    ''' Pipeline stage: pair every project with the Notion database it belongs in '''
+
+    #https://www.notion.so/suidroot/4d4430579537403cb77007746d19268b?v=985bb580f90e401b8456193b2a1deb9f
+
+    for task in tasks:
+        if task['relm'] == 'Work':
+            logging.debug("Work task")
+            yield task, work_database_id
+        else:
+            yield task, database_id
+
+def filter_unchanged(routed, state, stats: Counter):
+    ''' Pipeline stage: drop projects already pushed unchanged to their database '''
+
+    for task, database in routed:
+        if state is not None and state.unchanged(task, database):
+            stats['unchanged'] += 1
+            continue
+
+        yield task, database
+
+def of_task_pipeline(of_csv_filename, database_id, work_database_id, state=None,
+                     stats=None):
+    '''
+    Lazy ingestion pipeline yielding (task, database) pairs that need syncing
+
+    Nothing is read until the result is iterated; per-stage drop counts are
+    collected in stats.
+    '''
+
+    if stats is None:
+        stats = Counter()
+
+    tasks = read_of_csv_file(of_csv_filename)
+    tasks = clean_tags(tasks, stats)
+    tasks = map_fields(tasks, stats)
+    tasks = filter_skipped(tasks, stats)
+    routed = route_to_database(tasks, database_id, work_database_id)
+
+    return filter_unchanged(routed, state, stats)
+
+def task_status_mapper(of_task_text: str, status_mapping: dict) -> str:
+    ''' Normalize Project status to assoicated Notion state '''
+
+    try:
+        status = status_mapping[of_task_text]
+    except KeyError:
+        logging.error("Status Error: %s", of_task_text)
+        status = None
+
+    return status
+
+def task_relm_mapper(of_folder_text: str, relm_mapping: dict) -> str:
+    ''' Normalize Project relm to assoicated Notion relm '''
+
+    try:
+        relm = relm_mapping[of_folder_text]
+    except KeyError:
+        logging.error("Relm Error: %s", of_folder_text)
+        relm = None
+
+    return relm
+
+def notion_database_stuff(notion_if, task, database, project_index=None, scheduler=None,
+                          state=None):
+    ''' Check for Project in DB and Update or create it '''
+
+    if project_index is None:
+        notion_results = notion_if.check_if_project_exists(task, database)
+    else:
+        notion_results = project_index.get(task['ofid'])
+
+    if notion_results is None:
+        logging.debug("Creating task %s", task)
+
+        page_parameters= {
+            'databaseid' : database,
+            'status' : task['status'],
+            'name' : task['name'],
+            'ofid' : task['ofid'],
+            'relm' : task['notion_relm'] if 'notion_relm' in task \
+                else task_relm_mapper(task['relm'], of_relm_mapping)
+        }
+
+        def created(result):
+            if project_index is not None:
+                project_index[task['ofid']] = page_summary(result)
+            if state is not None:
+                state.record(task, database, result['id'])
+
+        if scheduler is None:
+            result = notion_if.create_page_db(page_parameters)
+            if result.get('object') == 'page':
+                created(result)
+            else:
+                logging.error("Create of %s failed: %s", task['ofid'], result.get('message'))
+        else:
+            scheduler.submit('created', task['ofid'], notion_if.create_page_db,
+                             page_parameters, on_success=created)
+    else:
+        if notion_results['projstatus'] != task['status']:
+            logging.debug("Updating Status for task %s", task)
+
+            def updated(_):
+                notion_results['projstatus'] = task['status']
+                if state is not None:
+                    state.record(task, database, notion_results['projid'])
+
+            if scheduler is None:
+                result = notion_if.update_page_status(notion_results['projid'], task['status'])
+                if result.get('object') == 'page':
+                    updated(result)
+                else:
+                    logging.error("Update of %s failed: %s", task['ofid'], result.get('message'))
+            else:
+                scheduler.submit('updated', task['ofid'], notion_if.update_page_status,
+                                 notion_results['projid'], task['status'], on_success=updated)
+        elif state is not None:
+            state.record(task, database, notion_results['projid'])
+
+def load_config():
+    ''' Import notionconfig (the user's settings) on first use '''
+
+    global notionconfig # pylint: disable=global-statement,invalid-name
+    if notionconfig is None:
+        try:
+            notionconfig = importlib.import_module('notionconfig')
+        except ModuleNotFoundError as err:
+            # The installed CLI does not have the working directory on sys.path
+            if err.name != 'notionconfig' or os.getcwd() in sys.path:
+                raise
+            sys.path.append(os.getcwd())
+            notionconfig = importlib.import_module('notionconfig')
+
+    return notionconfig
+
+def sync_projects(notion_if, scheduler, state, project_indexes, full=False,
+                  profiler=instrument.NULL_PROFILER):
+    '''
+    Push new and changed projects from the export to Notion
+
+    project_indexes is filled lazily and reused by later calls, returns the
+    pipeline and write statistics and the failed writes of this pass
+    '''
+
+    config = load_config()
+    pipeline_stats = Counter()
+    before = Counter(notion_if.stats)
+
+    tasks = of_task_pipeline(config.OF_CSV_FILENAME, config.DATABASE_ID,
+                             config.work_db, None if full else state,
+                             pipeline_stats)
+
+    for task, database in profiler.iterate('parse', tasks):
+        # One paged scan per database instead of one search per project, only
+        # done once a database actually has a changed row
+        if database not in project_indexes:
+            with profiler.phase('network'):
+                project_indexes[database] = notion_if.build_project_index(database)
+
+        with profiler.phase('schedule'):
+            notion_database_stuff(notion_if, task, database, project_indexes[database],
+                                  scheduler, state)
+
+        if len(state.pending) >= STATE_BATCH_SIZE:
+            with profiler.phase('state'):
+                state.commit()
+
+    with profiler.phase('network'):
+        stats, failures = scheduler.drain()
+    stats['requests'] = notion_if.stats['requests'] - before['requests']
+    with profiler.phase('state'):
+        state.commit()
+
+    profiler.count('records', pipeline_stats['read'])
+    for name, counter in (('api calls', 'requests'), ('retries', 'retries'),
+                          ('throttled', 'throttled'), ('bytes', 'bytes')):
+        profiler.count(name, notion_if.stats[counter] - before[counter])
+
+    return pipeline_stats, stats, failures
+
+def pull_projects(notion_if, mirror, database_ids, full=False,
+                  full_interval=MIRROR_FULL_PULL_INTERVAL,
+                  profiler=instrument.NULL_PROFILER) -> Counter:
+    '''
+    Bring the mirror up to date with pages edited in Notion since each
+    database's watermark, returns pages pulled and removed and requests made
+
+    A database is read in full when full is set, on its first pull and once
+    full_interval seconds have passed since its last full pull; that is how
+    pages archived or deleted in Notion are found and marked archived.
+    '''
+
+    stats = Counter()
+    before = notion_if.stats['requests']
+
+    for database_id in database_ids:
+        full_pull = full or mirror.full_pull_due(database_id, full_interval)
+        # on_or_after: Notion rounds last_edited_time to the minute, so pages
+        # edited in the watermark's minute are read again rather than missed
+        pages = notion_if.pages_edited_since(
+            database_id, None if full_pull else mirror.watermark(database_id))
+        seen = set()
+        batch = []
+        for page in profiler.iterate('network', pages):
+            seen.add(page['id'])
+            batch.append(mirror_row(page))
+            if len(batch) >= MIRROR_BATCH_SIZE:
+                with profiler.phase('state'):
+                    stats['pulled'] += mirror.upsert(database_id, batch)
+                batch = []
+        with profiler.phase('state'):
+            stats['pulled'] += mirror.upsert(database_id, batch)
+            # Only reached when the whole database was read
+            if full_pull:
+                stats['removed'] += mirror.mark_removed(database_id, seen)
+
+    stats['requests'] = notion_if.stats['requests'] - before
+    profiler.count('records', stats['pulled'])
+    profiler.count('api calls', stats['requests'])
+
+    return stats
+
+def write_mirror_csv(mirror, filename, database_ids=None) -> int:
+    '''
+    Write the mirrored projects in the OmniFocus export layout that
+    read_of_csv_file reads, returns the number of rows
+    '''
+
+    rows = 0
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, OF_CSV_COLUMNS)
+        writer.writeheader()
+        for page in mirror.pages(database_ids):
+            writer.writerow({
+                'ofid' : page['ofid'] or '',
+                'status' : notion_status_mapping.get(page['status'], page['status'] or ''),
+                'name' : page['name'],
+                'relm' : notion_relm_mapping.get(page['relm'], page['relm'] or ''),
+                'tag' : page['tag'],
+                'note' : page['note']
+            })
+            rows += 1
+
+    return rows
+
+def print_sync_stats(pipeline_stats, stats, failures=()):
+    ''' Display the result of a sync pass '''
+
+    print(f"OmniFocus export: {pipeline_stats['read']} read, "
+          f"{pipeline_stats['skipped']} skipped, {pipeline_stats['unchanged']} unchanged, "
+          f"{pipeline_stats['unmapped status']} with unmapped status")
+    print(f"Notion sync: {stats['created']} created, {stats['updated']} updated, "
+          f"{stats['failed']} failed, {stats['retried']} retried "
+          f"({stats['requests']} requests)")
+    for kind, ofid, attempts in failures:
+        print(f"  failed: {'create' if kind == 'created' else 'update'} of {ofid} "
+              f"after {attempts} attempt{'s' if attempts != 1 else ''}")
+
+def pull_main(notion_if, config, export_csv=None, full=False,
+              profiler=instrument.NULL_PROFILER):
+    ''' --pull/--export-csv: refresh the mirror of both project databases '''
+
+    database_ids = list(dict.fromkeys(database for database in
+                                      (config.DATABASE_ID, config.work_db) if database))
+    mirror = NotionMirror(os.path.expanduser(
+        getattr(config, 'STATE_DB_FILENAME', STATE_DB_FILENAME)))
+
+    try:
+        stats = pull_projects(notion_if, mirror, database_ids, full,
+                              getattr(config, 'MIRROR_FULL_PULL_INTERVAL',
+                                      MIRROR_FULL_PULL_INTERVAL), profiler)
+        print(f"Notion pull: {stats['pulled']} pages changed, {stats['removed']} removed "
+              f"({stats['requests']} requests)")
+
+        if export_csv:
+            with profiler.phase('render'):
+                rows = write_mirror_csv(mirror, export_csv, database_ids)
+            print(f"Wrote {rows} projects to {export_csv}")
+    except NotionRequestError as err:
+        # Batches stored before the failure keep their watermark
+        print(f"Notion pull failed: {err}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        mirror.close()
+        notion_if.close()
+        profiler.finish()
+
+def main():
+    ''' Main Function '''
+
+    parser = argparse.ArgumentParser(description='Sync OmniFocus projects to Notion')
+    parser.add_argument('--full', action='store_true',
+                        help='ignore the local state and re-check every project '
+                             '(with --pull: read every page and find removed ones)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and sync whenever the export is rewritten')
+    parser.add_argument('--pull', action='store_true',
+                        help='instead of syncing, update the local mirror with the '
+                             'projects edited in Notion since the last pull')
+    parser.add_argument('--export-csv', metavar='FILE',
+                        help='pull, then write the mirror as an OmniFocus style CSV')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    if (args.pull or args.export_csv) and args.watch:
+        parser.error("--pull/--export-csv cannot be combined with --watch")
+
+    logging.basicConfig(level=LOGGING_LEVEL, format=LOGGING_FORMAT)
+    profiler = instrument.from_args('notion-sync', args)
+    config = load_config()
+
+    notion_if = NotionInterface(config.NOTION_ID, config.API_KEY,
+                                base_url=getattr(config, 'BASE_URL', BASE_URL),
+                                pool_size=getattr(config, 'HTTP_POOL_SIZE', HTTP_POOL_SIZE),
+                                timeout=getattr(config, 'HTTP_TIMEOUT', HTTP_TIMEOUT),
+                                limiter=TokenBucket(
+                                    getattr(config, 'NOTION_RATE_LIMIT', NOTION_RATE_LIMIT),
+                                    getattr(config, 'NOTION_RATE_BURST', NOTION_RATE_BURST)))
+
+    if args.pull or args.export_csv:
+        pull_main(notion_if, config, args.export_csv, args.full, profiler)
+        return
+
+    scheduler = WriteScheduler(notion_if,
+                               workers=getattr(config, 'WRITE_WORKERS', WRITE_WORKERS))
+    state = SyncStateStore(os.path.expanduser(
+        getattr(config, 'STATE_DB_FILENAME', STATE_DB_FILENAME)))
+
+    watcher = None
+    if args.watch:
+        watcher = ExportWatcher(config.OF_CSV_FILENAME,
+                                getattr(config, 'WATCH_POLL_INTERVAL', WATCH_POLL_INTERVAL),
+                                getattr(config, 'WATCH_DEBOUNCE', WATCH_DEBOUNCE))
+
+    # Indexes, session and state stay warm between passes in watch mode
+    project_indexes = {}
+    full = args.full
+
+    try:
+        while True:
+            try:
+                pipeline_stats, stats, failures = sync_projects(notion_if, scheduler, state,
+                                                                project_indexes, full, profiler)
+                print_sync_stats(pipeline_stats, stats, failures)
+                full = False
+            except (NotionRequestError, requests.RequestException) as err:
+                if watcher is None:
+                    print(f"Notion sync aborted: {err}", file=sys.stderr)
+                    sys.exit(1)
+                # Keep watching; finish this pass's writes and re-query next time
+                logging.error("Sync pass failed, retrying on the next export change: %s", err)
+                scheduler.drain()
+                state.commit()
+                project_indexes.clear()
+
+            if watcher is None:
+                break
+            watcher.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.close()
+        state.close()
+        notion_if.close()
+        profiler.finish()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,306 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
+'''
+Import actions from an OmniFocus CSV export into Taskwarrior
 
+The whole export is converted to Taskwarrior JSON and fed to `task import`
+in a few chunked invocations instead of one `task add` per action. Every
+task gets a UUID derived from its OmniFocus Task ID and a local index of
+imported rows means re-runs only send new or changed actions.
+'''
+
+import argparse
 import csv
-import subprocess
-from taskw import TaskWarrior
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+import cmdrunner
+import instrument
+
 
-DRYRUN = "" 
-#DRYRUN = True
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2017"
+__version__ = "0.2"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
 
 OFCSV = "/Users/benmason/Desktop/OmniFocus.csv"
+TASK_COMMAND = "task"
+# Seconds one `task import` chunk may take
+IMPORT_TIMEOUT = 300
+IMPORT_INDEX_FILENAME = "~/.omnifocus-taskwarrior.sqlite"
+# Namespace for uuid5(OmniFocus Task ID), changing it re-creates every task
+OF_UUID_NAMESPACE = uuid.UUID('6f6d6e69-666f-6375-732d-7461736b7772')
+# Tasks per `task import` invocation
+IMPORT_CHUNK_SIZE = 1000
+LOGGING_LEVEL = logging.ERROR
+LOGGING_FORMAT = '[%(levelname)s] %(asctime)s - %(funcName)s %(lineno)d - %(message)s'
+
+OF_DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+TW_DATE_FORMAT = "%Y%m%dT%H%M%SZ"
 
-w = TaskWarrior()
 # Task ID,Type,Name,Status,Project,Context,Start Date,Due Date,Completion Date,Duration,Flagged,Notes
-with open(OFCSV, 'rU') as filehandle:
-    reader = csv.reader(filehandle, dialect='excel', quotechar='"')
-    for line in reader:
-        if line[1] == 'Action':
-            project = line[4]
-            task = line[2]
-            context = '+@'+line[5].replace(" ", "")
-            startdate = line[6]
-            duedate = line[7]
-            duration = line[9]
-            note = line[11]
-            tags = line[12].split(", ")
-
-
-# Built-in attributes are:
-#   description:    Task description text
-#   status:         Status of task - pending, completed, deleted, waiting
-#   project:        Project name
-#   priority:       Priority
-#   due:            Due date
-#   recur:          Recurrence frequency
-#   until:          Expiration date of a task
-#   limit:          Desired number of rows in report, or 'page'
-#   wait:           Date until task becomes pending
-#   entry:          Date task was created
-#   end:            Date task was completed/deleted
-#   start:          Date task was started
-#   scheduled:      Date task is scheduled to start
-#   modified:       Date task was last modified
-#   depends:        Other tasks that this task depends upon
-
-            #command = "task add project:\"" + project + "\" tags:\"" + ',"'.join(tags) + "\" " + task
-            
-            
-            command = ["task","add", "project:\"" + project + "\"", "tags:\"" + '","'.join(tags)+"\"",task]
-            if DRYRUN == True:
-                print command
-            else:
-                print command
-                output = subprocess.check_output(command)
-                print output
-
-                #currtask = w.task_add(task, project=project, tags=tags)
-
-                #if duedate != '':
-                #    id, task = w.get_task(id=currtask['id'])
-                #    task['due'] = duedate
-                #    date.append("due="+duedate)
-                #if startdate != '':
-                #    id, task = w.get_task(id=currtask['id'])
-                #    task['due'] = duedate
-                #    date.append("scheduled:"+startdate)
-
-                #if duration != '':
-                #    id, task = w.get_task(id=currtask['id'])
-                #    task['due'] = duedate
+COL_TASK_ID = 0
+COL_TYPE = 1
+COL_NAME = 2
+COL_STATUS = 3
+COL_PROJECT = 4
+COL_CONTEXT = 5
+COL_START = 6
+COL_DUE = 7
+COL_COMPLETED = 8
+COL_DURATION = 9
+COL_FLAGGED = 10
+COL_NOTES = 11
+COL_TAGS = 12
+
+def of_date_to_tw(of_date: str) -> str:
+    ''' Convert an OmniFocus export date to Taskwarrior's UTC format '''
+
+    if not of_date:
+        return None
+
+    try:
+        parsed = datetime.strptime(of_date, OF_DATE_FORMAT)
+    except ValueError:
+        logging.error("Date Error: %s", of_date)
+        return None
+
+    return parsed.astimezone(timezone.utc).strftime(TW_DATE_FORMAT)
+
+def column(line: list, index: int) -> str:
+    ''' Field of a CSV row, empty if the row is short '''
+
+    return line[index].strip() if index < len(line) else ''
+
+def task_uuid(of_task_id: str) -> str:
+    ''' Stable Taskwarrior UUID for an OmniFocus Task ID '''
+
+    return str(uuid.uuid5(OF_UUID_NAMESPACE, of_task_id))
+
+def line_hash(line: list) -> str:
+    ''' Content hash of an export row '''
+
+    return hashlib.sha1(json.dumps(line).encode('utf-8')).hexdigest()
+
+def first_known_date(line: list) -> str:
+    '''
+    Earliest start or completion date of a row (the export has no creation
+    date) in Taskwarrior's format, now if it has neither or they are later
+    '''
+
+    now = datetime.now(timezone.utc).strftime(TW_DATE_FORMAT)
+    dates = [of_date_to_tw(column(line, index)) for index in (COL_START, COL_COMPLETED)]
+
+    # The fixed width UTC format sorts chronologically
+    return min([date for date in dates if date] + [now])
+
+def action_to_task(line: list, entry=None) -> dict:
+    ''' Convert one OmniFocus Action row into a Taskwarrior JSON task '''
+
+    if entry is None:
+        entry = first_known_date(line)
+
+    task = {
+        'uuid': task_uuid(column(line, COL_TASK_ID)),
+        'description': column(line, COL_NAME),
+        'status': 'pending',
+        'entry': entry
+    }
+
+    completed = of_date_to_tw(column(line, COL_COMPLETED))
+    if completed:
+        task['status'] = 'completed'
+        task['end'] = completed
+
+    if column(line, COL_PROJECT):
+        task['project'] = column(line, COL_PROJECT)
+
+    tags = [tag for tag in column(line, COL_TAGS).split(", ") if tag]
+    if column(line, COL_CONTEXT):
+        tags.append('@' + column(line, COL_CONTEXT).replace(" ", ""))
+    if tags:
+        task['tags'] = tags
+
+    for key, index in (('scheduled', COL_START), ('due', COL_DUE)):
+        date = of_date_to_tw(column(line, index))
+        if date:
+            task[key] = date
+
+    annotations = []
+    if column(line, COL_DURATION):
+        annotations.append("Duration: " + column(line, COL_DURATION))
+    if column(line, COL_NOTES):
+        annotations.append(column(line, COL_NOTES))
+    if annotations:
+        task['annotations'] = [{'entry': entry, 'description': text} for text in annotations]
+
+    return task
+
+class ImportIndex:
+    ''' OmniFocus Task IDs already imported, with their row hash, entry date and status '''
+
+    def __init__(self, filename):
+        ''' Open (or create) the index database '''
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS imported (
+                                of_task_id TEXT PRIMARY KEY,
+                                uuid TEXT NOT NULL,
+                                row_hash TEXT NOT NULL,
+                                entry TEXT NOT NULL,
+                                status TEXT)''')
+        # Indexes written before status was kept
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(imported)')]
+        if 'status' not in columns:
+            self.conn.execute('ALTER TABLE imported ADD COLUMN status TEXT')
+        self.conn.commit()
+
+        self.known = {
+            of_task_id : (row_hash, entry, status)
+            for of_task_id, row_hash, entry, status in
+            self.conn.execute('SELECT of_task_id, row_hash, entry, status FROM imported')
+        }
+
+    def record(self, rows: list):
+        ''' Store (of_task_id, row_hash, task) rows of one import in a transaction '''
+
+        with self.conn:
+            self.conn.executemany('''INSERT OR REPLACE INTO imported
+                                     (of_task_id, uuid, row_hash, entry, status)
+                                     VALUES (?, ?, ?, ?, ?)''',
+                                  [(of_task_id, task['uuid'], digest, task['entry'],
+                                    task['status'])
+                                   for of_task_id, digest, task in rows])
+        for of_task_id, digest, task in rows:
+            self.known[of_task_id] = (digest, task['entry'], task['status'])
+
+    def close(self):
+        ''' Close the database '''
+
+        self.conn.close()
+
+def changed_actions(lines, index, stats: Counter, full=False):
+    ''' Yield (of_task_id, row_hash, task) for actions new or changed since the last import '''
+
+    for line in lines:
+        of_task_id = column(line, COL_TASK_ID)
+        digest = line_hash(line)
+        known = index.known.get(of_task_id)
+
+        if not full and known is not None and known[0] == digest:
+            stats['unchanged'] += 1
+            continue
+
+        # Keep the original entry date when re-importing a changed action
+        task = action_to_task(line, known[1] if known is not None else None)
+        if known is None:
+            stats['new'] += 1
+        elif task['status'] == 'completed' and known[2] != 'completed':
+            # Only rows completed since the last import, not every changed completed row
+            stats['completed'] += 1
+        else:
+            stats['updated'] += 1
+
+        yield of_task_id, digest, task
+
+def read_of_actions(of_csv_filename):
+    ''' Yield the Action rows of an OmniFocus CSV export '''
+
+    with open(of_csv_filename, newline='', errors='ignore') as filehandle:
+        reader = csv.reader(filehandle, dialect='excel', quotechar='"')
+        for line in reader:
+            if column(line, COL_TYPE) == 'Action':
+                yield line
+
+def chunked(items, size):
+    ''' Split an iterable into lists of at most size items '''
+
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def import_tasks(tasks: list, dryrun=False, profiler=instrument.NULL_PROFILER) -> str:
+    ''' Feed a list of tasks to one `task import` invocation '''
+
+    payload = json.dumps(tasks)
+    profiler.count('bytes', len(payload))
+
+    if dryrun:
+        print(payload)
+        return ''
+
+    # rc.confirmation off: bulk imports would otherwise prompt
+    command = [TASK_COMMAND, "rc.confirmation=off", "rc.verbose=nothing", "import", "-"]
+    logging.debug("cli: %s (%s tasks)", command, len(tasks))
+
+    with profiler.phase('subprocess'):
+        return cmdrunner.run(command, timeout=IMPORT_TIMEOUT, stdin=payload).stdout
+
+def main():
+    ''' Main Function '''
+
+    parser = argparse.ArgumentParser(description='Import OmniFocus actions into Taskwarrior')
+    parser.add_argument('csv_file', nargs='?', default=OFCSV, help='OmniFocus CSV export')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                        help='tasks per task import invocation')
+    parser.add_argument('--dryrun', action='store_true',
+                        help='print the Taskwarrior JSON instead of importing it')
+    parser.add_argument('--full', action='store_true',
+                        help='ignore the import index and send every action')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOGGING_LEVEL, format=LOGGING_FORMAT)
+    profiler = instrument.from_args('of-to-tw', args)
+
+    index = ImportIndex(os.path.expanduser(IMPORT_INDEX_FILENAME))
+    stats = Counter()
+    actions = changed_actions(read_of_actions(args.csv_file), index, stats, args.full)
+    imported = 0
+    failure = None
+
+    try:
+        for number, chunk in enumerate(chunked(profiler.iterate('parse', actions),
+                                               args.chunk_size), 1):
+            try:
+                output = import_tasks([task for _, _, task in chunk], args.dryrun, profiler)
+            except cmdrunner.CommandError as err:
+                # Earlier chunks are in Taskwarrior and the index, a re-run resumes here
+                failure = f"task import of chunk {number} ({len(chunk)} tasks) failed: {err}\n" \
+                          f"{imported} tasks of earlier chunks were imported"
+                break
+            if output:
+                print(output, end='')
+            if not args.dryrun:
+                with profiler.phase('state'):
+                    index.record(chunk)
+                imported += len(chunk)
+    finally:
+        index.close()
+        profiler.count('records', sum(stats.values()))
+        profiler.finish(**stats)
+
+    if failure is not None:
+        print(failure, file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{stats['new']} new, {stats['updated']} updated, {stats['completed']} completed, "
+          f"{stats['unchanged']} unchanged")
 
 # Task ID,Type,Name,Status,Project,Context,Start Date,Due Date,Completion Date,Duration,Flagged,Notes
 # 1,Project,Miscellaneous,active,,,,,,,0,
 # 1.1,Action,Check on finances,,Miscellaneous,Scheduled,2017-06-12 12:00:00 +0000,,,,0,
+
+if __name__ == "__main__":
+    main()
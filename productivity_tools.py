@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+'''
+One entry point for the productivity tools
+
+Each subcommand is the matching script's main(), so its options are
+unchanged. Only the module of the subcommand being run is imported, and
+the tools import their heavy dependencies (tabulate, requests, numpy,
+notionconfig) when they first need them, so a quick query pays for one
+interpreter and little else.
+
+Usage:
+productivity-tools velocity 1
+productivity-tools tw-search -t lastmonth meeting
+productivity-tools notion-sync --watch
+productivity-tools of-to-tw ~/omnifocus.csv --dryrun
+productivity-tools dashboard --refresh 300
+'''
+
+import importlib
+import sys
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+PROG = "productivity-tools"
+# subcommand: (module, description)
+COMMANDS = {
+    'velocity': ('CalculatePersonalVelocity', "personal velocity from the calendar"),
+    'tw-search': ('tw_text_reporter', "search and total Timewarrior intervals"),
+    'notion-sync': ('notionsync', "sync OmniFocus projects to Notion"),
+    'of-to-tw': ('omnifocuscsvtotaskwarrier', "import OmniFocus tasks into Taskwarrior"),
+    'dashboard': ('dashboard', "velocity, Timewarrior and meetings at a glance")
+}
+
+def usage() -> str:
+    ''' Subcommand list, built without importing any of them '''
+
+    width = max(len(command) for command in COMMANDS)
+    lines = [f"usage: {PROG} <command> [options]", "", "commands:"]
+    lines += [f"  {command:<{width}}  {description}"
+              for command, (_, description) in COMMANDS.items()]
+    lines += ["", f"'{PROG} <command> -h' shows the options of a command"]
+
+    return '\n'.join(lines)
+
+def main(argv=None) -> int:
+    ''' Main function '''
+
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    if argv[0] == '--version':
+        print(f"{PROG} {__version__}")
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"{PROG}: unknown command '{argv[0]}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    command, options = argv[0], argv[1:]
+    module = importlib.import_module(COMMANDS[command][0])
+
+    # The tools parse sys.argv themselves, prog shows up in their --help
+    sys.argv = [f"{PROG} {command}"] + options
+    result = module.main()
+
+    return result if isinstance(result, int) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+'''
+Tests for the .ics event store and its recurrence expansion
+'''
+
+import sqlite3
+from datetime import date, datetime
+
+import icsstore
+
+
+def write_event(path, uid, start, end, summary='Meeting'):
+    ''' An .ics file with a single event '''
+
+    path.write_text('\r\n'.join(['BEGIN:VCALENDAR', 'BEGIN:VEVENT', f"UID:{uid}",
+                                 f"SUMMARY:{summary}", f"DTSTART:{start}", f"DTEND:{end}",
+                                 'END:VEVENT', 'END:VCALENDAR']) + '\r\n')
+
+def test_occurrences_of_more_sources_than_sqlite_variables(tmp_path):
+    ''' Source lists past SQLite's bound variable limit still query '''
+
+    calendar = tmp_path / 'calendar'
+    calendar.mkdir()
+    write_event(calendar / 'a.ics', 'a', '20261013T090000', '20261013T100000')
+    write_event(calendar / 'b.ics', 'b', '20261014T090000', '20261014T093000')
+
+    store = icsstore.IcsStore(str(tmp_path / 'store.sqlite'))
+    # The limit of older builds, newer ones allow 32766 or more
+    if hasattr(store.conn, 'setlimit'):
+        store.conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    try:
+        store.update(str(calendar), datetime(2026, 10, 31))
+        sources = icsstore.IcsStore.source_files(str(calendar))
+        sources += [str(calendar / f"missing-{number}.ics") for number in range(2000)]
+        occurrences = store.occurrences(date(2026, 10, 12), date(2026, 10, 16), sources)
+        # Files outside sources are left out
+        only_a = store.occurrences(date(2026, 10, 12), date(2026, 10, 16), sources[:1])
+    finally:
+        store.close()
+
+    assert occurrences == [('Meeting', datetime(2026, 10, 13, 9), datetime(2026, 10, 13, 10)),
+                           ('Meeting', datetime(2026, 10, 14, 9), datetime(2026, 10, 14, 9, 30))]
+    assert only_a == occurrences[:1]
+
+def starts(rule, start, until=datetime(2030, 1, 1)):
+    ''' Occurrence starts of the built-in expander '''
+
+    return list(icsstore.simple_rrule(rule, start, until))
+
+def test_rrule_interval_and_count():
+    ''' Every other day, four times '''
+
+    assert starts('FREQ=DAILY;INTERVAL=2;COUNT=4', datetime(2023, 1, 2, 9)) == \
+        [datetime(2023, 1, day, 9) for day in (2, 4, 6, 8)]
+
+def test_rrule_byday_starts_mid_week():
+    ''' BYDAY days before DTSTART in its first week are skipped '''
+
+    # 2023-01-04 is a Wednesday
+    assert starts('FREQ=WEEKLY;BYDAY=MO,WE,FR;COUNT=5', datetime(2023, 1, 4, 10)) == \
+        [datetime(2023, 1, day, 10) for day in (4, 6, 9, 11, 13)]
+
+def test_rrule_byday_with_interval_and_until():
+    ''' Tuesdays and Thursdays of every other week up to UNTIL inclusive '''
+
+    assert starts('FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,TH;UNTIL=20230126T140000',
+                  datetime(2023, 1, 3, 14)) == \
+        [datetime(2023, 1, day, 14) for day in (3, 5, 17, 19)]
+
+def test_rrule_until_date_covers_the_whole_day():
+    ''' A DATE UNTIL includes occurrences later that day '''
+
+    assert starts('FREQ=DAILY;UNTIL=20230104', datetime(2023, 1, 2, 16)) == \
+        [datetime(2023, 1, day, 16) for day in (2, 3, 4)]
+
+def test_rrule_utc_until_with_a_zoned_start():
+    ''' UTC UNTIL is compared in DTSTART's zone '''
+
+    start = icsstore.parse_datetime('20230102T090000', {'TZID': 'America/New_York'})[0]
+    # 14:00 UTC is 09:00 in New York
+    series = starts('FREQ=DAILY;UNTIL=20230104T140000Z', start,
+                    until=datetime(2030, 1, 1, tzinfo=start.tzinfo))
+
+    assert [when.day for when in series] == [2, 3, 4]
+
+def test_rrule_stops_at_the_horizon():
+    ''' Open ended series end at until '''
+
+    assert starts('FREQ=WEEKLY', datetime(2023, 1, 2, 9), until=datetime(2023, 1, 20)) == \
+        [datetime(2023, 1, day, 9) for day in (2, 9, 16)]
+
+def test_rrule_monthly_skips_short_months():
+    ''' The 31st only happens in months that have one '''
+
+    assert starts('FREQ=MONTHLY;COUNT=3', datetime(2023, 1, 31, 9)) == \
+        [datetime(2023, 1, 31, 9), datetime(2023, 3, 31, 9), datetime(2023, 5, 31, 9)]
+
+def test_rrule_outside_the_subset_keeps_the_first_occurrence():
+    ''' Rules the expander does not know give DTSTART only '''
+
+    assert starts('FREQ=MONTHLY;BYMONTHDAY=15', datetime(2023, 1, 15, 9)) == \
+        [datetime(2023, 1, 15, 9)]
+
+SERIES = '''BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:standup
+SUMMARY:Standup
+DTSTART:20230102T090000
+DTEND:20230102T091500
+RRULE:FREQ=DAILY;COUNT=5
+EXDATE:20230103T090000
+END:VEVENT
+BEGIN:VEVENT
+UID:standup
+RECURRENCE-ID:20230104T090000
+SUMMARY:Standup (moved)
+DTSTART:20230104T110000
+DTEND:20230104T113000
+END:VEVENT
+END:VCALENDAR
+'''
+
+def test_exdate_and_recurrence_id(monkeypatch):
+    ''' EXDATE drops an occurrence, a RECURRENCE-ID override replaces one '''
+
+    # The built-in expander, whether or not python-dateutil is installed
+    monkeypatch.setattr(icsstore, '_rrule', False)
+    events = icsstore.parse_events(SERIES.replace('\n', '\r\n'))
+    occurrences = sorted(icsstore.event_occurrences(events, datetime(2023, 12, 31)),
+                         key=lambda occurrence: occurrence[1])
+
+    assert occurrences == [
+        ('Standup', datetime(2023, 1, 2, 9), datetime(2023, 1, 2, 9, 15)),
+        ('Standup (moved)', datetime(2023, 1, 4, 11), datetime(2023, 1, 4, 11, 30)),
+        ('Standup', datetime(2023, 1, 5, 9), datetime(2023, 1, 5, 9, 15)),
+        ('Standup', datetime(2023, 1, 6, 9), datetime(2023, 1, 6, 9, 15))]
@@ -0,0 +1,76 @@
+'''
+Tests for the sweep-line meeting time engine
+'''
+
+from datetime import date, datetime
+
+from meetingintervals import day_usage, format_slot, free_slots, split_at_midnight, sweep
+
+WINDOW = (8 * 3600, 17 * 3600)
+DAY = date(2017, 8, 8)
+
+
+def at(hour, minute=0, day=8):
+    ''' A time in August 2017 '''
+
+    return datetime(2017, 8, day, hour, minute)
+
+def test_overlapping_events_count_once():
+    ''' Double booked time is credited once, to the higher precedence category '''
+
+    usage = day_usage([('focus', at(9), at(12)), ('work', at(10), at(11)),
+                       ('admin', at(10, 30), at(13))], window=WINDOW)[DAY]
+
+    # 09-10 focus, 10-11 work, 11-13 admin (admin ranks above focus)
+    assert (usage['work'], usage['admin'], usage['focus']) == (60, 120, 60)
+    assert usage['busy'] == 240
+    assert usage['free_slots'] == [(8 * 3600, 9 * 3600), (13 * 3600, 17 * 3600)]
+    assert usage['free'] == 300
+
+def test_touching_events_merge_into_one_busy_slot():
+    ''' Back to back meetings leave no free gap between them '''
+
+    seconds, busy = sweep([(9 * 3600, 10 * 3600, 0), (10 * 3600, 11 * 3600, 1)], 3)
+
+    assert seconds == [3600, 3600, 0]
+    assert busy == [(9 * 3600, 11 * 3600)]
+
+def test_zero_length_event_takes_no_time():
+    ''' An event ending when it starts is neither busy time nor a split in a free slot '''
+
+    usage = day_usage([('work', at(10), at(10))], window=WINDOW)
+
+    assert usage == {}
+    assert list(split_at_midnight(at(10), at(10))) == []
+
+    usage = day_usage([('work', at(10), at(10)), ('admin', at(14), at(15))],
+                      window=WINDOW)[DAY]
+
+    assert (usage['work'], usage['admin'], usage['busy']) == (0, 60, 60)
+    assert usage['free_slots'] == [(8 * 3600, 14 * 3600), (15 * 3600, 17 * 3600)]
+
+def test_multi_day_event_is_split_at_midnight():
+    ''' A three day event fills the middle day and the ends of the others '''
+
+    usage = day_usage([('work', at(15), at(10, day=10))], window=WINDOW)
+
+    assert sorted(usage) == [date(2017, 8, 8), date(2017, 8, 9), date(2017, 8, 10)]
+    assert usage[date(2017, 8, 8)]['work'] == 9 * 60
+    assert usage[date(2017, 8, 9)]['work'] == 24 * 60
+    assert usage[date(2017, 8, 9)]['free_slots'] == []
+    assert usage[date(2017, 8, 10)]['work'] == 10 * 60
+    assert usage[date(2017, 8, 10)]['free_slots'] == [(10 * 3600, 17 * 3600)]
+
+def test_ignored_categories_are_skipped():
+    ''' Categories outside the precedence list are not busy time '''
+
+    assert day_usage([('holiday', at(9), at(17))], window=WINDOW) == {}
+
+def test_free_slots_clip_to_the_window():
+    ''' Busy time outside the working window does not create slots '''
+
+    busy = [(6 * 3600, 9 * 3600), (16 * 3600, 20 * 3600)]
+
+    assert free_slots(busy, *WINDOW) == [(9 * 3600, 16 * 3600)]
+    assert free_slots([], *WINDOW) == [WINDOW]
+    assert format_slot((9 * 3600, 16 * 3600 + 30 * 60)) == '09:00-16:30'
@@ -0,0 +1,167 @@
+'''
+Tests for notionsync's rate limiter and its 429/5xx retry path, against the
+local Notion stand-in
+'''
+
+import pytest
+
+import notionsync
+from notion_standin import NotionStandin, start_server
+
+DATABASE = 'projects'
+
+
+class FakeClock:
+    ''' time.monotonic/time.sleep stand-in, sleeping advances the clock '''
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        ''' Current fake time '''
+        return self.now
+
+    def sleep(self, seconds):
+        ''' Record the wait and move time on '''
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    ''' Fake time for TokenBucket '''
+
+    fake = FakeClock()
+    monkeypatch.setattr(notionsync.time, 'monotonic', fake.monotonic)
+    monkeypatch.setattr(notionsync.time, 'sleep', fake.sleep)
+
+    return fake
+
+@pytest.fixture
+def standin():
+    ''' A stand-in served on a free local port '''
+
+    workspace = NotionStandin(retry_after=0.01)
+    server = start_server(workspace)
+    workspace.base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    yield workspace
+    server.shutdown()
+    server.server_close()
+
+def interface(standin, limiter=None):
+    ''' A NotionInterface pointed at the stand-in '''
+
+    return notionsync.NotionInterface('test', 'secret', base_url=standin.base_url,
+                                      limiter=limiter)
+
+def query(notion_if, standin):
+    ''' One database query through execute_request '''
+
+    return notion_if.execute_request('POST', f"{standin.base_url}/databases/{DATABASE}/query",
+                                     '{}')
+
+def test_bucket_allows_a_burst_then_paces(clock):
+    ''' capacity requests go straight out, later ones wait 1/rate each '''
+
+    bucket = notionsync.TokenBucket(rate=4, capacity=2)
+    for _ in range(4):
+        bucket.acquire()
+
+    assert clock.sleeps == [pytest.approx(0.25), pytest.approx(0.25)]
+
+def test_bucket_refills_while_idle(clock):
+    ''' Time without requests earns tokens back, up to capacity '''
+
+    bucket = notionsync.TokenBucket(rate=2, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 60
+    for _ in range(3):
+        bucket.acquire()
+
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+def test_bucket_pause_holds_callers_back(clock):
+    ''' A pause (Retry-After) delays the next acquire though tokens remain '''
+
+    bucket = notionsync.TokenBucket(rate=10, capacity=10)
+    bucket.pause(3)
+    bucket.pause(1)
+    bucket.acquire()
+
+    assert clock.sleeps == [pytest.approx(3)]
+
+def test_retry_delay_prefers_retry_after(monkeypatch):
+    ''' Retry-After is used as given, garbage falls back to capped backoff '''
+
+    monkeypatch.setattr(notionsync.random, 'uniform', lambda low, high: high)
+
+    assert notionsync.retry_delay(0, '2.5') == 2.5
+    assert notionsync.retry_delay(0, '-1') == 0
+    assert notionsync.retry_delay(2, 'soon') == notionsync.RETRY_BASE_DELAY * 4
+    assert notionsync.retry_delay(30) == notionsync.RETRY_MAX_DELAY
+
+def test_429_is_retried_after_retry_after(standin, monkeypatch):
+    ''' A rate limited request succeeds once the stand-in lets it through '''
+
+    waits = []
+    standin.inject_429 = 1.0
+    notion_if = interface(standin)
+
+    def throttle_twice(seconds):
+        # Stop throttling once two Retry-After waits have been honoured
+        waits.append(seconds)
+        if len(waits) == 2:
+            standin.inject_429 = 0.0
+
+    monkeypatch.setattr(notionsync.time, 'sleep', throttle_twice)
+    result = query(notion_if, standin)
+
+    assert result['results'] == []
+    assert waits == [0.01, 0.01]
+    assert standin.stats['429'] == 2
+    assert notion_if.stats['throttled'] == 2
+    assert notion_if.last_attempts() == 3
+
+def test_429_pauses_the_shared_limiter(standin, monkeypatch):
+    ''' Retry-After holds back every worker using the limiter, not just the caller '''
+
+    paused = []
+    limiter = notionsync.TokenBucket(rate=1000, capacity=1000)
+    monkeypatch.setattr(limiter, 'pause', paused.append)
+    monkeypatch.setattr(notionsync, 'MAX_RETRIES', 1)
+    standin.inject_429 = 1.0
+
+    with pytest.raises(notionsync.NotionRequestError, match='rate limited'):
+        query(interface(standin, limiter), standin)
+
+    assert paused == [0.01, 0.01]
+
+def test_5xx_backs_off_and_gives_up(standin, monkeypatch):
+    ''' Server errors are retried MAX_RETRIES times with backoff, then raise '''
+
+    monkeypatch.setattr(notionsync, 'MAX_RETRIES', 3)
+    monkeypatch.setattr(notionsync, 'RETRY_BASE_DELAY', 0.001)
+    standin.inject_5xx = 1.0
+    notion_if = interface(standin)
+
+    with pytest.raises(notionsync.NotionRequestError, match='HTTP 502'):
+        query(notion_if, standin)
+
+    assert standin.stats['5xx'] == 4
+    assert notion_if.stats['retries'] == 3
+    assert notion_if.last_attempts() == 4
+
+def test_rate_limited_standin_with_a_matching_bucket(standin):
+    ''' A client bucket at the server's rate is never throttled '''
+
+    standin.rate_limit = 50
+    standin.burst = 3
+    standin.tokens = 3
+    notion_if = interface(standin, notionsync.TokenBucket(rate=40, capacity=3))
+
+    for _ in range(10):
+        query(notion_if, standin)
+
+    assert standin.stats['429'] == 0
+    assert notion_if.stats['requests'] == 10
@@ -0,0 +1,71 @@
+'''
+Tests for tw_text_reporter's incremental `timew export` parser
+'''
+
+import json
+
+import pytest
+
+from tw_text_reporter import iter_json_array
+
+INTERVALS = [
+    {'id': 2, 'start': '20230102T090000Z', 'end': '20230102T100000Z',
+     'tags': ['meeting', 'quote " and \\ backslash', 'brackets ] [ , }']},
+    {'id': 1, 'start': '20230103T090000Z', 'tags': ['café ☕', 'line\nbreak']},
+]
+
+
+def split_every(text, size):
+    ''' text in chunks of size characters '''
+
+    return [text[offset:offset + size] for offset in range(0, len(text), size)]
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64])
+def test_values_split_across_chunks(size):
+    ''' Every element comes back whole however the text is chunked '''
+
+    text = json.dumps(INTERVALS, indent=1)
+
+    assert list(iter_json_array(split_every(text, size))) == INTERVALS
+
+def test_every_split_point():
+    ''' Two chunks, split at each position, including inside escapes '''
+
+    text = json.dumps(INTERVALS)
+    for split in range(len(text) + 1):
+        assert list(iter_json_array([text[:split], text[split:]])) == INTERVALS, split
+
+def test_numbers_and_literals_at_a_chunk_end():
+    ''' 12|34 is one number and tr|ue one literal, not two values '''
+
+    chunks = ['[12', '34, tr', 'ue, nu', 'll, 5', ']']
+
+    assert list(iter_json_array(chunks)) == [1234, True, None, 5]
+
+def test_escapes_inside_strings():
+    ''' Escaped quotes, backslashes and unicode escapes split mid-escape '''
+
+    chunks = ['["a\\', '"b", "c\\\\', '", "\\u00', 'e9", "\\', 'n"]']
+
+    assert list(iter_json_array(chunks)) == ['a"b', 'c\\', 'é', '\n']
+
+def test_empty_array_and_whitespace():
+    ''' No intervals, with the layout timew prints '''
+
+    assert list(iter_json_array(['[\n', '\n]\n'])) == []
+
+def test_elements_are_yielded_before_the_end():
+    ''' The first interval arrives before later chunks are read '''
+
+    def chunks():
+        yield '[{"id": 1}, '
+        raise AssertionError("read past the first element")
+
+    assert next(iter_json_array(chunks())) == {'id': 1}
+
+@pytest.mark.parametrize('text', ['[{"id": 1}, {"id"', '[{"id": 1}, {"id": 2}', '[1, 2'])
+def test_truncated_output_raises(text):
+    ''' Output cut off inside or between elements is an error '''
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(split_every(text, 4)))
@@ -0,0 +1,76 @@
+'''
+Tests for CalculatePersonalVelocity's calendar processing
+'''
+
+import datetime
+
+import CalculatePersonalVelocity as velocity
+
+
+def test_zero_length_entry_counts_nothing():
+    ''' "10:00 - 10:00" is an empty entry, not a 24 hour meeting '''
+
+    # 08/08/2017 is a Tuesday
+    work, admin, focus, free = velocity.processicaldata([
+        "Planning~08/08/2017 at 10:00 - 10:00",
+        "Planning~08/09/2017 at 10:00 - 11:00"])
+
+    assert work['Tuesday'] == 0
+    assert work['Wednesday'] == 60
+    assert free['Tuesday'] == velocity.DAYLENGTH * 60
+    assert sum(admin.values()) == sum(focus.values()) == 0
+
+def test_zero_length_entry_keeps_its_day():
+    ''' Equal start and end times stay on the day they are listed for '''
+
+    events = list(velocity.icalevents(["Planning~08/08/2017 at 10:00 - 10:00"]))
+
+    assert events == [('work', datetime.datetime(2017, 8, 8, 10, 0),
+                       datetime.datetime(2017, 8, 8, 10, 0))]
+
+def test_entry_past_midnight_wraps():
+    ''' An end time before the start time ends on the next day '''
+
+    events = list(velocity.icalevents(["Release~08/08/2017 at 23:00 - 01:00"]))
+
+    assert events == [('work', datetime.datetime(2017, 8, 8, 23, 0),
+                       datetime.datetime(2017, 8, 9, 1, 0))]
+
+def write_ics(path, events):
+    ''' A calendar of (summary, DTSTART, DTEND) events '''
+
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0']
+    for number, (summary, start, end) in enumerate(events):
+        lines += ['BEGIN:VEVENT', f"UID:{number}@test", f"SUMMARY:{summary}",
+                  f"DTSTART:{start}", f"DTEND:{end}", 'END:VEVENT']
+    path.write_text('\r\n'.join(lines + ['END:VCALENDAR']) + '\r\n')
+
+def ics_week(tmp_path, monkeypatch, events):
+    ''' Usage of the week of 08/07/2017 read from an .ics file '''
+
+    monkeypatch.setattr(velocity, 'ICSSTORELOC', str(tmp_path / 'store.sqlite'))
+    write_ics(tmp_path / 'calendar.ics', events)
+    entries = velocity.geticaldata(start=datetime.datetime(2017, 8, 7),
+                                   end=datetime.datetime(2017, 8, 11),
+                                   ics=str(tmp_path / 'calendar.ics'))
+
+    return velocity.weekusage(entries)[(2017, 32)]
+
+def test_ics_summary_with_tilde(tmp_path, monkeypatch):
+    ''' A ~ in an .ics SUMMARY is just part of the name '''
+
+    usage = ics_week(tmp_path, monkeypatch,
+                     [('Sync ~ weekly', '20170808T100000', '20170808T110000')])
+
+    assert usage['work']['Tuesday'] == 60
+
+def test_ics_event_longer_than_a_day(tmp_path, monkeypatch):
+    ''' A multi-day .ics event keeps its full length '''
+
+    usage = ics_week(tmp_path, monkeypatch,
+                     [('Offsite', '20170808T090000', '20170810T120000')])
+
+    assert usage['work']['Tuesday'] == 15 * 60
+    assert usage['work']['Wednesday'] == 24 * 60
+    assert usage['work']['Thursday'] == 12 * 60
+    assert usage['free']['Wednesday'] == 0
@@ -0,0 +1,328 @@
+'''
+Read Timewarrior's monthly data files directly
+
+Timewarrior keeps one ~/.timewarrior/data/YYYY-MM.data file per month with
+lines like:
+
+    inc 20220110T140000Z - 20220110T150000Z # tag1 "tag two"
+
+Only the months overlapping the requested range are opened (memory-mapped)
+and their lines are parsed straight into an IntervalStore. Parsed months
+can be kept in an on-disk SegmentCache, so only data files whose mtime or
+size changed (usually just the current month) are parsed again.
+'''
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shlex
+import sys
+from array import array
+from datetime import datetime, timedelta
+from intervalstore import ACTIVE, IntervalStore
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+DATA_FILE_SUFFIX = '.data'
+# Interval files; undo.data, tags.data and backlog.data share the suffix
+MONTH_FILE_PATTERN = re.compile(r'^\d{4}-\d{2}' + re.escape(DATA_FILE_SUFFIX) + '$')
+CACHE_DIRECTORY = "~/.cache/tw_text_reporter"
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Bump when the segment layout changes
+SEGMENT_VERSION = 1
+
+def data_directory():
+    ''' Locate the Timewarrior data directory, None if there is none '''
+
+    candidates = []
+    if os.environ.get('TIMEWARRIORDB'):
+        candidates.append(os.path.join(os.environ['TIMEWARRIORDB'], 'data'))
+    candidates.append(os.path.expanduser('~/.timewarrior/data'))
+    candidates.append(os.path.join(os.environ.get('XDG_DATA_HOME',
+                                                  os.path.expanduser('~/.local/share')),
+                                   'timewarrior', 'data'))
+
+    for candidate in candidates:
+        if os.path.isdir(candidate):
+            return candidate
+
+    return None
+
+def add_months(day: datetime, months: int) -> datetime:
+    ''' First of the month, months away from day's month '''
+
+    month = day.year * 12 + day.month - 1 + months
+
+    return day.replace(year=month // 12, month=month % 12 + 1, day=1)
+
+def resolve_range(duration: str, now=None):
+    '''
+    Turn a Timewarrior range hint (day, week, lastyear, ...) into a
+    (start, end) pair of local datetimes, None if the hint is not supported
+    '''
+
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    monday = today - timedelta(days=today.weekday())
+    month = today.replace(day=1)
+    quarter = add_months(month, -((month.month - 1) % 3))
+    year = month.replace(month=1)
+
+    ranges = {
+        'day': (today, today + timedelta(days=1)),
+        'today': (today, today + timedelta(days=1)),
+        'yesterday': (today - timedelta(days=1), today),
+        'week': (monday, monday + timedelta(days=7)),
+        'lastweek': (monday - timedelta(days=7), monday),
+        'fortnight': (monday - timedelta(days=7), monday + timedelta(days=7)),
+        'month': (month, add_months(month, 1)),
+        'lastmonth': (add_months(month, -1), month),
+        'quarter': (quarter, add_months(quarter, 3)),
+        'lastquarter': (add_months(quarter, -3), quarter),
+        'year': (year, add_months(year, 12)),
+        'lastyear': (add_months(year, -12), year),
+    }
+
+    return ranges.get(duration.lstrip(':'))
+
+def month_files(data_dir, start: datetime, end: datetime) -> list:
+    ''' Data files for the months touched by [start, end) that exist '''
+
+    files = []
+    month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while month < end:
+        path = os.path.join(data_dir, month.strftime('%Y-%m') + DATA_FILE_SUFFIX)
+        if os.path.exists(path):
+            files.append(path)
+        month = add_months(month, 1)
+
+    return files
+
+def parse_tags(text: str) -> list:
+    ''' Tags after the '#' of a data line, dropping any trailing annotation '''
+
+    if '"' not in text and '\\' not in text:
+        words = text.split()
+    else:
+        words = shlex.split(text)
+
+    if '#' in words:
+        words = words[:words.index('#')]
+
+    return words
+
+def parse_line(line: str):
+    '''
+    Parse one "inc" line into (start, end, tags) timestamp strings,
+    end is None for a running interval
+    '''
+
+    if not line.startswith('inc '):
+        return None
+
+    body, _, tag_text = line[4:].partition(' # ')
+    fields = body.split()
+
+    start = fields[0]
+    end = fields[2] if len(fields) >= 3 and fields[1] == '-' else None
+
+    return start, end, parse_tags(tag_text) if tag_text else []
+
+def iter_data_file(path):
+    ''' Memory-map a data file and yield its parsed intervals '''
+
+    with open(path, 'rb') as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for raw in iter(mapped.readline, b''):
+                parsed = parse_line(raw.decode('utf-8').rstrip('\n'))
+                if parsed is not None:
+                    yield parsed
+
+def parse_data_file(path) -> IntervalStore:
+    ''' All intervals of one data file, ids numbered from 1 in file order '''
+
+    segment = IntervalStore()
+    for position, (start, end, tags) in enumerate(iter_data_file(path), 1):
+        segment.append(position, start, end, tags or [''])
+
+    return segment
+
+def file_signature(path):
+    ''' (mtime, size) of a file '''
+
+    stat = os.stat(path)
+
+    return stat.st_mtime_ns, stat.st_size
+
+class SegmentCache:
+    '''
+    On-disk cache of parsed data files, one binary segment per month
+
+    A segment is a JSON header line followed by the raw id/start/end/tag id
+    arrays. It is only used while the source file's mtime and size match;
+    the least recently used segments are evicted beyond max_bytes.
+    '''
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=CACHE_MAX_BYTES):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def segment_path(self, path) -> str:
+        ''' Cache file for a data file, distinct per data directory '''
+
+        source = os.path.abspath(path)
+        prefix = hashlib.sha1(os.path.dirname(source).encode('utf-8')).hexdigest()[:10]
+
+        return os.path.join(self.directory, f"{prefix}-{os.path.basename(source)}.seg")
+
+    def load(self, path, signature):
+        ''' Cached IntervalStore for a data file, None if missing or stale '''
+
+        segment_path = self.segment_path(path)
+        try:
+            with open(segment_path, 'rb') as handle:
+                header = json.loads(handle.readline())
+                body = handle.read()
+        except (OSError, ValueError):
+            return None
+
+        if header.get('version') != SEGMENT_VERSION or \
+                header.get('byteorder') != sys.byteorder or \
+                header.get('signature') != list(signature):
+            return None
+
+        segment = IntervalStore()
+        count = header['count']
+        offset = 0
+        for column, typecode in (('ids', 'q'), ('starts', 'q'), ('ends', 'q'),
+                                 ('tag_ids', 'i')):
+            values = array(typecode)
+            size = count * values.itemsize
+            values.frombytes(body[offset:offset + size])
+            offset += size
+            setattr(segment, column, values)
+        segment.tag_sets = [tuple(tags) for tags in header['tag_sets']]
+        segment.tag_set_ids = {tags: tag_id for tag_id, tags in enumerate(segment.tag_sets)}
+
+        # Touch for least-recently-used eviction
+        os.utime(segment_path)
+
+        return segment
+
+    def save(self, path, signature, segment: IntervalStore):
+        ''' Write a segment atomically, then evict down to max_bytes '''
+
+        segment_path = self.segment_path(path)
+        header = {
+            'version': SEGMENT_VERSION,
+            'byteorder': sys.byteorder,
+            'signature': list(signature),
+            'count': len(segment),
+            'tag_sets': segment.tag_sets
+        }
+
+        temporary = segment_path + '.tmp'
+        with open(temporary, 'wb') as handle:
+            handle.write(json.dumps(header).encode('utf-8') + b'\n')
+            for column in (segment.ids, segment.starts, segment.ends, segment.tag_ids):
+                handle.write(column.tobytes())
+        os.replace(temporary, segment_path)
+
+        self.evict()
+
+    def evict(self):
+        ''' Remove least recently used segments while over max_bytes '''
+
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.seg'):
+                stat = os.stat(os.path.join(self.directory, name))
+                segments.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in segments)
+        for _, size, name in sorted(segments):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        ''' Drop every cached segment '''
+
+        for name in os.listdir(self.directory):
+            if name.endswith('.seg'):
+                os.remove(os.path.join(self.directory, name))
+
+def load_data_file(path, cache=None) -> IntervalStore:
+    ''' Parsed data file, through the cache when one is given '''
+
+    if cache is None:
+        return parse_data_file(path)
+
+    signature = file_signature(path)
+    segment = cache.load(path, signature)
+    if segment is None:
+        logging.debug("parsing %s", path)
+        segment = parse_data_file(path)
+        cache.save(path, signature, segment)
+
+    return segment
+
+def count_intervals(path) -> int:
+    ''' Number of intervals in a data file '''
+
+    with open(path, 'rb') as handle:
+        data = handle.read()
+
+    return data.count(b'\ninc ') + (1 if data.startswith(b'inc ') else 0)
+
+def read_intervals(duration: str, data_dir=None, cache=None):
+    '''
+    IntervalStore of the intervals overlapping a range hint, None if the
+    range or data directory cannot be resolved
+    '''
+
+    data_dir = data_dir or data_directory()
+    time_range = resolve_range(duration)
+    if data_dir is None or time_range is None:
+        return None
+
+    range_start, range_end = (int(edge.timestamp()) for edge in time_range)
+
+    # Long intervals can start in the month before the range
+    files = month_files(data_dir, add_months(time_range[0], -1), time_range[1])
+    logging.debug("data files: %s", files)
+
+    store = IntervalStore()
+    position = 0
+    for path in files:
+        segment = load_data_file(path, cache)
+        for index, start in enumerate(segment.starts):
+            end = segment.ends[index]
+            if start < range_end and (end == ACTIVE or end > range_start):
+                store.append_epoch(position + index + 1, start, end,
+                                   segment.tag_sets[segment.tag_ids[index]])
+        position += len(segment)
+
+    # Like `timew export`, @1 is the most recent interval in the database
+    if len(store):
+        newest = position + sum(count_intervals(os.path.join(data_dir, name))
+                                for name in os.listdir(data_dir)
+                                if MONTH_FILE_PATTERN.match(name) and
+                                name > os.path.basename(files[-1]))
+        for index, read_position in enumerate(store.ids):
+            store.ids[index] = newest - read_position + 1
+
+    return store
@@ -11,125 +11,547 @@ __email__ = "locutus@the-collective.net"
 __status__ = "Production"
 
 
-import subprocess
-import json
 import logging
 import argparse
-from datetime import datetime, timedelta
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+import instrument
+from intervalstore import ACTIVE, GROUPINGS, REPORT_GROUPINGS, IntervalStore, \
+    format_seconds, parse_stamp
 
 
 DURATION = ":lastyear"
 CLI_BASE_COMMAND = 'timew'
+# Seconds before a hung timew is killed
+CLI_TIMEOUT = 120
+# auto: read the data files when possible, else fall back to `timew export`
+BACKENDS = ['auto', 'native', 'export']
+# How search terms are compared with the tags of an interval
+MATCH_MODES = ['substring', 'token', 'regex']
+REPORT_FORMATS = ['table', 'csv', 'json']
+# Bytes read from the timew pipe at a time in --stream mode
+STREAM_CHUNK_SIZE = 64 * 1024
 LOGGING_LEVEL = logging.ERROR
 LOGGING_FORMAT = '[%(levelname)s] %(asctime)s - %(funcName)s %(lineno)d - %(message)s'
 
+def tag_tokens(tags: str) -> set:
+    ''' Whole tags and words of a lower cased ", " joined tag string '''
+
+    return {token for token in set(tags.split(', ')) | set(re.split(r'[\s,]+', tags)) if token}
+
+def term_matcher(term: str, match='substring'):
+    ''' Predicate testing a lower cased ", " joined tag string against one term '''
+
+    if match == 'token':
+        token = term.lower()
+        return lambda tags: token in tag_tokens(tags)
+    if match == 'regex':
+        return re.compile(term, re.IGNORECASE).search
+
+    text = term.lower()
+    return lambda tags: text in tags
+
+def iter_json_array(chunks):
+    '''
+    Incrementally decode a top level JSON array from text chunks,
+    yielding each element as soon as it is complete
+    '''
+
+    import json # pylint: disable=import-outside-toplevel
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    chunks = iter(chunks)
+    exhausted = False
+
+    while True:
+        # Skip whitespace and the array punctuation between elements
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+            if buffer[position] == '[':
+                started = True
+            position += 1
+
+        if position < len(buffer) and buffer[position] == ']' and started:
+            return
+
+        if position < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+            else:
+                # A number or literal at the end of the buffer may continue in the next chunk
+                if exhausted or end < len(buffer) or isinstance(item, (dict, list, str)):
+                    yield item
+                    position = end
+                    continue
+
+        if exhausted:
+            # A started array only ends at its ], a killed export stops anywhere
+            if buffer[position:].strip() or started:
+                raise ValueError("truncated JSON array")
+            return
+
+        # Drop consumed text so the buffer never holds more than one element
+        buffer = buffer[position:]
+        position = 0
+        try:
+            buffer += next(chunks)
+        except StopIteration:
+            exhausted = True
+
+class TagIndex:
+    '''
+    Inverted index from tag text to positions in a task list
+
+    Substring and regex queries only scan the distinct tag combinations
+    (a few hundred even for years of data) and every query is memoized.
+    '''
+
+    def __init__(self, store: IntervalStore):
+        self.by_tags = {}
+        self.by_token = {}
+        self.cache = {}
+
+        for tag_id, positions in enumerate(store.positions_by_tag_set()):
+            tags = ', '.join(store.tag_sets[tag_id]).lower()
+            self.by_tags.setdefault(tags, []).extend(positions)
+
+        for tags, positions in self.by_tags.items():
+            for token in tag_tokens(tags):
+                self.by_token.setdefault(token, set()).update(positions)
+
+    def lookup(self, term: str, match='substring') -> frozenset:
+        ''' Positions of tasks whose tags match a single term '''
+
+        key = (match, term.lower())
+        if key not in self.cache:
+            if match == 'token':
+                positions = self.by_token.get(term.lower(), ())
+            else:
+                matcher = term_matcher(term, match)
+                positions = [position for tags, found in self.by_tags.items()
+                             if matcher(tags) for position in found]
+            self.cache[key] = frozenset(positions)
+
+        return self.cache[key]
+
+    def search(self, terms: list, match='substring', require_all=False):
+        ''' Combine several terms with OR (default) or AND, returns (positions, per term) '''
+
+        per_term = {term: self.lookup(term, match) for term in terms}
+        sets = list(per_term.values()) or [frozenset()]
+
+        if require_all:
+            combined = frozenset.intersection(*sets)
+        else:
+            combined = frozenset.union(*sets)
+
+        return combined, per_term
+
 class TwReporter:
     ''' Collect list of tasks functions for reporting '''
 
     no_of_tasks_tracked = 0
-    todays_tasks = None
+    store = None
+    tag_index = None
+    profiler = instrument.NULL_PROFILER
 
     @staticmethod
-    def execute_cli(cli: list) -> str:
-        ''' Execute commands on CLI returns STDOUT '''
+    def execute_cli(cli: list, sources=()) -> str:
+        '''
+        Execute commands on CLI returns STDOUT; repeated calls with unchanged
+        sources are answered from the session cache
+        '''
 
-        logging.debug("cli: %s", cli)
+        import cmdrunner # pylint: disable=import-outside-toplevel
 
-        process = subprocess.Popen(cli, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+        return cmdrunner.run(cli, timeout=CLI_TIMEOUT, cache=cmdrunner.SESSION_CACHE,
+                             sources=sources).stdout
 
-        logging.debug("stdout: %s", stdout)
-        logging.debug("stderr: %s", stderr)
+    @staticmethod
+    def stream_cli(cli: list, chunk_size=STREAM_CHUNK_SIZE):
+        ''' Execute commands on CLI, yielding STDOUT as text chunks while it runs '''
+
+        import cmdrunner # pylint: disable=import-outside-toplevel
+
+        return cmdrunner.stream(cli, timeout=CLI_TIMEOUT, chunk_size=chunk_size)
 
-        return stdout
+    def stream_tasks(self, duration: str):
+        ''' Yield task dicts from `timew export` as they are parsed '''
+
+        cli = [CLI_BASE_COMMAND, 'export', ':'+duration]
+
+        for task_item in iter_json_array(self.stream_cli(cli)):
+            start = parse_stamp(task_item['start'])
+            end = parse_stamp(task_item['end']) if 'end' in task_item else ACTIVE
+
+            task = {
+                'starttime': IntervalStore.naive_utc(start),
+                'id': task_item['id'],
+                'tag': task_item.get('tags', [''])
+            }
+            if end == ACTIVE:
+                task['duration'] = 'Active'
+                task['seconds'] = int(time.time()) - start
+            else:
+                task['stoptime'] = IntervalStore.naive_utc(end)
+                task['duration'] = task['stoptime'] - task['starttime']
+                task['seconds'] = end - start
 
+            yield task
 
-    def collect_tasks_list(self, duration='day') -> int:
+    def stream_search(self, duration: str, terms: list, match='substring',
+                      require_all=False, quiet=False):
         '''
-        Collect list of tracked tasks (default to today)
-        Store in object variable
+        Match and total intervals while `timew export` is still running,
+        printing each match as it arrives
 
-        return number of tasks
+        return (total duration, {term: duration})
         '''
 
-        table_dict = []
-        date_format = "%Y%m%dT%H%M%SZ"
+        matchers = {term: term_matcher(term, match) for term in terms}
+        combine = all if require_all else any
+        total = 0
+        per_term = dict.fromkeys(terms, 0)
+
+        for task in self.stream_tasks(duration):
+            self.no_of_tasks_tracked += 1
+            self.profiler.count('records')
+            tags = ', '.join(task['tag']).lower()
+            hits = [term for term, matcher in matchers.items() if matcher(tags)]
 
+            for term in hits:
+                per_term[term] += task['seconds']
+            if combine(term in hits for term in terms):
+                total += task['seconds']
+                if not quiet:
+                    self.print_tasks([task])
+
+        return timedelta(seconds=total), \
+            {term: timedelta(seconds=seconds) for term, seconds in per_term.items()}
+
+    def export_tasks(self, duration: str) -> list:
+        ''' Intervals from `timew export` '''
+
+        import json # pylint: disable=import-outside-toplevel
+        import timewdata # pylint: disable=import-outside-toplevel
 
         cli = [CLI_BASE_COMMAND, 'export', ':'+duration]
-        logging.debug("cli: %s", cli)
+        data_dir = timewdata.data_directory()
 
-        stdout = self.execute_cli(cli)
+        with self.profiler.phase('subprocess'):
+            stdout = self.execute_cli(cli, [data_dir] if data_dir else ())
+        self.profiler.count('bytes', len(stdout))
 
-        task_list = json.loads(stdout)
+        with self.profiler.phase('parse'):
+            return json.loads(stdout)
 
-        for task_item in task_list:
-            task = {}
+    def collect_tasks_list(self, duration='day', backend='auto', cache=None) -> int:
+        '''
+        Collect list of tracked tasks (default to today)
+        Store in object variable
 
-            task['starttime'] = datetime.strptime(task_item['start'], date_format)
+        return number of tasks
+        '''
 
-            # Calculate Duration (skip or active)
-            if 'end' in task_item.keys():
-                task['stoptime'] = datetime.strptime(task_item['end'], date_format)
-                task['duration'] = task['stoptime'] - task['starttime']
-            else:
-                task['duration'] = 'Active'
+        import timewdata # pylint: disable=import-outside-toplevel
+
+        store = None
+        if backend in ('auto', 'native'):
+            with self.profiler.phase('parse'):
+                store = timewdata.read_intervals(duration, cache=cache)
+            if store is None:
+                if backend == 'native':
+                    if timewdata.data_directory() is None:
+                        raise ValueError("no Timewarrior data directory found "
+                                         "(set TIMEWARRIORDB)")
+                    raise ValueError(f"range :{duration} cannot be read from the data files, "
+                                     "use --backend export")
+                logging.debug("Falling back to timew export")
+
+        if store is None:
+            task_items = self.export_tasks(duration)
+            store = IntervalStore()
+            with self.profiler.phase('parse'):
+                for task_item in task_items:
+                    store.append(task_item['id'], task_item['start'], task_item.get('end'),
+                                 task_item.get('tags', ['']))
+
+        self.store = store
+        self.no_of_tasks_tracked = len(store)
+        self.profiler.count('records', len(store))
+        with self.profiler.phase('index'):
+            self.tag_index = TagIndex(store)
 
-            task['id'] = task_item['id']
-            task['tag'] = task_item.get('tags', [''])
+        return len(store)
 
-            table_dict.append(task)
+    @property
+    def todays_tasks(self) -> list:
+        ''' Every collected interval as a task dict '''
 
-        self.todays_tasks = table_dict
-        self.no_of_tasks_tracked = len(table_dict)
+        if self.store is None:
+            return None
 
-        return len(table_dict)
+        return self.tasks_at(range(len(self.store)))
+
+    def tasks_at(self, positions) -> list:
+        ''' Tasks for store positions, in their original order '''
+
+        return [self.store.interval(position) for position in sorted(positions)]
 
     def parse_tags_for_text(self, text: str) -> list:
         ''' Parse through list of tasks for specified text '''
 
-        matched_tasks = []
+        return self.tasks_at(self.tag_index.lookup(text))
+
+    def search_tags(self, terms: list, match='substring', require_all=False):
+        '''
+        Match several terms in one pass over the index
+
+        return (matched positions, {term: matched positions})
+        '''
+
+        with self.profiler.phase('classify'):
+            return self.tag_index.search(terms, match, require_all)
+
+    def total_duration(self, positions=None) -> timedelta:
+        ''' Total time of the intervals at positions (default all) as an array sum '''
 
-        for i in self.todays_tasks:
-            if text.lower() in ', '.join(i['tag']).lower():
-                matched_tasks.append(i)
-                print(f"{i['starttime'].strftime('%m/%d/%Y')} - {', '.join(i['tag'])} - {i['duration']}")
+        with self.profiler.phase('aggregate'):
+            return timedelta(seconds=self.store.total_seconds(positions))
 
-        return matched_tasks
+    def rollup(self, by='day', positions=None) -> dict:
+        ''' Tracked time per day/week/month/tag of the intervals at positions '''
+
+        with self.profiler.phase('aggregate'):
+            return self.store.group_sums(by, positions)
+
+    @staticmethod
+    def print_tasks(task_list: list):
+        ''' Display one line per task '''
+
+        for i in task_list:
+            print(f"{i['starttime'].strftime('%m/%d/%Y')} - {', '.join(i['tag'])} - {i['duration']}")
 
     @staticmethod
     def add_durations(task_list: list) -> timedelta:
-        ''' Total all of the time from list of tasks'''
+        ''' Total all of the time from list of tasks (running ones up to now) '''
 
         total_duration = timedelta()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
 
         for i in task_list:
             logging.debug("i['duration']: %s", i['duration'])
-            total_duration += i['duration']
+            if i['duration'] == 'Active':
+                total_duration += now - i['starttime']
+            else:
+                total_duration += i['duration']
 
         return total_duration
 
+    def report(self, groupings=REPORT_GROUPINGS, positions=None) -> dict:
+        ''' Totals for several groupings of the intervals at positions in one pass '''
+
+        with self.profiler.phase('aggregate'):
+            return self.store.rollup(groupings, positions)
+
+def report_rows(rollups: dict) -> list:
+    ''' Flatten rollups to (grouping, tag, period, seconds) rows '''
+
+    rows = []
+    for grouping, totals in rollups.items():
+        for key, seconds in totals.items():
+            if grouping == 'tag-week':
+                tag, period = key
+            elif grouping == 'tag':
+                tag, period = key, ''
+            else:
+                tag, period = '', key
+            rows.append((grouping, tag, period, seconds))
+
+    return rows
+
+def render_report(rollups: dict, output_format='table') -> str:
+    ''' Render rollups as text tables, CSV or JSON '''
+
+    rows = report_rows(rollups)
+
+    if output_format == 'json':
+        import json # pylint: disable=import-outside-toplevel
+        return json.dumps({grouping: [{'tag': tag, 'period': period, 'seconds': seconds,
+                                       'duration': format_seconds(seconds)}
+                                      for row_grouping, tag, period, seconds in rows
+                                      if row_grouping == grouping]
+                           for grouping in rollups}, indent=2)
+
+    if output_format == 'csv':
+        import csv # pylint: disable=import-outside-toplevel
+        import io # pylint: disable=import-outside-toplevel
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['grouping', 'tag', 'period', 'seconds', 'hours'])
+        for grouping, tag, period, seconds in rows:
+            writer.writerow([grouping, tag, period, seconds, round(seconds / 3600, 2)])
+        return output.getvalue()
+
+    from tabulate import tabulate # pylint: disable=import-outside-toplevel
+
+    sections = []
+    for grouping in rollups:
+        headers = {'tag': ['Tag'], 'tag-week': ['Tag', 'Week']}.get(grouping,
+                                                                   [grouping.capitalize()])
+        table = [([tag] if grouping in ('tag', 'tag-week') else []) +
+                 ([period] if grouping != 'tag' else []) +
+                 [format_seconds(seconds), round(seconds / 3600, 2)]
+                 for row_grouping, tag, period, seconds in rows if row_grouping == grouping]
+        sections.append(tabulate(table, headers + ['Time', 'Hours'], tablefmt="simple"))
+
+    return '\n\n'.join(sections)
+
 
 def main():
     ''' Main function '''
 
     parser = argparse.ArgumentParser(description='Search for text')
-    parser.add_argument('search_text', metavar='text', type=str, help='Test to Search')
+    parser.add_argument('search_text', metavar='text', type=str, nargs='*', help='Test to Search')
     parser.add_argument('--tw_duration', '-t', default='lastyear', help='duration to search')
+    parser.add_argument('--backend', '-b', choices=BACKENDS, default='auto',
+                        help='read Timewarrior data files (native) or use timew export')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every data file instead of using the interval cache')
+    parser.add_argument('--cache-dir',
+                        help='where parsed months are cached (default ~/.cache/tw_text_reporter)')
+    parser.add_argument('--cache-size', type=int,
+                        help='maximum cache size in MB (default 64)')
+    parser.add_argument('--terms-file', '-f',
+                        help='file with one extra search term per line')
+    parser.add_argument('--match', '-m', choices=MATCH_MODES, default='substring',
+                        help='compare terms as substrings, whole tags/words or regexes')
+    parser.add_argument('--all', '-a', action='store_true', dest='require_all',
+                        help='intervals must match every term (default: any term)')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='only print the totals')
+    parser.add_argument('--rollup', '-r', choices=GROUPINGS,
+                        help='also print the matched time per day, week, month or tag')
+    parser.add_argument('--report', action='store_true',
+                        help='print totals per tag, day, week, month and tag x week '
+                             '(of the matched intervals, or all without search text)')
+    parser.add_argument('--group-by', default=','.join(REPORT_GROUPINGS),
+                        help='comma separated report groupings: ' + ', '.join(REPORT_GROUPINGS))
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='table',
+                        help='report output format')
+    parser.add_argument('--stream', '-s', action='store_true',
+                        help='match `timew export` output incrementally as it arrives')
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
 
-    print (f"""Searching for {args.search_text}
-During the timeframe: {args.tw_duration}
-    """)
+    terms = list(args.search_text)
+    if args.terms_file:
+        with open(args.terms_file) as handle:
+            terms += [line.strip() for line in handle if line.strip()]
+    if not terms and not args.report:
+        parser.error("no search text given")
+    if args.match == 'regex':
+        for term in terms:
+            try:
+                re.compile(term, re.IGNORECASE)
+            except re.error as err:
+                parser.error(f"invalid regex {term!r}: {err}")
+
+    groupings = [grouping.strip() for grouping in args.group_by.split(',') if grouping.strip()]
+    if set(groupings) - set(REPORT_GROUPINGS):
+        parser.error(f"--group-by takes {', '.join(REPORT_GROUPINGS)}")
+    if args.stream and (args.rollup or args.report):
+        parser.error("--rollup/--report need the collected intervals, "
+                     "they cannot be used with --stream")
+
     logging.basicConfig(level=LOGGING_LEVEL, format=LOGGING_FORMAT)
 
     twrep = TwReporter()
+    twrep.profiler = instrument.from_args('tw_text_reporter', args)
+
+    try:
+        report(twrep, args, terms, groupings)
+    finally:
+        twrep.profiler.finish(backend='stream' if args.stream else args.backend)
+
+def abort(error):
+    ''' Print a one line error, such as a failed `timew export`, and exit 1 '''
+
+    print(f"tw_text_reporter: {error}", file=sys.stderr)
+    sys.exit(1)
+
+def report(twrep, args, terms, groupings):
+    ''' Run the search or report the command line asked for '''
+
+    profiler = twrep.profiler
+
+    if not args.report:
+        print (f"""Searching for {', '.join(terms)}
+During the timeframe: {args.tw_duration}
+    """)
 
-    twrep.collect_tasks_list(duration=args.tw_duration)
-    matched_tasks = twrep.parse_tags_for_text(args.search_text)
-    total_duration = twrep.add_durations(matched_tasks)
+    # Loaded after the header so a search starts printing before the data code is imported
+    import cmdrunner # pylint: disable=import-outside-toplevel
+    import timewdata # pylint: disable=import-outside-toplevel
+
+    if args.stream:
+        try:
+            with profiler.phase('stream'):
+                total_duration, per_term = twrep.stream_search(args.tw_duration, terms,
+                                                               args.match, args.require_all,
+                                                               args.quiet)
+        except (ValueError, cmdrunner.CommandError) as err:
+            abort(err)
+        print("")
+        if len(terms) > 1:
+            for term, duration in per_term.items():
+                print(f"{term}: {duration}")
+            print("")
+        print(f"Total Time Tracked: {total_duration}")
+        return
+
+    cache = None
+    if not args.no_cache:
+        cache_size = args.cache_size * 1024 * 1024 if args.cache_size is not None \
+            else timewdata.CACHE_MAX_BYTES
+        cache = timewdata.SegmentCache(args.cache_dir or timewdata.CACHE_DIRECTORY, cache_size)
+
+    try:
+        twrep.collect_tasks_list(duration=args.tw_duration, backend=args.backend, cache=cache)
+    except (ValueError, cmdrunner.CommandError) as err:
+        abort(err)
+
+    if args.report:
+        matched = None
+        if terms:
+            matched, _ = twrep.search_tags(terms, args.match, args.require_all)
+        rollups = twrep.report(groupings, matched)
+        with profiler.phase('render'):
+            print(render_report(rollups, args.format))
+        return
+
+    matched, per_term = twrep.search_tags(terms, args.match, args.require_all)
+    if not args.quiet:
+        with profiler.phase('render'):
+            twrep.print_tasks(twrep.tasks_at(matched))
+    total_duration = twrep.total_duration(matched)
     print("")
+    if len(terms) > 1:
+        for term, positions in per_term.items():
+            print(f"{term}: {twrep.total_duration(positions)}")
+        print("")
+    if args.rollup:
+        for key, seconds in twrep.rollup(args.rollup, matched).items():
+            print(f"{key}: {format_seconds(seconds)}")
+        print("")
     print(f"Total Time Tracked: {total_duration}")
 
 ####### Start Main Function #############
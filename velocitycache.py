@@ -0,0 +1,112 @@
+'''
+On-disk cache of computed velocity for completed weeks
+
+A week that has ended no longer changes, so its per day work/admin/focus/
+free minutes are stored keyed by ISO week plus a hash of the settings that
+decide how events are classified. Changing ADMINMEETINGS, FOCUSTIME,
+IGNOREEVENTS, DAILYADJUST or the calendar source gives a new key, so stale
+results are never read; the least recently used weeks are evicted beyond
+max_weeks.
+'''
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+
+__author__ = "Ben Mason"
+__copyright__ = "Copyright 2022"
+__version__ = "1.0.0"
+__email__ = "locutus@the-collective.net"
+__status__ = "Production"
+
+WEEK_CACHE_FILENAME = "~/.cache/velocity-weeks.sqlite"
+WEEK_CACHE_MAX_WEEKS = 520
+
+def config_hash(*settings) -> str:
+    ''' Content hash of the classification settings '''
+
+    content = json.dumps(settings, sort_keys=True, default=str)
+
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+class WeekCache:
+    ''' Per week velocity results keyed by (ISO week, config hash) '''
+
+    def __init__(self, filename=WEEK_CACHE_FILENAME, max_weeks=WEEK_CACHE_MAX_WEEKS):
+        ''' Open (or create) the cache database '''
+
+        filename = os.path.expanduser(filename)
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        self.max_weeks = max_weeks
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS weeks (
+                                week TEXT NOT NULL,
+                                config TEXT NOT NULL,
+                                usage TEXT NOT NULL,
+                                used_at REAL NOT NULL,
+                                PRIMARY KEY (week, config))''')
+        self.conn.commit()
+
+    def load(self, weeks: list, config: str) -> dict:
+        ''' Cached {week: usage} for the given weeks, misses left out '''
+
+        if not weeks:
+            return {}
+
+        found = {
+            week : json.loads(usage)
+            for week, usage in self.conn.execute(
+                f"SELECT week, usage FROM weeks WHERE config = ? "
+                f"AND week IN ({','.join('?' * len(weeks))})", [config] + list(weeks))
+        }
+
+        # Touch for least-recently-used eviction
+        with self.conn:
+            self.conn.executemany('UPDATE weeks SET used_at = ? WHERE week = ? AND config = ?',
+                                  [(time.time(), week, config) for week in found])
+        logging.debug("week cache: %s of %s weeks cached", len(found), len(weeks))
+
+        return found
+
+    def save(self, results: dict, config: str):
+        ''' Store {week: usage} in one transaction, then evict down to max_weeks '''
+
+        if not results:
+            return
+
+        with self.conn:
+            self.conn.executemany('''INSERT OR REPLACE INTO weeks (week, config, usage, used_at)
+                                     VALUES (?, ?, ?, ?)''',
+                                  [(week, config, json.dumps(usage), time.time())
+                                   for week, usage in results.items()])
+        self.evict()
+
+    def evict(self):
+        ''' Remove least recently used weeks while over max_weeks '''
+
+        with self.conn:
+            self.conn.execute('''DELETE FROM weeks WHERE rowid NOT IN
+                                 (SELECT rowid FROM weeks ORDER BY used_at DESC LIMIT ?)''',
+                              (self.max_weeks,))
+
+    def invalidate(self, weeks=None) -> int:
+        ''' Forget the given weeks (every week by default), returns rows removed '''
+
+        with self.conn:
+            if weeks is None:
+                cursor = self.conn.execute('DELETE FROM weeks')
+            else:
+                cursor = self.conn.executemany('DELETE FROM weeks WHERE week = ?',
+                                               [(week,) for week in weeks])
+
+        return cursor.rowcount
+
+    def close(self):
+        ''' Close the database '''
+
+        self.conn.close()